@@ -0,0 +1,120 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+from main import setup_logging
+
+# Runs the bot as a cluster of processes, each running a range of the shards.
+# The shard count is SHARD_COUNT, or the count recommended by Discord. The shards are spread over CLUSTER_PROCESSES
+# processes (default: one per CPU), which share their configs through the CONFIG_STORE database.
+# Crashed processes are restarted with an increasing delay. Start with `python cluster.py`.
+
+log = logging.getLogger("cluster")
+
+gateway_url = "https://discord.com/api/v10/gateway/bot"
+
+
+def split_shards(count: int, processes: int) -> list:
+    """Split the shard ids 0..count-1 into at most `processes` contiguous ranges of nearly equal size."""
+    processes = max(1, min(processes, count))
+    size, rest = divmod(count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < rest else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def recommended_shards(token: str) -> int:
+    request = urllib.request.Request(gateway_url, headers={"Authorization": f"Bot {token}",
+                                                           "User-Agent": "DiscordBot (damabot, 1.0)"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())["shards"]
+
+
+def run_worker(index: int, shard_ids: list, shard_count: int):
+    os.environ["SHARD_IDS"] = ",".join(str(i) for i in shard_ids)
+    os.environ["SHARD_COUNT"] = str(shard_count)
+    # Every process needs its own metrics port
+    if "METRICS_PORT" in os.environ:
+        os.environ["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + index)
+
+    import main
+    main.main()
+
+
+class Cluster:
+
+    def __init__(self, shard_count: int, processes: int):
+        self.shard_count = shard_count
+        self.ranges = split_shards(shard_count, processes)
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = {}
+        self.restarts = [0] * len(self.ranges)
+        self.stopping = False
+
+    def start(self, index: int):
+        shard_ids = self.ranges[index]
+        log.info(f"Starting process {index} with shards {shard_ids[0]}-{shard_ids[-1]} of {self.shard_count}")
+        process = self.context.Process(target=run_worker, args=(index, shard_ids, self.shard_count),
+                                       name=f"shards-{index}")
+        process.start()
+        self.workers[index] = (process, time.monotonic())
+
+    def stop(self, *_):
+        self.stopping = True
+        for process, _ in self.workers.values():
+            if process.is_alive():
+                # bot.run closes the bot cleanly on SIGINT
+                os.kill(process.pid, signal.SIGINT)
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for index in range(len(self.ranges)):
+            if self.stopping:
+                break
+            self.start(index)
+            # Discord allows only one identify per 5 seconds (for bots without large bot sharding)
+            time.sleep(5)
+
+        while not self.stopping:
+            for index, (process, started) in list(self.workers.items()):
+                if process.is_alive() or self.stopping:
+                    continue
+                # Processes that ran for a while count as healthy again
+                if time.monotonic() - started > 300:
+                    self.restarts[index] = 0
+                delay = min(2 ** self.restarts[index], 300)
+                self.restarts[index] += 1
+                log.warning(f"Process {index} exited with {process.exitcode}, restarting in {delay}s")
+                time.sleep(delay)
+                if not self.stopping:
+                    self.start(index)
+            time.sleep(1)
+
+        for process, _ in self.workers.values():
+            process.join(timeout=30)
+
+
+def main():
+    setup_logging()
+    load_dotenv(verbose=True)
+
+    # The processes must share their configs, or e.g. registrations would only be known to one of them
+    os.environ.setdefault("CONFIG_STORE", "1")
+    shard_count = int(os.environ["SHARD_COUNT"]) if "SHARD_COUNT" in os.environ \
+        else recommended_shards(os.environ["DISCORD_TOKEN"])
+    processes = int(os.environ.get("CLUSTER_PROCESSES", os.cpu_count() or 1))
+    Cluster(shard_count, processes).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
-import asyncio
 import importlib.util
+import io
 import json
 import logging
+from typing import Optional
 
-from discord import Guild, Permissions
+from discord import File, Guild, Permissions
 from discord.ext.commands import Bot, Cog, Context, command
 
+from util import handoff, profiler, slash, split_message, tracing
 from util.config import Config
 
 _log = logging.getLogger(__name__)
@@ -72,12 +74,16 @@ class Admin(Cog):
 
     @command(aliases=["r"], hidden=True)
     async def reload(self, ctx: Context, cog: str):
+        """Reload a cog. Cogs that support it keep their in-memory state, see util.handoff."""
         if not cog.startswith("cogs."):
             cog = "cogs." + cog
 
         resolved = importlib.util.find_spec(cog, None)
         if resolved:
-            await ctx.bot.reload_extension(cog)
+            handed_off = await handoff.reload(ctx.bot, cog)
+            dropped = [name for name, kept in handed_off.items() if not kept]
+            if dropped:
+                await ctx.reply(f"Reloaded, but the state of {', '.join(dropped)} was dropped.")
             await self._react_ok(ctx)
         else:
             await ctx.message.add_reaction("\N{BLACK QUESTION MARK ORNAMENT}")
@@ -110,18 +116,53 @@ class Admin(Cog):
             await ctx.message.add_reaction("\N{BLACK QUESTION MARK ORNAMENT}")
 
     @command(hidden=True)
-    async def syncslash(self, ctx: Context):
-        await ctx.bot.tree.sync()
-        await self._react_ok(ctx)
+    async def syncslash(self, ctx: Context, guild: Optional[Guild] = None, force: bool = False):
+        async with ctx.typing():
+            synced = await slash.sync(ctx.bot, guild=guild, force=force)
+
+        if synced:
+            await self._react_ok(ctx)
+        else:
+            await ctx.reply("Slash commands are unchanged, skipped the sync. Add `True` to force it.")
 
     @command(hidden=True)
-    async def clearslash(self, ctx: Context, guild: Guild = None):
+    async def clearslash(self, ctx: Context, guild: Optional[Guild] = None):
         async with ctx.typing():
-            commands = await ctx.bot.tree.fetch_commands(guild=guild)
-            await asyncio.wait([appcommand.delete() for appcommand in commands])
+            await slash.clear(ctx.bot, guild=guild)
 
         await self._react_ok(ctx)
 
+    @command(hidden=True)
+    async def profile(self, ctx: Context, seconds: float = 10.0, memory: bool = False):
+        """Sample the running bot, and reply with the busiest functions and the most awaited coroutines.
+        With memory, the allocations during the profile are compared as well."""
+        seconds = min(max(seconds, 1.0), 300.0)
+        await ctx.message.add_reaction("\N{STOPWATCH}")
+
+        result = await profiler.profile(seconds, memory=memory)
+        report = io.BytesIO(result.report().encode())
+        await ctx.reply(f"Profiled {result.duration:.1f}s.", file=File(report, "profile.txt"))
+
+    @command(hidden=True)
+    async def lag(self, ctx: Context):
+        """Show the event loop lag percentiles, and how often the loop was blocked."""
+        watchdog = ctx.bot.watchdog
+        lags = " | ".join(f"{name}: {value * 1000:.1f}ms" for name, value in watchdog.percentiles().items())
+        await ctx.reply(f"Loop lag over the last {len(watchdog.lags)} samples: {lags}\n"
+                        f"Blocked for over {watchdog.threshold * 1000:.0f}ms: {watchdog.blocked} times")
+
+    @command(hidden=True)
+    async def traces(self, ctx: Context, count: int = 10):
+        """Show the slowest of the recently traced commands, with the time spent per service."""
+        slowest = tracing.slowest(min(max(count, 1), 25))
+        if not slowest:
+            await ctx.reply(f"No traces yet, {tracing.sample_rate:.0%} of the commands are traced.")
+            return
+
+        lines = [f"{trace.duration * 1000:>7.0f}ms  {trace.attributes.get('invocation', trace.name)[:60]}\n"
+                 f"           {trace.summary() or 'no calls'}" for trace in slowest]
+        await split_message("\n".join(lines), ctx, prefix="```\n", suffix="```")
+
     @command(hidden=True)
     async def invite(self, ctx: Context):
         perms = Permissions(create_expressions=True, manage_expressions=True).value
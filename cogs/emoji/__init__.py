@@ -1,19 +1,61 @@
+import asyncio
 import logging
-import unicodedata
 import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 
 import aiohttp
+import discord
 from discord.ext import commands
 from discord.ext.commands import Bot, Cog, Context
 
+import util
+from util.ratelimit import TokenBucket
+from . import transcode
+
 _log = logging.getLogger(__name__)
 
+# Matches custom emojis like <:name:123> and <a:name:123>, and emoji links optionally followed by a name.
+# A name followed by a colon is the scheme of the next link
+_emoji_pattern = re.compile(
+    r"<(?P<animated>a?):(?P<name>\w+):(?P<id>\d+)>"
+    r"|https://cdn\.discordapp\.com/emojis/(?P<link_id>\d+)\.(?P<ext>\w+)\S*(?:[ \t]+(?P<link_name>\w{2,32})\b(?!:))?"
+)
+
 
 async def setup(bot: Bot):
     await bot.add_cog(Emoji())
 
 
 class Emoji(Cog):
+    # Concurrent downloads from the CDN during a bulk import
+    max_downloads = 8
+    # Emoji creations per guild and time span. Discord does not document this limit, stay well below what was observed
+    create_rate = (5, 30.0)
+    # See util.handoff
+    state_version = 1
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._create_buckets = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def cog_load(self) -> None:
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_downloads))
+        # Worker processes are only started on the first oversized image
+        self._pool = ProcessPoolExecutor(max_workers=2)
+
+    async def cog_unload(self) -> None:
+        await self._session.close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def export_state(self) -> dict:
+        # Keep the rate limits of emoji creations, a reload must not allow a new burst
+        return {"create_buckets": self._create_buckets}
+
+    def import_state(self, state: dict):
+        self._create_buckets = state["create_buckets"]
 
     @commands.command(hidden=True)
     async def pyemoji(self, ctx: Context, emoji):
@@ -23,13 +65,14 @@ class Emoji(Cog):
     @commands.has_guild_permissions(manage_emojis=True)
     @commands.command()
     async def yoink(self, ctx: Context, emoji: str, name=""):
-        match = re.match("^<a?:(.+):(\\d+)>$", emoji)
+        match = re.match("^<(a?):(.+):(\\d+)>$", emoji)
 
         if match:
-            name = match.group(1) if not name else name
-            emoji_id = match.group(2)
+            name = match.group(2) if not name else name
+            animated = bool(match.group(1))
+            emoji_id = match.group(3)
         else:
-            match = re.match("^https://cdn\\.discordapp\\.com/emojis/(\\d+)\\..*$", emoji)
+            match = re.match("^https://cdn\\.discordapp\\.com/emojis/(\\d+)\\.(\\w+).*$", emoji)
 
             if not match:
                 await ctx.reply("Please supply an emoji or a link to one.")
@@ -39,14 +82,111 @@ class Emoji(Cog):
                 return
 
             emoji_id = match.group(1)
+            animated = match.group(2) == "gif"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://cdn.discordapp.com/emojis/{emoji_id}") as resp:
-                data = await resp.read()
+        data = await self._fetch(emoji_id, animated)
 
         if not data:
             await ctx.reply("Could not fetch the emoji image.")
             return
 
-        emoji = await ctx.guild.create_custom_emoji(name=name, image=data)
+        async with ctx.typing():
+            try:
+                fitted = await self._fit(data)
+            except OSError:
+                await ctx.reply("The emoji is not an image.")
+                return
+            if not fitted:
+                await ctx.reply("The emoji image is too large, and could not be shrunk enough.")
+                return
+
+            emoji = await self._create(ctx.guild, name, fitted)
         await ctx.reply(str(emoji))
+
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_emojis=True)
+    @commands.command()
+    async def yoinkall(self, ctx: Context, *, emojis: str = ""):
+        """Import all custom emojis from a message. Reply to the message, or paste the emojis.
+        Links to emojis can be followed by a name, else they are named after their ID."""
+        if ctx.message.reference and isinstance(ctx.message.reference.resolved, discord.Message):
+            emojis = ctx.message.reference.resolved.content + " " + emojis
+
+        found = self._parse(emojis)
+        if not found:
+            await ctx.reply("Please supply some emojis, links to them, or reply to a message containing some.")
+            return
+
+        async with ctx.typing():
+            semaphore = asyncio.Semaphore(self.max_downloads)
+
+            async def load(emoji_id: str, animated: bool) -> Tuple[Optional[bytes], str]:
+                """The image, fitted to the size limit, or None and the reason why not."""
+                try:
+                    async with semaphore:
+                        data = await self._fetch(emoji_id, animated)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    data = b""
+                if not data:
+                    return None, "download failed"
+
+                # All images are shrunk in the pool at the same time
+                try:
+                    data = await self._fit(data)
+                except OSError:
+                    return None, "not an image"
+                return (data, "") if data else (None, "too large")
+
+            images = await asyncio.gather(*[load(emoji_id, animated) for _, emoji_id, animated in found])
+
+            created, failed = [], []
+            for (name, _, _), (data, error) in zip(found, images):
+                if not data:
+                    failed.append(f"{name} ({error})")
+                    continue
+
+                try:
+                    created.append(str(await self._create(ctx.guild, name, data)))
+                except discord.HTTPException as e:
+                    failed.append(f"{name} ({e.text or e.status})")
+
+        summary = f"Added {len(created)} of {len(found)} emojis: {' '.join(created)}"
+        if not created:
+            summary = "No emojis added."
+        if failed:
+            summary += "\nFailed: " + ", ".join(failed)
+        await util.split_message(summary, ctx)
+
+    @staticmethod
+    def _parse(text: str) -> List[Tuple[str, str, bool]]:
+        """Return (name, id, animated) for every distinct emoji found in the text."""
+        result = {}
+        for match in _emoji_pattern.finditer(text):
+            if match.group("id"):
+                entry = (match.group("name"), match.group("id"), bool(match.group("animated")))
+            else:
+                emoji_id = match.group("link_id")
+                entry = (match.group("link_name") or f"emoji_{emoji_id}", emoji_id, match.group("ext") == "gif")
+            result.setdefault(entry[1], entry)
+        return list(result.values())
+
+    async def _fetch(self, emoji_id: str, animated: bool) -> bytes:
+        extension = ".gif" if animated else ""
+        async with self._session.get(f"https://cdn.discordapp.com/emojis/{emoji_id}{extension}") as resp:
+            return await resp.read() if resp.ok else b""
+
+    async def _fit(self, data: bytes) -> Optional[bytes]:
+        """Shrink the image in the process pool if it exceeds the emoji size limit, see :func:`transcode.fit`.
+        Raises OSError if the data is not an image Pillow can read."""
+        if len(data) <= transcode.EMOJI_LIMIT:
+            return data
+
+        return await asyncio.get_running_loop().run_in_executor(self._pool, transcode.fit, data)
+
+    async def _create(self, guild: discord.Guild, name: str, data: bytes) -> discord.Emoji:
+        bucket = self._create_buckets.get(guild.id)
+        if not bucket:
+            bucket = self._create_buckets[guild.id] = TokenBucket(*self.create_rate)
+
+        await bucket.acquire()
+        return await guild.create_custom_emoji(name=name, image=data)
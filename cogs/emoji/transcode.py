@@ -0,0 +1,90 @@
+import io
+from typing import Iterator, List, Optional, Tuple
+
+from PIL import Image, ImageSequence
+
+# Image re-encoding for emoji uploads. The functions in here are CPU-bound,
+# so they should be run in a process pool, never on the event loop.
+
+# Maximum file size of a guild emoji
+EMOJI_LIMIT = 256 * 1024
+
+# Emojis are displayed at no more than 128px, so there is no point in keeping more
+_sizes = (128, 96, 64, 48, 32)
+_frame_steps = (1, 2, 3, 4)
+_colors = (256, 128, 64, 32)
+
+
+def fit(data: bytes, limit: int = EMOJI_LIMIT) -> Optional[bytes]:
+    """Return the image unchanged if it is small enough, else the first re-encoded variant that fits into `limit`
+    bytes, or None if there is none. Variants get progressively smaller: first the resolution is reduced,
+    then frames are dropped from animations, then the number of colors is reduced."""
+    if len(data) <= limit:
+        return data
+
+    for variant in variants(data):
+        if len(variant) <= limit:
+            return variant
+    return None
+
+
+def variants(data: bytes) -> Iterator[bytes]:
+    with Image.open(io.BytesIO(data)) as image:
+        animated = getattr(image, "is_animated", False)
+        frames, durations = _load_frames(image) if animated else ([image.convert("RGBA")], [0])
+        loop = image.info.get("loop", 0)
+
+    resized = {}
+
+    def at_size(size: int) -> List[Image.Image]:
+        if size not in resized:
+            resized[size] = [_resize(frame, size) for frame in frames]
+        return resized[size]
+
+    if not animated:
+        for colors in (None,) + _colors:
+            for size in _sizes:
+                image = at_size(size)[0]
+                yield _encode_png(image if not colors else image.quantize(colors, method=Image.Quantize.FASTOCTREE))
+        return
+
+    for colors in _colors:
+        for step in _frame_steps:
+            for size in _sizes:
+                kept, kept_durations = _drop_frames(at_size(size), durations, step)
+                yield _encode_gif(kept, kept_durations, colors, loop)
+
+
+def _load_frames(image: Image.Image) -> Tuple[List[Image.Image], List[int]]:
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        frames.append(frame.convert("RGBA"))
+        durations.append(frame.info.get("duration", 100))
+    return frames, durations
+
+
+def _resize(image: Image.Image, size: int) -> Image.Image:
+    image = image.copy()
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return image
+
+
+def _drop_frames(frames: List[Image.Image], durations: List[int], step: int) -> Tuple[List[Image.Image], List[int]]:
+    """Keep every `step`th frame, and extend its duration by the ones dropped after it, to keep the timing."""
+    kept = frames[::step]
+    kept_durations = [sum(durations[idx:idx + step]) for idx in range(0, len(durations), step)]
+    return kept, kept_durations
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _encode_gif(frames: List[Image.Image], durations: List[int], colors: int, loop: int) -> bytes:
+    quantized = [frame.quantize(colors, method=Image.Quantize.FASTOCTREE) for frame in frames]
+    buffer = io.BytesIO()
+    quantized[0].save(buffer, "GIF", save_all=True, append_images=quantized[1:], duration=durations, loop=loop,
+                      disposal=2, optimize=True)
+    return buffer.getvalue()
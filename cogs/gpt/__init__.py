@@ -1,6 +1,7 @@
 import logging
 import re
-from typing import List, Any, Tuple, Union
+from functools import partial
+from typing import Any, Awaitable, Callable, List, Tuple, Union
 
 import discord
 from discord import Interaction, Message
@@ -9,7 +10,9 @@ from discord.ext.commands import Cog, Bot, Context, hybrid_command, is_owner
 from discord.utils import find
 
 import util
+from cogs.gpt import ai
 from cogs.gpt.ai import AIError
+from cogs.gpt.cache import ResponseCache
 from cogs.gpt.classes import GPTConfig
 
 _log = logging.getLogger(__name__)
@@ -21,11 +24,23 @@ async def setup(bot: Bot):
 
 class GPT(Cog):
     _system_message: List[Union[Tuple[Any, str], None]]
+    # See util.handoff
+    state_version = 1
 
     def __init__(self, bot: Bot) -> None:
         self._config = GPTConfig()
         self._bot = bot
         self._system_message = [None] * 100
+        self._cache = ResponseCache(ttl=self._config.cache_ttl, max_entries=self._config.cache_size)
+
+    async def cog_unload(self) -> None:
+        await ai.close()
+
+    def export_state(self) -> dict:
+        return {"system_message": self._system_message}
+
+    def import_state(self, state: dict):
+        self._system_message = state["system_message"]
 
     @hybrid_command(hidden=True, enabled=False)
     @is_owner()
@@ -34,14 +49,19 @@ class GPT(Cog):
         await ctx.reply(content="Choose the models", view=SettingsView(self._config), ephemeral=True)
 
     @hybrid_command(enabled=False)
-    async def gpt(self, ctx: Context, *, prompt: str):
+    @describe(fresh="Ignore cached answers and ask the AI again")
+    async def gpt(self, ctx: Context, *, prompt: str, fresh: bool = False):
         """Let a GPT-3 AI respond to your prompt. Try \"Tell me a joke!\""""
         async with ctx.typing():
             try:
-                text = await ai.completion(prompt, model=self._config.model, temperature=self._config.temperature,
-                                           max_tokens=self._config.max_tokens,
-                                           presence_penalty=self._config.presence_penalty,
-                                           user=ctx.author.name)
+                text = await self._cached(
+                    partial(ai.completion, prompt, model=self._config.model,
+                            temperature=self._config.temperature,
+                            max_tokens=self._config.max_tokens,
+                            presence_penalty=self._config.presence_penalty,
+                            user=ctx.author.name),
+                    self._config.model, "", prompt, self._config.temperature, fresh
+                )
                 text = f"> {prompt}{text}"
                 await util.split_message(text, ctx)
             except AIError as e:
@@ -65,8 +85,9 @@ class GPT(Cog):
                 await ctx.reply(str(e))
 
     @hybrid_command()
-    @describe(preprompt="A primer message to set the behaviour of the AI")
-    async def chatgpt(self, ctx: Context, *, prompt: str, preprompt=""):
+    @describe(preprompt="A primer message to set the behaviour of the AI",
+              fresh="Ignore cached answers and ask the AI again")
+    async def chatgpt(self, ctx: Context, *, prompt: str, preprompt="", fresh: bool = False):
         """Talk to ChatGPT!"""
         async with ctx.typing():
             if not preprompt:
@@ -76,15 +97,34 @@ class GPT(Cog):
             self._save_system_message(ctx, preprompt)
 
             try:
-                text = await ai.chat_completion(prompt, preprompt, model=self._config.chat_model,
-                                                temperature=self._config.code_temperature,
-                                                presence_penalty=self._config.presence_penalty,
-                                                user=ctx.author.name)
+                text = await self._cached(
+                    partial(ai.chat_completion, prompt, preprompt, model=self._config.chat_model,
+                            temperature=self._config.code_temperature,
+                            presence_penalty=self._config.presence_penalty,
+                            user=ctx.author.name),
+                    self._config.chat_model, preprompt, prompt, self._config.code_temperature, fresh
+                )
                 text = f"> {prompt}\n\n{text}"
                 await util.split_message(text, ctx)
             except AIError as e:
                 await ctx.reply(str(e))
 
+    async def _cached(self, request: Callable[[], Awaitable[str]], model: str, system_message: str, prompt: str,
+                      temperature: float, fresh: bool) -> str:
+        """Serve the response for a deterministic request from the cache, or await the request and cache its result.
+        With `fresh`, the cached response is skipped, but still replaced by the new one."""
+        if not self._cache.cacheable(temperature):
+            return await request()
+
+        key = self._cache.key(model, system_message, prompt, temperature)
+        cached = None if fresh else self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        response = await request()
+        self._cache.put(key, response)
+        return response
+
     def _save_system_message(self, ctx: Context, system_message: str):
         key = ctx.interaction.id if ctx.interaction else ctx.message.id
         self._system_message.pop()
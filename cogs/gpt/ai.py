@@ -1,36 +1,45 @@
-import asyncio
+from typing import AsyncIterator, Optional
 
-import openai
+from cogs.gpt import providers
+from cogs.gpt.providers import AIError, Provider
 
+_provider: Optional[Provider] = None
 
-async def completion(prompt, *, model: str = "text-davinci-003", **kwargs):
-    try:
-        completion = await asyncio.to_thread(openai.Completion.create, prompt=prompt, model=model, **kwargs)
-        return completion.choices[0].text
-    except openai.error.OpenAIError as e:
-        raise AIError(str(e))
 
+def get_provider() -> Provider:
+    global _provider
+    if not _provider:
+        _provider = providers.from_env()
+    return _provider
 
-async def history_completion(history, *, model: str = "gpt-3.5-turbo", **kwargs):
-    try:
-        completion = openai.ChatCompletion.create(
-            model=model,
-            messages=history,
-            **kwargs
-        )
-        return completion.choices[0].message.content
-    except openai.error.OpenAIError as e:
-        raise AIError(str(e))
 
+def set_provider(provider: Optional[Provider]):
+    """Replace the provider used by all functions of this module. With `None`, it is recreated from the environment."""
+    global _provider
+    _provider = provider
 
-async def chat_completion(prompt, system_message, *, model: str = "gpt-3.5-turbo", **kwargs):
+
+async def close():
+    if _provider:
+        await _provider.close()
+
+
+async def completion(prompt, *, model: str = "text-davinci-003", **kwargs) -> str:
+    return await get_provider().completion(prompt, model=model, **kwargs)
+
+
+async def history_completion(history, *, model: str = "gpt-3.5-turbo", **kwargs) -> str:
+    return await get_provider().chat(history, model=model, **kwargs)
+
+
+def stream_history_completion(history, *, model: str = "gpt-3.5-turbo", **kwargs) -> AsyncIterator[str]:
+    return get_provider().stream_chat(history, model=model, **kwargs)
+
+
+async def chat_completion(prompt, system_message, *, model: str = "gpt-3.5-turbo", **kwargs) -> str:
     messages = [
         {"role": "system", "content": system_message},
         {"role": "user", "content": prompt},
     ]
 
     return await history_completion(messages, model=model, **kwargs)
-
-
-class AIError(Exception):
-    pass
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Optional
+
+from util import metrics
+from util.config import Config
+
+_log = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Size-bounded LRU cache for AI responses, persisted as a :class:`Config` file in the data directory.
+
+    Only deterministic requests (temperature 0) are cached, as any other setting is expected to produce
+    a different answer for every call. Entries expire after ``ttl`` seconds. A ``max_entries`` of 0 disables the cache.
+    """
+
+    def __init__(self, name: str = "ai_cache", *, ttl: int, max_entries: int):
+        self._config = Config(name)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(model: str, system_message: str, prompt: str, temperature: float) -> str:
+        raw = json.dumps([model, system_message, prompt, float(temperature)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.enabled and float(temperature) == 0
+
+    def get(self, key: str) -> Optional[str]:
+        entries = self._config.data
+        entry = entries.pop(key, None)
+
+        if entry is None or time.time() - entry["time"] > self.ttl:
+            self.misses += 1
+            metrics.cache_lookup("ai", hit=False)
+            return None
+
+        # Re-insert to mark the entry as recently used, the order is persisted with the next put()
+        entries[key] = entry
+        self.hits += 1
+        metrics.cache_lookup("ai", hit=True)
+        return entry["response"]
+
+    def put(self, key: str, response: str):
+        entries = self._config.data
+        entries.pop(key, None)
+        entries[key] = {"time": time.time(), "response": response}
+
+        # Dicts keep insertion order, so the least recently used entries come first
+        while len(entries) > self.max_entries:
+            del entries[next(iter(entries))]
+
+        self._config.save()
+
+    def clear(self):
+        self._config.data.clear()
+        self._config.save()
@@ -10,6 +10,8 @@ class GPTConfig(Config):
     code_temperature: float
     max_tokens: int
     presence_penalty: float
+    cache_size: int
+    cache_ttl: int
 
     def __init__(self):
         super().__init__("ai")
@@ -23,3 +25,6 @@ class GPTConfig(Config):
         self.code_temperature = 0.1
         self.max_tokens = 512
         self.presence_penalty = 0.5
+        # Caching only applies to requests with a temperature of 0, a cache_size of 0 disables it
+        self.cache_size = 0
+        self.cache_ttl = 7 * 24 * 60 * 60
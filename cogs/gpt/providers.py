@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Callable, List, Optional
+
+import aiohttp
+
+from util import metrics
+
+_log = logging.getLogger(__name__)
+
+
+class AIError(Exception):
+    pass
+
+
+# Responses that are no json, or json without the expected fields
+_invalid_response = (aiohttp.ContentTypeError, json.JSONDecodeError, KeyError, IndexError, TypeError)
+
+
+class Provider(ABC):
+    """Interface for the backends that generate the AI responses. Implementations must be safe to share
+    between all commands, and release their resources in :meth:`close`. All errors are raised as AIError."""
+
+    @abstractmethod
+    async def completion(self, prompt: str, *, model: str, **kwargs) -> str:
+        ...
+
+    @abstractmethod
+    async def chat(self, messages: List[dict], *, model: str, **kwargs) -> str:
+        ...
+
+    @abstractmethod
+    def stream_chat(self, messages: List[dict], *, model: str, **kwargs) -> AsyncIterator[str]:
+        """Yield the response in chunks of text, as they are generated."""
+        ...
+
+    async def close(self):
+        pass
+
+
+class HTTPProvider(Provider):
+    """Provider for OpenAI-compatible HTTP APIs. All requests share one connection pool, are subject to a timeout,
+    and are retried with exponential backoff on connection errors, rate limits and server errors."""
+
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url: str, api_key: str = "", *, timeout: float = 60, retries: int = 2,
+                 max_connections: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # The session has to be created from within the event loop, so do it on first use
+        if not self._session or self._session.closed:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._session = aiohttp.ClientSession(
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        return self._session
+
+    async def completion(self, prompt: str, *, model: str, **kwargs) -> str:
+        return await self._post("/completions", {"model": model, "prompt": prompt, **kwargs},
+                                lambda data: data["choices"][0]["text"])
+
+    async def chat(self, messages: List[dict], *, model: str, **kwargs) -> str:
+        return await self._post("/chat/completions", {"model": model, "messages": messages, **kwargs},
+                                lambda data: data["choices"][0]["message"]["content"])
+
+    async def stream_chat(self, messages: List[dict], *, model: str, **kwargs) -> AsyncIterator[str]:
+        payload = {"model": model, "messages": messages, "stream": True, **kwargs}
+        with metrics.track("openai", "/chat/completions"):
+            resp = await self._request("/chat/completions", payload)
+
+        async with resp:
+            # The response is a stream of server-sent events, each containing one json chunk
+            try:
+                async for line in resp.content:
+                    line = line.strip()
+                    if not line.startswith(b"data:"):
+                        continue
+
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+
+                    delta = json.loads(data)["choices"][0]["delta"]
+                    if delta.get("content"):
+                        yield delta["content"]
+            except _invalid_response as e:
+                raise AIError(f"The AI sent an invalid response: {e.__class__.__name__}") from e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise AIError(f"Could not read the response of the AI: {e.__class__.__name__}") from e
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+    async def _post(self, path: str, payload: dict, extract: Callable[[dict], str]) -> str:
+        """Send the request and return the text that `extract` takes from the json response."""
+        with metrics.track("openai", path):
+            async with await self._request(path, payload) as resp:
+                try:
+                    return extract(await resp.json())
+                except _invalid_response as e:
+                    raise AIError(f"The AI sent an invalid response: {e.__class__.__name__}") from e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    raise AIError(f"Could not read the response of the AI: {e.__class__.__name__}") from e
+
+    async def _request(self, path: str, payload: dict) -> aiohttp.ClientResponse:
+        """Send the request and return the successful response, which must be used as a context manager."""
+        for attempt in range(self.retries + 1):
+            last_try = attempt == self.retries
+
+            try:
+                resp = await self.session.post(self.base_url + path, json=payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last_try:
+                    raise AIError(f"Could not reach the AI: {e.__class__.__name__}")
+                _log.warning("Request to %s failed with %r, retrying", path, e)
+            else:
+                if resp.ok:
+                    return resp
+
+                try:
+                    message = await self._error_message(resp)
+                finally:
+                    resp.release()
+                if last_try or resp.status not in self.retry_statuses:
+                    raise AIError(message)
+                _log.warning("Request to %s failed with status %s, retrying", path, resp.status)
+
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    @staticmethod
+    async def _error_message(resp: aiohttp.ClientResponse) -> str:
+        try:
+            return (await resp.json())["error"]["message"]
+        except (aiohttp.ContentTypeError, json.JSONDecodeError, KeyError, TypeError):
+            return f"The AI responded with an error ({resp.status})."
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise AIError(f"Could not read the response of the AI: {e.__class__.__name__}") from e
+
+
+def from_env() -> Provider:
+    """Create the provider configured by the OPENAI_API_BASE and OPENAI_API_KEY environment variables."""
+    return HTTPProvider(
+        os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1"),
+        os.environ.get("OPENAI_API_KEY", ""),
+        timeout=float(os.environ.get("OPENAI_TIMEOUT", 60))
+    )
@@ -37,6 +37,7 @@ class Artist(NamedBase):
     img_url: str = None
     tags: str = None
     popularity: int = None
+    spotify_id: str = None
     origin: pylast.Artist = None
 
 
@@ -44,6 +45,7 @@ class Track(NamedBase):
     length: int = None
     url: str = None
     popularity: int = None
+    spotify_id: str = None
     origin: pylast.Track = None
 
     def __init__(self):
@@ -76,6 +78,7 @@ class Album(NamedBase):
     url: str = None
     img_url: str = None
     popularity: int = None
+    spotify_id: str = None
     origin: pylast.Album = None
 
     def __init__(self):
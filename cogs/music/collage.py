@@ -0,0 +1,60 @@
+import io
+from typing import List, Optional
+
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+
+# Compositing of album cover collages. Runs in a process pool (see Music.chart), so everything here must be
+# picklable and free of bot state. Covers are passed as paths of the downloaded files, which is cheaper than
+# sending their bytes to the worker process.
+
+# Largest side of the finished collage. Grids above 5x5 use smaller tiles to stay below Discord's upload limit.
+max_width = 1500
+max_tile = 300
+background = (24, 24, 24)
+
+
+def tile_size(grid: int) -> int:
+    return min(max_tile, max_width // grid)
+
+
+def render(paths: List[Optional[str]], captions: List[str], grid: int) -> bytes:
+    """Arrange the covers row by row in a `grid` x `grid` collage and return it as JPEG.
+    Missing or unreadable covers leave their tile empty, with only the caption."""
+    tile = tile_size(grid)
+    collage = Image.new("RGB", (tile * grid, tile * grid), background)
+    draw = ImageDraw.Draw(collage)
+    font = ImageFont.load_default(size=max(10, tile // 16))
+
+    for index, (path, caption) in enumerate(zip(paths, captions)):
+        x, y = (index % grid) * tile, (index // grid) * tile
+        cover = _load(path, tile)
+        if cover:
+            collage.paste(cover, (x, y))
+        if caption:
+            _caption(draw, font, caption, x, y, tile)
+
+    buffer = io.BytesIO()
+    collage.save(buffer, "JPEG", quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+def _load(path: Optional[str], tile: int) -> Optional[Image.Image]:
+    if not path:
+        return None
+    try:
+        with Image.open(path) as image:
+            # Let the JPEG decoder skip most of the work for covers far larger than the tile
+            image.draft("RGB", (tile, tile))
+            return image.convert("RGB").resize((tile, tile), Image.Resampling.BILINEAR)
+    except (OSError, UnidentifiedImageError):
+        return None
+
+
+def _caption(draw: ImageDraw.ImageDraw, font, caption: str, x: int, y: int, tile: int):
+    """Draw the caption on a dark band at the top of the tile, shortened to fit."""
+    margin = max(2, tile // 50)
+    while caption and draw.textlength(caption, font=font) > tile - 2 * margin:
+        caption = caption[:-2] + "…"
+    left, top, right, bottom = draw.textbbox((x + margin, y + margin), caption, font=font)
+    draw.rectangle((x, y, x + tile - 1, bottom + margin), fill=(0, 0, 0))
+    draw.text((x + margin, y + margin), caption, font=font, fill=(255, 255, 255))
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import aiohttp
+
+from util import metrics
+from .identity import normalize
+
+# Async client for the Genius search and song endpoints, on the aiohttp session of the Music cog.
+# Searches are cached by their normalized query, songs by their id, both for `ttl`. Concurrent requests for the same
+# query or song share one request, so a command and the pre-resolution of the same song (see Music.on_presence_update)
+# never search twice.
+
+# Parts of titles of Genius pages that are no songs, like track lists and liner notes
+_non_songs = ("track list", "album art", "liner notes", "booklet", "credits", "interview", "skit", "instrumental",
+              "setlist")
+
+
+class Song(NamedTuple):
+    id: int
+    title: str
+    artist: str
+    url: str
+    header_image_url: str
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Song":
+        return cls(data["id"], data["title"], data["primary_artist"]["name"], data["url"], data["header_image_url"])
+
+
+class Genius:
+    cache_size = 2000
+    ttl = 86400
+
+    def __init__(self, token: str, session: aiohttp.ClientSession, api_url: str = "https://api.genius.com/",
+                 public_api_url: str = "https://genius.com/api/"):
+        self._headers = {"Authorization": f"Bearer {token}"}
+        self._session = session
+        self._api_url = api_url
+        self._public_api_url = public_api_url
+        # (kind, query or id) -> (expiry, song), in the order of the last use
+        self._cache: Dict[Tuple[str, object], Tuple[float, Optional[Song]]] = {}
+        self._pending: Dict[Tuple[str, object], asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls, session: aiohttp.ClientSession) -> "Genius":
+        """GENIUS_API_URL replaces both API roots, for the stand-in server in test/standin."""
+        if "GENIUS_API_URL" in os.environ:
+            root = os.environ["GENIUS_API_URL"].rstrip("/") + "/"
+            return cls(os.environ["GENIUS_CLIENT_SECRET"], session, root, root + "api/")
+        return cls(os.environ["GENIUS_CLIENT_SECRET"], session)
+
+    async def search(self, query: str) -> Optional[Song]:
+        """The best song for `query`, or None."""
+        return await self._cached(("search", normalize(query)), self._search, query)
+
+    async def song(self, song_id: int) -> Song:
+        """The song with the id. Raises aiohttp.ClientResponseError with status 404 for unknown ids."""
+        return await self._cached(("song", song_id), self._song, song_id)
+
+    async def _cached(self, key: Tuple[str, object], fetch, *args) -> Optional[Song]:
+        cached = self._cache.pop(key, None)
+        if cached and cached[0] > time.monotonic():
+            self._cache[key] = cached
+            metrics.cache_lookup("genius", True)
+            return cached[1]
+
+        pending = self._pending.get(key)
+        if pending:
+            metrics.cache_lookup("genius", True)
+            return await asyncio.shield(pending)
+
+        metrics.cache_lookup("genius", False)
+        pending = self._pending[key] = asyncio.ensure_future(self._fetch(key, fetch, *args))
+        pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, key: Tuple[str, object], fetch, *args) -> Optional[Song]:
+        song = await fetch(*args)
+        self._store(key, song)
+        if song:
+            self._store(("song", song.id), song)
+        return song
+
+    def _store(self, key: Tuple[str, object], song: Optional[Song]):
+        self._cache.pop(key, None)
+        self._cache[key] = (time.monotonic() + self.ttl, song)
+        while len(self._cache) > self.cache_size:
+            del self._cache[next(iter(self._cache))]
+
+    async def _search(self, query: str) -> Optional[Song]:
+        with metrics.track("genius", "search"):
+            async with self._session.get(self._public_api_url + "search/multi", params={"q": query}) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+
+        sections = {section["type"]: section["hits"] for section in data["response"]["sections"]}
+        # The top hit may be an artist or album, then take the best song
+        for hit in sections.get("top_hit", []) + sections.get("song", []):
+            if hit["index"] == "song" and _is_song(hit["result"]):
+                return Song.from_json(hit["result"])
+        return None
+
+    async def _song(self, song_id: int) -> Song:
+        with metrics.track("genius", "song"):
+            async with self._session.get(f"{self._api_url}songs/{song_id}", headers=self._headers) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+        return Song.from_json(data["response"]["song"])
+
+
+def _is_song(result: dict) -> bool:
+    title = result["title"].lower()
+    return result.get("lyrics_state") == "complete" and not any(term in title for term in _non_songs)
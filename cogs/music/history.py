@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pylast
+
+from util import metrics
+from util.ratelimit import TokenBucket
+from .search import lastfm_net
+
+# Local listening history of the registered Last.fm users, kept in a SQLite database.
+# - Artist, album and track names are interned, a scrobble is one row of integers (user, time, track, album).
+# - sync fetches the scrobbles since the last sync through user.getRecentTracks with `from`. The sync watermark
+#   only advances once all pages of the window are stored, so an interrupted sync is simply repeated.
+# - backfill walks back through the older history page by page with `to`, and can resume after a restart.
+# - maintain runs both for all registered users in the background, with their own Last.fm rate limits.
+# Times are unix timestamps (UTC) as used by Last.fm.
+
+_log = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    newest INTEGER,                         -- sync watermark: `from` of the next sync
+    backfill INTEGER,                       -- `to` of the next backfill page
+    complete INTEGER NOT NULL DEFAULT 0     -- the backfill reached the first scrobble
+);
+CREATE TABLE IF NOT EXISTS artists (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS albums (id INTEGER PRIMARY KEY, artist INTEGER NOT NULL, name TEXT NOT NULL,
+                                   UNIQUE (artist, name));
+CREATE TABLE IF NOT EXISTS tracks (id INTEGER PRIMARY KEY, artist INTEGER NOT NULL, name TEXT NOT NULL,
+                                   UNIQUE (artist, name));
+CREATE TABLE IF NOT EXISTS scrobbles (
+    user INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    track INTEGER NOT NULL,
+    album INTEGER,
+    PRIMARY KEY (user, time, track)
+) WITHOUT ROWID;
+"""
+
+# (time, artist, track, album) of a scrobble, with names
+PlayedTrack = Tuple[int, str, str, Optional[str]]
+
+
+class UserState:
+    __slots__ = ["id", "newest", "backfill", "complete"]
+
+    def __init__(self, row: tuple):
+        self.id, self.newest, self.backfill, self.complete = row[0], row[1], row[2], bool(row[3])
+
+
+class History:
+    # Tracks per getRecentTracks page. pylast requests one more to make up for the now playing track.
+    page_size = 199
+    # Requests per second. Syncs are waited for by commands, the backfill runs in the background.
+    sync_rate = (5, 1.0)
+    backfill_rate = (1, 1.0)
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_schema)
+        self._db_lock = threading.Lock()
+        self._ids: Dict[tuple, int] = {}
+        self._user_locks: Dict[str, asyncio.Lock] = {}
+        self._sync_bucket = TokenBucket(*self.sync_rate)
+        self._backfill_bucket = TokenBucket(*self.backfill_rate)
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+    # ---------- Syncing ----------
+
+    async def sync(self, username: str) -> int:
+        """Store the scrobbles since the last sync, or the most recent page for a new user.
+        Returns the number of new scrobbles."""
+        async with self._user_lock(username):
+            state = await self._run(self._state, username)
+
+            if state.newest is None:
+                page = await self._page(username, None, None, self._sync_bucket)
+                added = await self._run(self._insert, state.id, page)
+                times = [p[0] for p in page]
+                await self._run(self._update, state.id, newest=max(times, default=0),
+                                backfill=min(times, default=0) + 1, complete=len(page) < self.page_size)
+                return added
+
+            # Walk back from the most recent scrobble to the watermark
+            added, top, time_to = 0, None, None
+            while True:
+                page = await self._page(username, state.newest, time_to, self._sync_bucket)
+                added += await self._run(self._insert, state.id, page)
+                times = [p[0] for p in page]
+                if top is None:
+                    top = max(times, default=state.newest)
+                if len(page) < self.page_size:
+                    break
+                time_to = self._next_to(times, time_to)
+
+            await self._run(self._update, state.id, newest=top)
+            return added
+
+    async def backfill(self, username: str, pages: int = 1) -> Optional[bool]:
+        """Store up to `pages` pages of older scrobbles. Returns whether the history is complete,
+        or None if the user was never synced, as the backfill starts below the first sync."""
+        async with self._user_lock(username):
+            state = await self._run(self._state, username)
+            if state.newest is None:
+                return None
+            if state.complete:
+                return True
+
+            time_to = state.backfill
+            for _ in range(pages):
+                page = await self._page(username, None, time_to, self._backfill_bucket)
+                await self._run(self._insert, state.id, page)
+                if len(page) < self.page_size:
+                    await self._run(self._update, state.id, complete=True)
+                    return True
+                time_to = self._next_to([p[0] for p in page], time_to)
+                await self._run(self._update, state.id, backfill=time_to)
+            return False
+
+    async def maintain(self, usernames: Callable[[], Iterable[str]], interval: float = 600.0, delay: float = 30.0):
+        """Sync all users returned by `usernames` every `interval` seconds, and backfill their history
+        in between. Runs until cancelled."""
+        await asyncio.sleep(delay)
+        while True:
+            deadline = time.monotonic() + interval
+            # Users whose sync failed are not backfilled in this run either
+            incomplete = [name for name in sorted(set(usernames()))
+                          if await self._guarded(self.sync(name), name) is not None]
+
+            # A few pages per user in turn, so new users don't wait for the complete history of others
+            while incomplete and time.monotonic() < deadline:
+                complete = [await self._guarded(self.backfill(name, pages=5), name) for name in incomplete]
+                # Failed and never synced users (None) are retried on the next run
+                incomplete = [name for name, done in zip(incomplete, complete) if done is False]
+            await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+
+    @staticmethod
+    async def _guarded(coro, username: str):
+        try:
+            return await coro
+        except pylast.PyLastError as e:
+            # e.g. renamed or deleted accounts, or Last.fm being down. Retried on the next run.
+            _log.warning(f"Could not sync the history of {username}: {e}")
+        except Exception:
+            # e.g. database errors or unexpected responses, which must not end the maintenance of all users
+            _log.exception(f"Error while syncing the history of {username}")
+
+    def _user_lock(self, username: str) -> asyncio.Lock:
+        return self._user_locks.setdefault(username.lower(), asyncio.Lock())
+
+    async def _page(self, username: str, time_from: Optional[int], time_to: Optional[int],
+                    bucket: TokenBucket) -> List[PlayedTrack]:
+        await bucket.acquire()
+        with metrics.track("lastfm", "get_recent_tracks"):
+            return await asyncio.to_thread(self._fetch, username, time_from, time_to)
+
+    def _fetch(self, username: str, time_from: Optional[int], time_to: Optional[int]) -> List[PlayedTrack]:
+        played = lastfm_net.get_user(username).get_recent_tracks(limit=self.page_size, time_from=time_from,
+                                                                 time_to=time_to, cacheable=False)
+        return [(int(p.timestamp), p.track.artist.name, p.track.title, p.album or None) for p in played]
+
+    @staticmethod
+    def _next_to(times: List[int], previous: Optional[int]) -> int:
+        """`to` of the page after a full page. The page boundary is fetched twice (`to` is exclusive), so
+        scrobbles in the same second are not lost, unless that would fetch the same page again."""
+        lowest = min(times)
+        return lowest if previous is not None and lowest + 1 >= previous else lowest + 1
+
+    # ---------- Queries ----------
+
+    async def plays(self, username: str, start: Optional[int] = None, end: Optional[int] = None) \
+            -> List[Tuple[int, int, int, Optional[int]]]:
+        """(time, artist id, track id, album id) of the stored scrobbles with start <= time < end, oldest first."""
+        return await self._run(self._plays, username, start, end)
+
+    async def titles(self, kind: str, ids: Iterable[int]) -> Dict[int, Tuple[str, str]]:
+        """(artist, title) of the interned ids of `kind` ("artists", "albums" or "tracks").
+        For artists, the title is empty."""
+        return await self._run(self._titles, kind, list(ids))
+
+    async def versions(self, usernames: Iterable[str]) -> Dict[str, tuple]:
+        """A value per user that changes whenever scrobbles of the user were stored. Users without any are missing."""
+        return await self._run(self._versions, [name.lower() for name in usernames])
+
+    async def status(self, username: str) -> Tuple[int, Optional[int], bool]:
+        """The number of stored scrobbles, the time of the oldest one and whether the history is complete."""
+        return await self._run(self._status, username)
+
+    # ---------- Database, called in a thread through _run ----------
+
+    async def _run(self, func, *args, **kwargs):
+        return await asyncio.to_thread(self._locked, func, *args, **kwargs)
+
+    def _locked(self, func, *args, **kwargs):
+        with self._db_lock:
+            return func(*args, **kwargs)
+
+    def _state(self, username: str) -> UserState:
+        name = username.lower()
+        self._db.execute("INSERT OR IGNORE INTO users (name) VALUES (?)", (name,))
+        row = self._db.execute("SELECT id, newest, backfill, complete FROM users WHERE name = ?", (name,)).fetchone()
+        return UserState(row)
+
+    def _update(self, user_id: int, **columns):
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        self._db.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*columns.values(), user_id))
+
+    def _intern(self, table: str, name: str, artist: Optional[int] = None) -> int:
+        key = (table, artist, name)
+        if key not in self._ids:
+            if artist is None:
+                self._db.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+                row = self._db.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+            else:
+                self._db.execute(f"INSERT OR IGNORE INTO {table} (artist, name) VALUES (?, ?)", (artist, name))
+                row = self._db.execute(f"SELECT id FROM {table} WHERE artist = ? AND name = ?",
+                                       (artist, name)).fetchone()
+            self._ids[key] = row[0]
+        return self._ids[key]
+
+    def _insert(self, user_id: int, page: List[PlayedTrack]) -> int:
+        self._db.execute("BEGIN")
+        try:
+            rows = []
+            for timestamp, artist, track, album in page:
+                artist_id = self._intern("artists", artist)
+                album_id = self._intern("albums", album, artist_id) if album else None
+                rows.append((user_id, timestamp, self._intern("tracks", track, artist_id), album_id))
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO scrobbles (user, time, track, album) VALUES (?, ?, ?, ?)",
+                                 rows)
+            added = self._db.total_changes - before
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            # Ids interned in the rolled back transaction don't exist
+            self._ids.clear()
+            raise
+        return added
+
+    def _plays(self, username: str, start: Optional[int], end: Optional[int]) -> list:
+        return self._db.execute(
+            "SELECT s.time, t.artist, s.track, s.album FROM scrobbles s JOIN tracks t ON t.id = s.track "
+            "WHERE s.user = (SELECT id FROM users WHERE name = ?) AND s.time >= ? AND s.time < ? ORDER BY s.time",
+            (username.lower(), start if start is not None else 0, end if end is not None else 2 ** 62)).fetchall()
+
+    def _titles(self, kind: str, ids: List[int]) -> Dict[int, Tuple[str, str]]:
+        if kind == "artists":
+            query = "SELECT id, name, '' FROM artists WHERE id IN ({})"
+        elif kind in ("albums", "tracks"):
+            query = f"SELECT x.id, a.name, x.name FROM {kind} x JOIN artists a ON a.id = x.artist WHERE x.id IN ({{}})"
+        else:
+            raise ValueError(f"Unknown kind {kind}")
+
+        result = {}
+        # Stay below SQLite's limit of variables per statement
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for row in self._db.execute(query.format(", ".join("?" * len(chunk))), chunk):
+                result[row[0]] = (row[1], row[2])
+        return result
+
+    def _versions(self, names: List[str]) -> Dict[str, tuple]:
+        result = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            for row in self._db.execute(f"SELECT name, newest, backfill, complete FROM users "
+                                        f"WHERE name IN ({placeholders}) AND newest IS NOT NULL", chunk):
+                result[row[0]] = row[1:]
+        return result
+
+    def _status(self, username: str) -> Tuple[int, Optional[int], bool]:
+        row = self._db.execute(
+            "SELECT COUNT(s.time), MIN(s.time), u.complete FROM users u LEFT JOIN scrobbles s ON s.user = u.id "
+            "WHERE u.name = ?", (username.lower(),)).fetchone()
+        return (row[0], row[1], bool(row[2])) if row and row[2] is not None else (0, None, False)
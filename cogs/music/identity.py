@@ -0,0 +1,266 @@
+import asyncio
+import difflib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+import tekore
+
+from . import search
+from .classes import Album, Artist, Track
+
+# Persistent map from Last.fm entities to their Spotify and Genius ids, so a match is only searched once.
+# Entities are keyed by their normalized (artist, title). MBIDs and ISRCs would be more exact, but pylast only
+# returns MBIDs with an extra getInfo request per entity, and neither Last.fm nor Spotify activities have ISRCs.
+# Every link has a confidence: how well the names of the match agree with the ones searched for. Links with at least
+# `accept` are used for `ttl`, weaker links and searches without a result are searched again after `retry`.
+# Links whose id is unknown to the service are dropped and searched again. Raising `version` drops all links,
+# which is needed when `normalize` changes.
+
+_log = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS links (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    service TEXT NOT NULL,
+    id TEXT,
+    confidence REAL NOT NULL,
+    resolved REAL NOT NULL,
+    PRIMARY KEY (kind, key, service)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS links_id ON links (service, id);
+"""
+
+# Remaster, live and similar notes in brackets or after a dash, and featured artists
+_noise = re.compile(r"\s*[(\[][^)\]]*[)\]]|\s+-\s+.*(remaster|version|edit|mix|live|mono|stereo).*$"
+                    r"|\s+(feat|ft|featuring)\.?\s.*$", re.IGNORECASE)
+_punctuation = re.compile(r"[^\w\s]+")
+
+
+class Link(NamedTuple):
+    # None if the search found nothing
+    id: Optional[str]
+    confidence: float
+
+
+def normalize(text: str) -> str:
+    """Case, accents, punctuation and notes like "(Remastered 2011)" removed, for comparing names."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = _noise.sub("", text) or text
+    text = _punctuation.sub(" ", text.replace("&", " and "))
+    return " ".join(text.split())
+
+
+def similarity(expected: str, found: str) -> float:
+    """How well two names agree, from 0 to 1. Names that contain each other, like an artist and a list of artists
+    starting with it, count as a good match."""
+    expected, found = normalize(expected), normalize(found)
+    if expected == found:
+        return 1.0
+    if expected and found and (f" {expected} " in f" {found} " or f" {found} " in f" {expected} "):
+        return 0.9
+    return difflib.SequenceMatcher(None, expected, found).ratio()
+
+
+def keys(artist: str, title: str = "") -> List[str]:
+    """Keys of an entity, the most specific first. For artists, the title is empty."""
+    return [f"name:{normalize(artist)}\t{normalize(title)}"]
+
+
+class Identities:
+    # Links with at least this confidence are used without searching again
+    accept = 0.8
+    ttl = 90 * 86400
+    retry = 86400
+    version = 1
+    # Concurrent searches of a batch
+    max_searches = 4
+
+    def __init__(self, path: str, genius=None):
+        self.path = path
+        self.genius = genius
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != self.version:
+            self._db.execute("DROP TABLE IF EXISTS links")
+            self._db.execute(f"PRAGMA user_version = {self.version}")
+        self._db.executescript(_schema)
+        self._db_lock = threading.Lock()
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+    # ---------- Links ----------
+
+    async def lookup(self, kind: str, keys: Iterable[str], service: str) -> Optional[Link]:
+        """The link of the first key that has a current one, or None if the entity must be searched."""
+        return await self._run(self._lookup, kind, list(keys), service, time.time())
+
+    async def lookup_many(self, kind: str, keys: List[List[str]], service: str) -> List[Optional[Link]]:
+        """:meth:`lookup` of several entities at once."""
+        return await self._run(self._lookup_many, kind, keys, service, time.time())
+
+    async def link(self, kind: str, keys: Iterable[str], service: str, link: Link):
+        await self._run(self._link, kind, list(keys), service, link, time.time())
+
+    async def invalidate(self, service: str, entity_id: str):
+        """Drop all links to an id, e.g. because the service does not know it anymore."""
+        _log.info(f"Dropping the links to {service} id {entity_id}")
+        await self._run(self._db.execute, "DELETE FROM links WHERE service = ? AND id = ?", (service, entity_id))
+
+    # ---------- Resolution ----------
+
+    async def spotify_track(self, artist: str, title: str, album: str = "", spotify_id: str = None) \
+            -> Optional[Track]:
+        """The Spotify track of a Last.fm track. With `spotify_id`, e.g. from a Spotify activity, the track is
+        fetched and linked right away."""
+        track_keys = keys(artist, title)
+        if spotify_id:
+            track = await search.get_spotify_track(spotify_id)
+            await self.link("track", track_keys, "spotify", Link(spotify_id, 1.0))
+            return track
+
+        link = await self.lookup("track", track_keys, "spotify")
+        if link and link.id:
+            try:
+                return await search.get_spotify_track(link.id)
+            except tekore.NotFound:
+                await self.invalidate("spotify", link.id)
+        elif link:
+            return None
+
+        query = f"track:{title} artist:{artist}" + (f" album:{album}" if album else "")
+        track = await search.search_spotify_track(query)
+        confidence = min(similarity(artist, track.artist.name), similarity(title, track.name)) if track else 0.0
+        await self.link("track", track_keys, "spotify", Link(track.spotify_id if track else None, confidence))
+        return track
+
+    async def spotify_album(self, artist: str, title: str, query: str = None, extended: bool = False) \
+            -> Optional[Album]:
+        """The Spotify album of a Last.fm album. The first search uses `query`, if given."""
+        album_keys = keys(artist, title)
+        link = await self.lookup("album", album_keys, "spotify")
+        if link and link.id:
+            try:
+                # The album endpoint returns the extended album
+                return await search.get_spotify_album(link.id)
+            except tekore.NotFound:
+                await self.invalidate("spotify", link.id)
+        elif link:
+            return None
+
+        album = await search.search_spotify_album(query or f"album:{title} artist:{artist}", extended=extended)
+        confidence = min(similarity(artist, album.artist.name), similarity(title, album.name)) if album else 0.0
+        await self.link("album", album_keys, "spotify", Link(album.spotify_id if album else None, confidence))
+        return album
+
+    async def spotify_artist(self, name: str) -> Optional[Artist]:
+        artist_keys = keys(name)
+        link = await self.lookup("artist", artist_keys, "spotify")
+        if link and link.id:
+            try:
+                return await search.get_spotify_artist(link.id)
+            except tekore.NotFound:
+                await self.invalidate("spotify", link.id)
+        elif link:
+            return None
+
+        artist = await search.search_spotify_artist(name)
+        confidence = similarity(name, artist.name) if artist else 0.0
+        await self.link("artist", artist_keys, "spotify", Link(artist.spotify_id if artist else None, confidence))
+        return artist
+
+    async def spotify_tracks(self, tracks: List[Tuple[str, str]]) -> List[Optional[Track]]:
+        """The Spotify tracks of several (artist, title) at once, see :meth:`_batch`."""
+        return await self._batch("track", tracks, search.get_spotify_tracks, self.spotify_track)
+
+    async def spotify_albums(self, albums: List[Tuple[str, str]]) -> List[Optional[Album]]:
+        """The Spotify albums of several (artist, title) at once, see :meth:`_batch`."""
+        return await self._batch("album", albums, search.get_spotify_albums, self.spotify_album)
+
+    async def _batch(self, kind: str, items: List[Tuple[str, str]], get_many, resolve) -> list:
+        """Fetch the linked items with as few requests of the multi-id endpoint as possible. Items without
+        a current link are resolved one by one, at most `max_searches` at a time."""
+        links = await self.lookup_many(kind, [keys(*item) for item in items], "spotify")
+        results = [None] * len(items)
+
+        known = [index for index, link in enumerate(links) if link and link.id]
+        ids = list(dict.fromkeys(links[index].id for index in known))
+        fetched = dict(zip(ids, await get_many(ids))) if ids else {}
+        unresolved = [index for index, link in enumerate(links) if not link]
+        for index in known:
+            results[index] = fetched[links[index].id]
+            if not results[index]:
+                # Unknown to Spotify now, search it again
+                await self.invalidate("spotify", links[index].id)
+                unresolved.append(index)
+
+        semaphore = asyncio.Semaphore(self.max_searches)
+
+        async def resolve_one(index: int):
+            async with semaphore:
+                results[index] = await resolve(*items[index])
+
+        await asyncio.gather(*(resolve_one(index) for index in unresolved))
+        return results
+
+    async def genius_song(self, query: str, artist: str = None, title: str = None):
+        """The Genius song (see cogs.music.genius) of a Last.fm track, or of a free text search."""
+        song_keys = keys(artist, title) if artist and title else [f"query:{normalize(query)}"]
+        link = await self.lookup("track", song_keys, "genius")
+        if link and link.id:
+            try:
+                return await self.genius.song(int(link.id))
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+                await self.invalidate("genius", link.id)
+        elif link:
+            return None
+
+        song = await self.genius.search(query)
+        if not song:
+            confidence = 0.0
+        elif artist and title:
+            confidence = min(similarity(artist, song.artist), similarity(title, song.title))
+        else:
+            confidence = similarity(query, f"{song.title} {song.artist}")
+        await self.link("track", song_keys, "genius", Link(str(song.id) if song else None, confidence))
+        return song
+
+    # ---------- Database, called in a thread through _run ----------
+
+    async def _run(self, func, *args):
+        return await asyncio.to_thread(self._locked, func, *args)
+
+    def _locked(self, func, *args):
+        with self._db_lock:
+            return func(*args)
+
+    def _lookup(self, kind: str, keys: List[str], service: str, now: float) -> Optional[Link]:
+        for key in keys:
+            row = self._db.execute("SELECT id, confidence, resolved FROM links WHERE kind = ? AND key = ? "
+                                   "AND service = ?", (kind, key, service)).fetchone()
+            if not row:
+                continue
+            entity_id, confidence, resolved = row
+            max_age = self.ttl if entity_id and confidence >= self.accept else self.retry
+            if now - resolved < max_age:
+                return Link(entity_id, confidence)
+        return None
+
+    def _lookup_many(self, kind: str, keys: List[List[str]], service: str, now: float) -> List[Optional[Link]]:
+        return [self._lookup(kind, entity_keys, service, now) for entity_keys in keys]
+
+    def _link(self, kind: str, keys: List[str], service: str, link: Link, now: float):
+        self._db.executemany("INSERT OR REPLACE INTO links (kind, key, service, id, confidence, resolved) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             [(kind, key, service, link.id, link.confidence, now) for key in keys])
@@ -1,21 +1,34 @@
 import asyncio
 import copy
+import datetime
+import io
 import logging
-from typing import Optional, Literal, Collection, Union
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Literal, Collection, Dict, List, Set, Tuple, Union
 
+import aiohttp
 import discord
 import pylast
 import tekore
 from discord.app_commands import describe
 from discord.ext.commands import Bot, Cog, CommandError, CommandInvokeError, Context, MissingRequiredArgument, \
-    hybrid_command, hybrid_group
+    Range, guild_only, hybrid_command, hybrid_group
 
-from util import get_command
+from util import get_command, metrics
 from util.config import Config
-from . import search
+from util.imagecache import ImageCache
+from . import collage, search
 from .classes import Album, Artist, Track
-from .search import genius, lastfm_net
-from .util import get_activity, make_table, mklinks, rym_search, tbl_artist_format, tbl_format
+from .genius import Genius
+from .history import History
+from .identity import Identities
+from .recent import RecentCache, RecentView
+from .search import lastfm_net
+from .stats import GuildCharts, Stats, parse_range, timezone
+from .taste import Compatibility
+from .util import get_activity, make_bars, make_table, mklinks, rym_search, tbl_artist_format, tbl_format, \
+    tbl_server_artist_format, tbl_server_format
 
 # TODO Slash command error handler
 # if "SKIP_SLASH" not in os.environ:
@@ -44,16 +57,71 @@ class NotRegisteredError(Exception):
 
 
 class Music(Cog):
+    # Concurrent cover downloads for the collage
+    max_downloads = 10
+    # Genius songs resolved in the background at once, more track changes are skipped
+    max_prefetches = 20
+    # Last.fm's image for albums without a cover
+    lastfm_placeholder = "2a96cbd8b46e442fc41c2b86b821562f"
+
     def __init__(self, bot: Bot):
         self._bot = bot
 
         self.config = Config("music")
-        self.data = self.config.data
 
         if not self.data:
             self.data["names"] = {}
             self.config.save()
 
+        self.history: Optional[History] = None
+        self.stats: Optional[Stats] = None
+        self.guild_charts: Optional[GuildCharts] = None
+        self.compatibility: Optional[Compatibility] = None
+        self._history_task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.images: Optional[ImageCache] = None
+        self.genius: Optional[Genius] = None
+        self.identities: Optional[Identities] = None
+        self._prefetches: Set[asyncio.Task] = set()
+        # Member id -> the Spotify track id of the last prefetch, as presence updates arrive once per shared guild
+        self._prefetched: Dict[int, str] = {}
+        self.recent_pages = RecentCache(search.get_recent)
+
+    @property
+    def data(self) -> dict:
+        # Through the config on every access, so registrations made by other processes are merged in
+        return self.config.data
+
+    async def cog_load(self) -> None:
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_downloads),
+                                              timeout=aiohttp.ClientTimeout(total=10))
+        # Worker processes are only started on the first collage
+        self._pool = ProcessPoolExecutor(max_workers=2)
+        self.images = ImageCache(os.path.join(self.config.datadir, "images"), self._session)
+        self.genius = Genius.from_env(self._session)
+        self.identities = Identities(os.path.join(self.config.datadir, "identities.db"), self.genius)
+        self.history = History(os.path.join(self.config.datadir, "history.db"))
+        self.stats = Stats(self.history)
+        self.guild_charts = GuildCharts(self.history)
+        self.compatibility = Compatibility(self.guild_charts)
+        # With several shard processes, one of them keeps the history of all users up to date
+        if getattr(self._bot, "is_primary", True):
+            self._history_task = asyncio.create_task(self.history.maintain(lambda: self.data["names"].values()))
+            self._history_task.add_done_callback(self._history_done)
+
+    async def cog_unload(self) -> None:
+        if self._history_task:
+            self._history_task.cancel()
+        self.history.close()
+        self.images.close()
+        self.identities.close()
+        self.recent_pages.clear()
+        for task in self._prefetches:
+            task.cancel()
+        await self._session.close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
     def get_lastfm_user(self, user: Union[discord.User, discord.Member]) -> Optional[str]:
         if str(user.id) in self.data["names"]:
             return self.data["names"][str(user.id)]
@@ -88,12 +156,46 @@ class Music(Cog):
             await self.reply_on_error(
                 ctx, "There was an error while communicating with the Spotify API, please try again later."
             )
+        elif isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            # Genius requests and cover downloads
+            _log.warning(f"HTTP request failed: {error!r}")
+            await self.reply_on_error(
+                ctx, "There was an error while communicating with Genius or Last.fm, please try again later."
+            )
         elif isinstance(error, NotRegisteredError):
             await self.reply_on_error(ctx, "You must register with `/last register` first.")
         else:
             _log.error("Unhandled error during command: " + get_command(ctx), exc_info=error)
             await self.reply_on_error(ctx, "There was an unknown error, please contact the bot owner.")
 
+    @Cog.listener()
+    async def on_presence_update(self, before: discord.Member, after: discord.Member):
+        """Resolve the Genius song of a registered member's new Spotify track, so `lyricsgenius` finds it cached."""
+        activity = next((a for a in after.activities if isinstance(a, discord.Spotify)), None)
+        previous = next((a for a in before.activities if isinstance(a, discord.Spotify)), None)
+        if not activity or (previous and previous.track_id == activity.track_id):
+            return
+        if str(after.id) not in self.data["names"] or len(self._prefetches) >= self.max_prefetches:
+            return
+        if self._prefetched.get(after.id) == activity.track_id:
+            return
+        self._prefetched[after.id] = activity.track_id
+
+        artist = activity.artists[0] if activity.artists else activity.artist
+        task = asyncio.create_task(self.identities.genius_song(f"{activity.title} {artist}", artist, activity.title))
+        self._prefetches.add(task)
+        task.add_done_callback(self._prefetch_done)
+
+    @staticmethod
+    def _history_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            _log.error("The history maintenance stopped", exc_info=task.exception())
+
+    def _prefetch_done(self, task: asyncio.Task):
+        self._prefetches.discard(task)
+        if not task.cancelled() and task.exception():
+            _log.warning("Could not resolve the Genius song of a Spotify activity", exc_info=task.exception())
+
     # ---------- Regular commands ----------
     @hybrid_group()
     async def last(self, ctx: Context):
@@ -115,6 +217,18 @@ class Music(Cog):
         else:
             await ctx.message.add_reaction("\N{WHITE HEAVY CHECK MARK}")
 
+    @last.command()
+    async def history(self, ctx: Context):
+        """Sync your scrobbles to the bot, and show how much of your history it knows."""
+        lastfm_user = self.get_lastfm_user(ctx.author)
+        async with ctx.typing():
+            added = await self.history.sync(lastfm_user)
+            count, oldest, complete = await self.history.status(lastfm_user)
+
+        since = f" since <t:{oldest}:D>" if oldest else ""
+        progress = "complete" if complete else "still importing older scrobbles in the background"
+        await ctx.reply(f"{count} scrobbles stored{since} ({added} new), {progress}.")
+
     @last.command()
     async def now(self, ctx: Context):
         """Fetch the currently playing song."""
@@ -135,14 +249,13 @@ class Music(Cog):
                 return
 
         # Try to enhance with Spotify data
-        sp_query = f"track:{track.name} artist:{track.artist.name}"
-        sp_query += f" album:{track.album.name}" if track.album else ""
-        sp_result = await search.search_spotify_track(sp_query)
+        sp_result = await self.identities.spotify_track(track.artist.name, track.name, track.album.name or "",
+                                                        spotify_id=activity.track_id if activity else None)
         if sp_result:
             track.update(sp_result)
 
         embed = discord.Embed(title="{} - {}".format(track.artist.name, track.name), url=track.url)
-        embed.set_author(name=author, icon_url=ctx.author.avatar.url)
+        embed.set_author(name=author, icon_url=ctx.author.display_avatar.url)
         embed.set_thumbnail(url=track.album.img_url or None)
 
         # Footer text, depending on where we got our data from
@@ -157,17 +270,9 @@ class Music(Cog):
 
     @last.command()
     async def recent(self, ctx: Context):
-        """Fetch your last scrobbles."""
-        recent_scrobbles = await search.get_recent(self.get_lastfm_user(ctx.author))
-
-        embed = discord.Embed(title="Recent scrobbles")
-        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar.url)
-
-        for i in range(len(recent_scrobbles)):
-            scrobble = recent_scrobbles[i]
-            embed.add_field(name=scrobble.track.title, value=scrobble.track.artist.name)
-
-        await ctx.send(embed=embed)
+        """Fetch your last scrobbles, and page back through older ones."""
+        view = RecentView(self.recent_pages.get(self.get_lastfm_user(ctx.author)), ctx.author)
+        view.message = await ctx.send(embed=await view.embed(), view=view)
 
     # Possible chart timeframes
     periods = {"all": pylast.PERIOD_OVERALL,
@@ -178,15 +283,17 @@ class Music(Cog):
                "12m": pylast.PERIOD_12MONTHS}
 
     @last.command()
-    async def tracks(self, ctx: Context, period: Literal["all", "7d", "1m", "3m", "6m", "12m"] = "all"):
+    @describe(period="all, 7d, 1m, 3m, 6m, 12m, or a range of years, months or days like 2023-01..2023-06")
+    async def tracks(self, ctx: Context, period: str = "all"):
         """Fetch your most played tracks.
-        Time periods: all, 7d, 1m, 3m, 6m, 12m"""
+        Time periods: all, 7d, 1m, 3m, 6m, 12m, or a range like 2023-01..2023-06"""
         if period not in self.periods:
-            await self.reply_on_error(ctx, "Unknown time-period. Possible values: all, 7d, 1m, 3m, 6m, 12m")
+            await self._local_chart(ctx, "tracks", period)
             return
 
         lfmuser = lastfm_net.get_user(self.get_lastfm_user(ctx.author))
-        top_tracks = lfmuser.get_top_tracks(period=self.periods[period], limit=10)
+        with metrics.track("lastfm", "get_top_tracks"):
+            top_tracks = await asyncio.to_thread(lfmuser.get_top_tracks, period=self.periods[period], limit=10)
 
         cols = {
             "No": range(1, len(top_tracks) + 1),
@@ -197,19 +304,23 @@ class Music(Cog):
 
         embed = discord.Embed(title="Top tracks (" + period + ")")
         embed.description = make_table(tbl_format, cols)
-        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar.url)
+        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+        await self._add_spotify_links(embed, "tracks", [(t.item.artist.name, t.item.title) for t in top_tracks])
 
         await ctx.send(embed=embed)
 
     @last.command()
-    async def albums(self, ctx: Context, period: Literal["all", "7d", "1m", "3m", "6m", "12m"] = "all"):
+    @describe(period="all, 7d, 1m, 3m, 6m, 12m, or a range of years, months or days like 2023-01..2023-06")
+    async def albums(self, ctx: Context, period: str = "all"):
         """Fetch your most played albums.
-        Time periods: all, 7d, 1m, 3m, 6m, 12m"""
+        Time periods: all, 7d, 1m, 3m, 6m, 12m, or a range like 2023-01..2023-06"""
         if period not in self.periods:
-            await self.reply_on_error(ctx, "Unknown time-period. Possible values: all, 7d, 1m, 3m, 6m, 12m")
+            await self._local_chart(ctx, "albums", period)
+            return
 
         lfmuser = lastfm_net.get_user(self.get_lastfm_user(ctx.author))
-        top_albums = lfmuser.get_top_albums(period=self.periods[period], limit=10)
+        with metrics.track("lastfm", "get_top_albums"):
+            top_albums = await asyncio.to_thread(lfmuser.get_top_albums, period=self.periods[period], limit=10)
 
         cols = {
             "No": range(1, len(top_albums) + 1),
@@ -220,19 +331,23 @@ class Music(Cog):
 
         embed = discord.Embed(title="Top albums (" + period + ")")
         embed.description = make_table(tbl_format, cols)
-        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar.url)
+        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+        await self._add_spotify_links(embed, "albums", [(t.item.artist.name, t.item.title) for t in top_albums])
 
         await ctx.send(embed=embed)
 
     @last.command()
-    async def artists(self, ctx: Context, period: Literal["all", "7d", "1m", "3m", "6m", "12m"] = "all"):
+    @describe(period="all, 7d, 1m, 3m, 6m, 12m, or a range of years, months or days like 2023-01..2023-06")
+    async def artists(self, ctx: Context, period: str = "all"):
         """Fetch your most played artists.
-        Time periods: all, 7d, 1m, 3m, 6m, 12m"""
+        Time periods: all, 7d, 1m, 3m, 6m, 12m, or a range like 2023-01..2023-06"""
         if period not in self.periods:
-            await self.reply_on_error(ctx, "Unknown time-period. Possible values: all, 7d, 1m, 3m, 6m, 12m")
+            await self._local_chart(ctx, "artists", period)
+            return
 
         lfmuser = lastfm_net.get_user(self.get_lastfm_user(ctx.author))
-        top_artists = lfmuser.get_top_artists(period=self.periods[period], limit=10)
+        with metrics.track("lastfm", "get_top_artists"):
+            top_artists = await asyncio.to_thread(lfmuser.get_top_artists, period=self.periods[period], limit=10)
 
         cols = {
             "No": range(1, len(top_artists) + 1),
@@ -242,10 +357,182 @@ class Music(Cog):
 
         embed = discord.Embed(title="Top artists (" + period + ")")
         embed.description = make_table(tbl_artist_format, cols)
-        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar.url)
+        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
 
         await ctx.send(embed=embed)
 
+    async def _local_chart(self, ctx: Context, kind: str, period: str):
+        """Top list for a custom time range, from the local scrobble history."""
+        time_range = await self._parse_range(ctx, period)
+        if not time_range:
+            return
+        start, end = time_range
+
+        lastfm_user = self.get_lastfm_user(ctx.author)
+        async with ctx.typing():
+            await self.history.sync(lastfm_user)
+            top = await self.stats.top(lastfm_user, kind, start, end)
+
+        if kind == "artists":
+            cols = {"No": range(1, len(top) + 1), "Artist": [t[0] for t in top], "Scr.": [t[2] for t in top]}
+        else:
+            cols = {"No": range(1, len(top) + 1), "Artist": [t[0] for t in top],
+                    "Album" if kind == "albums" else "Title": [t[1] for t in top], "Scr.": [t[2] for t in top]}
+
+        embed = discord.Embed(title=f"Top {kind} ({period})")
+        embed.description = make_table(tbl_artist_format if kind == "artists" else tbl_format, cols)
+        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+        if kind != "artists":
+            await self._add_spotify_links(embed, kind, [(t[0], t[1]) for t in top])
+        await self._set_history_footer(embed, lastfm_user, start)
+        await ctx.send(embed=embed)
+
+    async def _add_spotify_links(self, embed: discord.Embed, kind: str, items: List[Tuple[str, str]]):
+        """Link the (artist, title) of a chart of "tracks" or "albums" to Spotify, and show the cover of the first.
+        Known entries take one request for up to 20 albums or 50 tracks, see Identities.spotify_tracks."""
+        try:
+            if kind == "tracks":
+                found = await self.identities.spotify_tracks(items)
+                cover = found[0].album.img_url if found and found[0] else None
+            else:
+                found = await self.identities.spotify_albums(items)
+                cover = found[0].img_url if found and found[0] else None
+        except tekore.HTTPError:
+            # The chart is complete without the links
+            _log.warning("Could not link a chart to Spotify", exc_info=True)
+            return
+
+        links = " ".join(f"[{no}]({item.url})" for no, item in enumerate(found, 1) if item)
+        if links:
+            embed.description += f"\nSpotify: {links}"
+        embed.set_thumbnail(url=cover)
+
+    async def _parse_range(self, ctx: Context, period: str, now: datetime.datetime = None) \
+            -> Optional[Tuple[Optional[int], Optional[int]]]:
+        """Parse a custom time range, or reply with the accepted ones and return None."""
+        try:
+            return parse_range(period, timezone(self.data.get("timezone")), now=now)
+        except ValueError:
+            await self.reply_on_error(ctx, "Unknown time-period. Possible values: all, 7d, 1m, 3m, 6m, 12m, "
+                                           "or a range of years, months or days like 2023-01..2023-06")
+            return None
+
+    async def _set_history_footer(self, embed: discord.Embed, lastfm_user: str, start: Optional[int]):
+        _, oldest, complete = await self.history.status(lastfm_user)
+        if not complete and (oldest is None or not start or start < oldest):
+            embed.set_footer(text="Your older scrobbles are still being imported, so they are missing here.")
+
+    @last.command()
+    @guild_only()
+    @describe(kind="What to chart",
+              period="all, 7d, 1m, 3m, 6m, 12m, or a range of years, months or days like 2023-01..2023-06")
+    async def server(self, ctx: Context, kind: Literal["artists", "albums", "tracks"] = "artists",
+                     period: str = "all"):
+        """Show what the whole server listens to, from the scrobbles of all registered members."""
+        # Relative periods start at the full hour, so the charts are cached for an hour
+        now = datetime.datetime.now(timezone(self.data.get("timezone"))).replace(minute=0, second=0, microsecond=0)
+        time_range = await self._parse_range(ctx, period, now=now)
+        if not time_range:
+            return
+
+        usernames = self._guild_usernames(ctx.guild)
+        async with ctx.typing():
+            top, members = await self.guild_charts.top(ctx.guild.id, usernames, kind, *time_range)
+
+        cols = {"No": range(1, len(top) + 1), "Artist": [t[0] for t in top]}
+        if kind != "artists":
+            cols["Album" if kind == "albums" else "Title"] = [t[1] for t in top]
+        cols["Scr."] = [t[2] for t in top]
+        cols["Lis"] = [t[3] for t in top]
+
+        embed = discord.Embed(title=f"Top {kind} on {ctx.guild.name} ({period})")
+        embed.description = make_table(tbl_server_artist_format if kind == "artists" else tbl_server_format, cols)
+        embed.set_footer(text=f"Scrobbles of {members} of {len(usernames)} registered members, "
+                              f"synced every 10 minutes. Lis: listeners")
+        await ctx.send(embed=embed)
+
+    @last.command()
+    @guild_only()
+    @describe(member="The member to compare with")
+    async def compat(self, ctx: Context, member: discord.Member):
+        """Compare your music taste with another member, based on the artists you listen to."""
+        own = self.get_lastfm_user(ctx.author)
+        if str(member.id) not in self.data["names"]:
+            await self.reply_on_error(ctx, f"{member.display_name} is not registered.")
+            return
+        other = self.data["names"][str(member.id)]
+
+        async with ctx.typing():
+            similarity = await self.compatibility.similarity(ctx.guild.id, self._guild_usernames(ctx.guild))
+        missing = [name for name in (own, other) if name not in similarity]
+        if missing:
+            await self.reply_on_error(ctx, f"No scrobbles of {' and '.join(missing)} are stored yet, "
+                                           f"try again in a few minutes.")
+            return
+
+        # Ordered by their contribution to the similarity
+        shared = similarity.shared(own, other)
+        titles = await self.history.titles("artists", shared)
+        embed = discord.Embed(title=f"{ctx.author.display_name} × {member.display_name}")
+        embed.description = f"**{similarity.pair(own, other):.0%}** compatible"
+        if shared:
+            embed.description += "\n\nYou both listen to " + ", ".join(titles[artist][0] for artist in shared)
+        await ctx.send(embed=embed)
+
+    @last.command()
+    @guild_only()
+    async def similar(self, ctx: Context):
+        """Show the members of this server with the most similar music taste."""
+        async with ctx.typing():
+            similarity = await self.compatibility.similarity(ctx.guild.id, self._guild_usernames(ctx.guild))
+
+        members = {}
+        for member in self.get_guild_lastfm_users(ctx.guild):
+            members.setdefault(self.data["names"][str(member.id)].lower(), member)
+        lines = [f"{i}. {members[a].display_name} & {members[b].display_name}: {score:.0%}"
+                 for i, (a, b, score) in enumerate(similarity.most_similar(), 1)]
+
+        embed = discord.Embed(title=f"Most similar listeners on {ctx.guild.name}")
+        embed.description = "\n".join(lines) or "Not enough scrobbles stored yet."
+        await ctx.send(embed=embed)
+
+    def _guild_usernames(self, guild: discord.Guild) -> List[str]:
+        return [self.data["names"][str(member.id)] for member in self.get_guild_lastfm_users(guild)]
+
+    @last.command()
+    @describe(period="all, 7d, 1m, 3m, 6m, 12m, or a range of years, months or days like 2023-01..2023-06")
+    async def activity(self, ctx: Context, period: str = "all"):
+        """Show when you listen to music: by hour and weekday, and your listening streaks."""
+        time_range = await self._parse_range(ctx, period)
+        if not time_range:
+            return
+        start, end = time_range
+
+        lastfm_user = self.get_lastfm_user(ctx.author)
+        tz = timezone(self.data.get("timezone"))
+        async with ctx.typing():
+            await self.history.sync(lastfm_user)
+            plays = (await self.stats.plays(lastfm_user)).window(start, end)
+
+        hours = plays.by_hour(tz)
+        # Three hour blocks keep the embed short
+        blocks = hours.reshape(8, 3).sum(axis=1)
+        weekdays = plays.by_weekday(tz)
+        streaks = plays.streaks(tz)
+
+        embed = discord.Embed(title=f"Listening activity ({period})")
+        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+        embed.add_field(name="By hour", value=make_bars([f"{h:02}-{h + 3:02}" for h in range(0, 24, 3)],
+                                                        blocks.tolist()), inline=False)
+        embed.add_field(name="By weekday", value=make_bars(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+                                                           weekdays.tolist()), inline=False)
+        embed.add_field(name="Scrobbles", value=str(len(plays)))
+        embed.add_field(name="Days with scrobbles", value=str(streaks["days"]))
+        embed.add_field(name="Longest streak", value=f"{streaks['longest']} days")
+        embed.add_field(name="Current streak", value=f"{streaks['current']} days")
+        await self._set_history_footer(embed, lastfm_user, start)
+        await ctx.send(embed=embed)
+
     @last.command()
     async def my(self, ctx: discord.ext.commands.Context):
         """Share your last.fm profile link"""
@@ -287,7 +574,8 @@ class Music(Cog):
         album.update(last_album)
         urls["Last.fm"] = last_album.url
 
-        spotify_album = await search.search_spotify_album(search_query, extended=True)
+        spotify_album = await self.identities.spotify_album(album.artist.name, album.name, query=search_query,
+                                                            extended=True)
         if spotify_album:
             album.update(spotify_album)
             urls["Spotify"] = spotify_album.url
@@ -335,7 +623,7 @@ class Music(Cog):
         artist.update(last_result)
         urls["Last.fm"] = last_result.url
 
-        sp_result = await search.search_spotify_artist(last_result.name)
+        sp_result = await self.identities.spotify_artist(last_result.name)
         if sp_result:
             artist.update(sp_result)
             urls["Spotify"] = sp_result.url
@@ -352,15 +640,23 @@ class Music(Cog):
     @describe(search_query="Title and artist of the song")
     async def lyricsgenius(self, ctx: Context, search_query: str = None):
         async with ctx.typing():
-            # Use the current scrobble if no search was submitted
+            # Use the Spotify activity or the current scrobble if no search was submitted.
+            # The song of the activity was usually resolved already, see on_presence_update
             if not search_query:
-                scrobble = await search.get_scrobble(self.get_lastfm_user(ctx.author))
-                if not scrobble:
-                    await self.reply_on_error(ctx, "Nothing is currently scrobbling.")
-                    return
-                search_query = f"{scrobble.name} {scrobble.artist.name}"
-
-            song = await asyncio.to_thread(genius.search_song, title=search_query, get_full_info=False)
+                activity = get_activity(ctx.author, "Spotify")
+                if activity:
+                    artist = activity.artists[0] if activity.artists else activity.artist
+                    title = activity.title
+                else:
+                    scrobble = await search.get_scrobble(self.get_lastfm_user(ctx.author))
+                    if not scrobble:
+                        await self.reply_on_error(ctx, "Nothing is currently scrobbling.")
+                        return
+                    artist, title = scrobble.artist.name, scrobble.name
+                search_query = f"{title} {artist}"
+                song = await self.identities.genius_song(search_query, artist, title)
+            else:
+                song = await self.identities.genius_song(search_query)
 
             if not song:
                 await self.reply_on_error(ctx, f"Could not find '{search_query}' on Genius.")
@@ -371,8 +667,56 @@ class Music(Cog):
             embed.set_thumbnail(url=song.header_image_url)
             await ctx.send(embed=embed)
 
-    # @app_command(description="Create a custom chart")
-    # async def chart(self, ctx: Context, search_by: Literal["artist", "album"], search_query: str = None, user: Member = None):
+    @hybrid_command(description="Create a collage of the covers of your top albums")
+    @describe(size="Rows and columns of the collage", member="Whose albums to show, default: you",
+              period="all, 7d, 1m, 3m, 6m, 12m, or a range of years, months or days like 2023-01..2023-06")
+    async def chart(self, ctx: Context, size: Range[int, 1, 10] = 3, period: str = "7d",
+                    member: discord.Member = None):
+        member = member or ctx.author
+        lastfm_user = self.get_lastfm_user(member)
+        count = size * size
+
+        async with ctx.typing():
+            if period in self.periods:
+                lfmuser = lastfm_net.get_user(lastfm_user)
+                with metrics.track("lastfm", "get_top_albums"):
+                    top_albums = await asyncio.to_thread(lfmuser.get_top_albums, period=self.periods[period],
+                                                         limit=count)
+                # The covers are part of the response, get_cover_image makes no further request
+                albums = [(t.item.artist.name, t.item.title, t.item.get_cover_image(pylast.SIZE_EXTRA_LARGE))
+                          for t in top_albums[:count]]
+            else:
+                time_range = await self._parse_range(ctx, period)
+                if not time_range:
+                    return
+                await self.history.sync(lastfm_user)
+                top = await self.stats.top(lastfm_user, "albums", *time_range, count=count)
+                albums = [(artist, title, None) for artist, title, _ in top]
+
+            if not albums:
+                await self.reply_on_error(ctx, f"No albums were scrobbled in this time period ({period}).")
+                return
+
+            paths = await asyncio.gather(*(self._album_cover(*album) for album in albums))
+            captions = [f"{artist} - {title}" for artist, title, _ in albums]
+            image = await asyncio.get_running_loop().run_in_executor(self._pool, collage.render, paths, captions,
+                                                                     size)
+
+        embed = discord.Embed(title=f"Top albums ({period})")
+        embed.set_author(name=member.display_name, icon_url=member.display_avatar.url)
+        embed.set_image(url="attachment://chart.jpg")
+        await ctx.send(embed=embed, file=discord.File(io.BytesIO(image), "chart.jpg"))
+
+    async def _album_cover(self, artist: str, title: str, url: Optional[str]) -> Optional[str]:
+        """Path of the cached cover. Albums without a cover on Last.fm get the one from Spotify."""
+        if not url or self.lastfm_placeholder in url:
+            try:
+                album = await search.search_spotify_album(f"{artist} {title}")
+            except tekore.HTTPError:
+                _log.warning(f"Could not search the cover of {artist} - {title}", exc_info=True)
+                return None
+            url = album.img_url if album else None
+        return await self.images.get(url) if url else None
 
     @hybrid_command(description="See who has the most plays of a track, album, or artist", aliases=["wk"])
     async def who_knows(self, ctx: Context, type: Literal["artist", "album", "track"], *, search_query: str = None):
@@ -402,7 +746,8 @@ class Music(Cog):
                                                member: discord.Member):
                 lfm = copy.copy(lfm)
                 lfm.username = self.get_lastfm_user(member)
-                playcount = await asyncio.to_thread(lfm.get_userplaycount)
+                with metrics.track("lastfm", "get_userplaycount"):
+                    playcount = await asyncio.to_thread(lfm.get_userplaycount)
                 return member, playcount
 
             coros = []
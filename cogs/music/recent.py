@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import discord
+import pylast
+
+# Paged view of the recent scrobbles of a user. Pages are fetched from Last.fm when they are first shown, and
+# the next page is prefetched while the user reads the current one. Each page continues at the oldest scrobble
+# of the previous one, so new scrobbles don't shift the pages while paging. The pages of a user are cached until
+# they were not used for `ttl` seconds, or are older than `max_age`, so reopening the view or paging back needs
+# no request.
+
+_log = logging.getLogger(__name__)
+
+Fetch = Callable[[str, int, Optional[int]], Awaitable[List[pylast.PlayedTrack]]]
+
+
+class RecentPages:
+    """The pages of one user, see :class:`RecentCache`."""
+
+    def __init__(self, username: str, fetch: Fetch, page_size: int):
+        self.username = username
+        self.created = self.used = time.monotonic()
+        self._fetch = fetch
+        self._page_size = page_size
+        self._pages: Dict[int, asyncio.Task] = {}
+
+    def ready(self, index: int) -> bool:
+        """Whether the page `index` was fetched already, so showing it needs no request."""
+        task = self._pages.get(index)
+        return bool(task and task.done() and not task.cancelled() and not task.exception())
+
+    def has_next(self, index: int) -> bool:
+        """Whether there may be a page after `index`, which must have been fetched."""
+        page = self._pages[index].result()
+        return len(page) >= self._page_size
+
+    async def get(self, index: int) -> List[pylast.PlayedTrack]:
+        """The page `index` (0 is the newest), and start fetching the page after it."""
+        self.used = time.monotonic()
+        page = await self._task(index)
+        if len(page) >= self._page_size:
+            self._task(index + 1)
+        return page
+
+    def _task(self, index: int) -> asyncio.Task:
+        task = self._pages.get(index)
+        if not task or (task.done() and (task.cancelled() or task.exception())):
+            # Start over after a failed fetch
+            task = self._pages[index] = asyncio.create_task(self._load(index))
+            task.add_done_callback(_retrieve_exception)
+        return task
+
+    async def _load(self, index: int) -> List[pylast.PlayedTrack]:
+        if index == 0:
+            return await self._fetch(self.username, self._page_size, None)
+
+        previous = await self._task(index - 1)
+        if not previous:
+            return []
+        # `to` is exclusive, so continue with the second of the oldest scrobble, which may have more scrobbles
+        # than fit on the previous page, and skip the ones that were shown already
+        boundary = int(previous[-1].timestamp)
+        seen = await self._seen_at(index - 1, boundary)
+        page = await self._fetch(self.username, self._page_size + seen, boundary + 1)
+        return page[seen:]
+
+    async def _seen_at(self, index: int, second: int) -> int:
+        """The number of scrobbles at `second` on the page `index` and the pages before it that end with it."""
+        seen = 0
+        for previous in range(index, -1, -1):
+            page = await self._task(previous)
+            seen += sum(1 for scrobble in page if int(scrobble.timestamp) == second)
+            if int(page[0].timestamp) != second:
+                break
+        return seen
+
+    def cancel(self):
+        for task in self._pages.values():
+            task.cancel()
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # A failed prefetch is only reported if the page is shown, and then fetched again
+    if not task.cancelled() and task.exception():
+        _log.debug("Could not fetch a page of recent scrobbles", exc_info=task.exception())
+
+
+class RecentCache:
+    """The pages of the users that looked at their recent scrobbles in the last `ttl` seconds.
+    Pages older than `max_age` are fetched again when the view is opened, to show new scrobbles."""
+
+    def __init__(self, fetch: Fetch, page_size: int = 10, ttl: float = 120.0, max_age: float = 600.0):
+        self.fetch = fetch
+        self.page_size = page_size
+        self.ttl = ttl
+        self.max_age = max_age
+        self._users: Dict[str, RecentPages] = {}
+
+    def get(self, username: str) -> RecentPages:
+        self._expire()
+        key = username.lower()
+        pages = self._users.get(key)
+        if not pages or time.monotonic() - pages.created > self.max_age:
+            pages = self._users[key] = RecentPages(username, self.fetch, self.page_size)
+        return pages
+
+    def _expire(self):
+        # The pages are not cancelled, a view may still show them. Their fetches end on their own.
+        now = time.monotonic()
+        for key, pages in list(self._users.items()):
+            if now - pages.used > self.ttl:
+                del self._users[key]
+
+    def clear(self):
+        for pages in self._users.values():
+            pages.cancel()
+        self._users.clear()
+
+
+class RecentView(discord.ui.View):
+    """Buttons to page through the recent scrobbles. Only the member who asked can use them."""
+
+    def __init__(self, pages: RecentPages, author: discord.abc.User, timeout: float = 180.0):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.author = author
+        self.index = 0
+        self.message: Optional[discord.Message] = None
+
+    async def embed(self, index: int = 0) -> discord.Embed:
+        """The embed of the page `index`, which becomes the current page. Updates the buttons to it."""
+        page = await self.pages.get(index)
+        self.index = index
+
+        embed = discord.Embed(title="Recent scrobbles")
+        embed.set_author(name=self.author.display_name, icon_url=self.author.display_avatar.url)
+        for scrobble in page:
+            embed.add_field(name=scrobble.track.title, value=scrobble.track.artist.name)
+        if not page:
+            embed.description = "No scrobbles." if index == 0 else "No older scrobbles."
+        embed.set_footer(text=f"Page {index + 1}")
+
+        self.newer.disabled = index == 0
+        self.older.disabled = not self.pages.has_next(index)
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author.id:
+            await interaction.response.send_message("Use `/last recent` to see your own scrobbles.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Newer", emoji="◀")
+    async def newer(self, interaction: discord.Interaction, _: discord.ui.Button):
+        await self._show(interaction, max(0, self.index - 1))
+
+    @discord.ui.button(label="Older", emoji="▶")
+    async def older(self, interaction: discord.Interaction, _: discord.ui.Button):
+        await self._show(interaction, self.index + 1)
+
+    async def _show(self, interaction: discord.Interaction, index: int):
+        if self.pages.ready(index):
+            await interaction.response.edit_message(embed=await self.embed(index), view=self)
+        else:
+            # Not prefetched yet, acknowledge in time and edit when the page is there
+            await interaction.response.defer()
+            await interaction.edit_original_response(embed=await self.embed(index), view=self)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item: discord.ui.Item):
+        if isinstance(error, pylast.PyLastError):
+            _log.warning("Last.fm did not respond on time.")
+            message = "There was an error while communicating with the Last.fm API, please try again later."
+        else:
+            _log.error("Unhandled error while paging the recent scrobbles", exc_info=error)
+            message = "Something went wrong."
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
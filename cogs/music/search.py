@@ -2,13 +2,15 @@ import asyncio
 import functools
 import logging
 import os
+import re
 from typing import Optional, Union, List
+from urllib.parse import urlsplit
 
 import discord
-import lyricsgenius
 import tekore
 from tekore.model import SimpleAlbum, FullAlbum, SimpleArtist, FullArtist, FullTrack
 
+from util import metrics
 from .classes import *
 
 # This module provides lookup functions for various music services
@@ -16,23 +18,57 @@ from .classes import *
 # - Before importing the module, the following environment vars need to be set:
 #       LAST_API_KEY, LAST_API_SECRET, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, GENIUS_CLIENT_SECRET
 # - pylast is not async, so calls should be wrapped in asyncio.to_thread
+# - For tests and benchmarks, the APIs can be redirected to another server (e.g. test/standin/music.py) with
+#   LASTFM_API_URL, SPOTIFY_API_URL and GENIUS_API_URL. pylast only supports https.
 
 _log = logging.getLogger(__name__)
 
+
+class _RedirectSender(tekore.ExtendingSender):
+    """Sends all Spotify API and account requests to another server."""
+
+    def __init__(self, base_url: str, sender: tekore.Sender):
+        super().__init__(sender)
+        self.base_url = base_url.rstrip("/")
+
+    def send(self, request: tekore.Request):
+        request.url = re.sub(r"^https://(api|accounts)\.spotify\.com", self.base_url, request.url)
+        return self.sender.send(request)
+
+
+def _spotify_sender(asynchronous: bool) -> tekore.Sender:
+    sender = tekore.AsyncSender() if asynchronous else tekore.SyncSender()
+    if "SPOTIFY_API_URL" in os.environ:
+        return _RedirectSender(os.environ["SPOTIFY_API_URL"], sender)
+    return sender
+
+
 # Init APIs
-# TODO This should be moved to some place where it's not being run on import
 lastfm_net = pylast.LastFMNetwork(
     api_key=(os.environ["LAST_API_KEY"]),
     api_secret=(os.environ["LAST_API_SECRET"]))
 
-spotify_api = tekore.Spotify(
-    tekore.request_client_token(
-        os.environ["SPOTIFY_CLIENT_ID"],
-        os.environ["SPOTIFY_CLIENT_SECRET"]),
-    asynchronous=True)
+if "LASTFM_API_URL" in os.environ:
+    _url = urlsplit(os.environ["LASTFM_API_URL"])
+    lastfm_net.ws_server = (_url.netloc, _url.path or "/2.0/")
 
-genius = lyricsgenius.Genius(
-    os.environ["GENIUS_CLIENT_SECRET"])
+# The client token is requested on first use, see _spotify
+spotify_api = tekore.Spotify(sender=_spotify_sender(asynchronous=True))
+_spotify_credentials = tekore.Credentials(
+    os.environ["SPOTIFY_CLIENT_ID"],
+    os.environ["SPOTIFY_CLIENT_SECRET"],
+    sender=_spotify_sender(asynchronous=True))
+_spotify_token_lock = asyncio.Lock()
+
+
+async def _spotify() -> tekore.Spotify:
+    """Return the Spotify client, after requesting a new client token if there is none yet or it expires soon."""
+    if spotify_api.token is None or spotify_api.token.is_expiring:
+        async with _spotify_token_lock:
+            if spotify_api.token is None or spotify_api.token.is_expiring:
+                with metrics.track("spotify", "token"):
+                    spotify_api.token = await _spotify_credentials.request_client_token()
+    return spotify_api
 
 
 def _get_lastfm_user(username: str) -> pylast.User:
@@ -44,7 +80,8 @@ def _get_lastfm_user(username: str) -> pylast.User:
 async def user_exists(username: str) -> bool:
     userobj = _get_lastfm_user(username)
     try:
-        await asyncio.to_thread(userobj.get_registered)
+        with metrics.track("lastfm", "user_exists"):
+            await asyncio.to_thread(userobj.get_registered)
         return True
     except pylast.WSError as err:
         if err.details == "User not found":
@@ -52,42 +89,48 @@ async def user_exists(username: str) -> bool:
         raise err
 
 
-async def get_recent(username: str) -> List[Track]:
+async def get_recent(username: str, limit: int = 10, time_to: Optional[int] = None) -> List[pylast.PlayedTrack]:
+    """The last `limit` scrobbles, or the last ones before `time_to`. Newest first, without the one now playing."""
     user = _get_lastfm_user(username)
-    return await asyncio.to_thread(user.get_recent_tracks)
+    with metrics.track("lastfm", "get_recent"):
+        return await asyncio.to_thread(user.get_recent_tracks, limit=limit, time_to=time_to, cacheable=False)
 
 
 async def get_scrobble(username: str) -> Optional[Scrobble]:
-    result = await asyncio.to_thread(lastfm_net.get_user(username).get_now_playing)
-    return await asyncio.to_thread(_pack_lastfm_track, result)
+    with metrics.track("lastfm", "get_scrobble"):
+        result = await asyncio.to_thread(lastfm_net.get_user(username).get_now_playing)
+        return await asyncio.to_thread(_pack_lastfm_track, result)
 
 
 async def search_lastfm_album(title: str, artist: str = "", exact=False) -> Optional[Album]:
-    if exact:
-        result = lastfm_net.get_album(artist, title)
-    else:
-        result = await asyncio.to_thread(lastfm_net.search_for_album(f"{title} {artist}").get_next_page)
-        result = result[0] if result else None
-    return await asyncio.to_thread(_pack_lastfm_album, result)
+    with metrics.track("lastfm", "search_lastfm_album"):
+        if exact:
+            result = lastfm_net.get_album(artist, title)
+        else:
+            result = await asyncio.to_thread(lastfm_net.search_for_album(f"{title} {artist}").get_next_page)
+            result = result[0] if result else None
+        return await asyncio.to_thread(_pack_lastfm_album, result)
 
 
 async def search_lastfm_track(title: str, artist: str = "", exact=False) -> Optional[Track]:
-    if exact:
-        result = lastfm_net.get_track(artist, title)
-    else:
-        result = await asyncio.to_thread(lastfm_net.search_for_track(artist, title).get_next_page)
-        result = result[0] if result else None
-    return await asyncio.to_thread(_pack_lastfm_track, result)
+    with metrics.track("lastfm", "search_lastfm_track"):
+        if exact:
+            result = lastfm_net.get_track(artist, title)
+        else:
+            result = await asyncio.to_thread(lastfm_net.search_for_track(artist, title).get_next_page)
+            result = result[0] if result else None
+        return await asyncio.to_thread(_pack_lastfm_track, result)
 
 
 async def search_lastfm_artist(artist: str, exact=False) -> Optional[Artist]:
-    if exact:
-        result = lastfm_net.get_artist(artist)
-    else:
-        result = await asyncio.to_thread(lastfm_net.search_for_artist(artist).get_next_page)
-        result = result[0] if result else None
+    with metrics.track("lastfm", "search_lastfm_artist"):
+        if exact:
+            result = lastfm_net.get_artist(artist)
+        else:
+            result = await asyncio.to_thread(lastfm_net.search_for_artist(artist).get_next_page)
+            result = result[0] if result else None
 
-    return await asyncio.to_thread(_pack_lastfm_artist, result)
+        return await asyncio.to_thread(_pack_lastfm_artist, result)
 
 
 def _pack_lastfm_artist(data: pylast.Artist) -> Optional[Artist]:
@@ -104,6 +147,44 @@ def _pack_lastfm_artist(data: pylast.Artist) -> Optional[Artist]:
     return result
 
 
+async def get_spotify_track(track_id: str) -> Optional[Track]:
+    with metrics.track("spotify", "track"):
+        result = await (await _spotify()).track(track_id)
+    return _pack_spotify_track(result)
+
+
+async def get_spotify_album(album_id: str) -> Optional[Album]:
+    with metrics.track("spotify", "album"):
+        result = await (await _spotify()).album(album_id)
+    return _pack_spotify_album(result)
+
+
+async def get_spotify_tracks(track_ids: List[str]) -> List[Optional[Track]]:
+    """The tracks of the ids, in requests of up to 50 ids. None for unknown ids."""
+    return await _get_spotify_many("tracks", track_ids, 50, _pack_spotify_track)
+
+
+async def get_spotify_albums(album_ids: List[str]) -> List[Optional[Album]]:
+    """The albums of the ids, in requests of up to 20 ids. None for unknown ids."""
+    return await _get_spotify_many("albums", album_ids, 20, _pack_spotify_album)
+
+
+async def _get_spotify_many(endpoint: str, ids: List[str], limit: int, pack) -> list:
+    spotify = await _spotify()
+    results = []
+    for start in range(0, len(ids), limit):
+        with metrics.track("spotify", endpoint):
+            batch = await getattr(spotify, endpoint)(ids[start:start + limit])
+        results += [pack(data) if data else None for data in batch]
+    return results
+
+
+async def get_spotify_artist(artist_id: str) -> Optional[Artist]:
+    with metrics.track("spotify", "artist"):
+        result = await (await _spotify()).artist(artist_id)
+    return _pack_spotify_artist(result)
+
+
 async def search_spotify_artist(query: str) -> Optional[Artist]:
     result = await _search_spotify(query, types=("artist",))  # type: FullArtist
     return _pack_spotify_artist(result)
@@ -113,7 +194,8 @@ async def search_spotify_album(query: str, extended=False) -> Optional[Album]:
     result = await _search_spotify(query, types=("album",))  # type: SimpleAlbum
 
     if extended and result:
-        result = await spotify_api.album(result.id)  # type: FullAlbum
+        with metrics.track("spotify", "album"):
+            result = await (await _spotify()).album(result.id)  # type: FullAlbum
 
     return _pack_spotify_album(result)
 
@@ -141,7 +223,8 @@ async def _search_spotify(*args, **kwargs) -> Union[FullTrack, SimpleAlbum, Full
     kwargs["limit"] = 1
 
     _log.debug(f"Querying Spotify: {args}, {kwargs}")
-    result = await spotify_api.search(*args, **kwargs)
+    with metrics.track("spotify", "search"):
+        result = await (await _spotify()).search(*args, **kwargs)
 
     # Try to extract the data object from the raw API response
     if result and result[0].items:
@@ -162,6 +245,7 @@ def _pack_spotify_track(data: FullTrack) -> Optional[Track]:
     result = Track()
     result.name = data.name
     result.url = data.external_urls["spotify"]
+    result.spotify_id = data.id
     result.album.name = data.album.name
     result.album.artist.name = _join_spotify_artists(data.album)
     result.album.img_url = data.album.images[0].url
@@ -180,6 +264,7 @@ def _pack_spotify_artist(data: Union[SimpleArtist, FullArtist]) -> Optional[Arti
     result.tags = ", ".join(data.genres)
     result.popularity = data.popularity
     result.url = data.external_urls["spotify"]
+    result.spotify_id = data.id
 
     if data.images:
         result.img_url = data.images[0].url
@@ -195,6 +280,7 @@ def _pack_spotify_album(data: Union[SimpleAlbum, FullAlbum]) -> Optional[Album]:
     result.name = data.name
     result.artist.name = _join_spotify_artists(data)
     result.url = data.external_urls["spotify"]
+    result.spotify_id = data.id
     result.img_url = data.images[0].url
     result.date = data.release_date
 
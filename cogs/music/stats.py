@@ -0,0 +1,285 @@
+import datetime
+import functools
+import re
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from .history import History
+
+# Listening statistics computed locally from the scrobble history (see history.py).
+# The scrobbles of a user are kept in memory as parallel integer arrays sorted by time, so a time window is
+# two binary searches and a top list one np.unique over the window, a few milliseconds even for years of history.
+# Days, weekdays and hours are in the configured timezone, with the daylight saving time of each day.
+
+# Periods that are relative to now, like the Last.fm chart periods
+relative_periods = {"7d": 7, "1m": 30, "3m": 90, "6m": 180, "12m": 365}
+
+_date_pattern = re.compile(r"^(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?$")
+
+
+def parse_range(text: str, tz: datetime.tzinfo, now: Optional[datetime.datetime] = None) \
+        -> Tuple[Optional[int], Optional[int]]:
+    """Parse a time range into (start, end) unix timestamps, end exclusive and None for open ends. Accepts
+    "all", the relative periods like "7d", a year, month or day like "2023", "2023-03" or "2023-03-14", and
+    ranges of those like "2023-01..2023-06", which include the whole last month. Raises ValueError."""
+    text = text.strip().lower()
+    now = now or datetime.datetime.now(tz)
+    if text == "all":
+        return None, None
+    if text in relative_periods:
+        return int((now - datetime.timedelta(days=relative_periods[text])).timestamp()), None
+
+    first, separator, last = text.partition("..")
+    if not separator:
+        last = first
+    start = _parse_date(first, tz, end=False) if first else None
+    end = _parse_date(last, tz, end=True) if last else None
+    if start is None and end is None:
+        raise ValueError(f"Invalid range {text}")
+    if start is not None and end is not None and start >= end:
+        raise ValueError(f"The range {text} ends before it starts")
+    return start, end
+
+
+def _parse_date(text: str, tz: datetime.tzinfo, end: bool) -> int:
+    """Start of the year, month or day, or with `end` the start of the following one."""
+    match = _date_pattern.match(text)
+    if not match:
+        raise ValueError(f"Invalid date {text}")
+    year, month, day = int(match.group(1)), match.group(2), match.group(3)
+    if day:
+        date = datetime.date(year, int(month), int(day))
+        date = date + datetime.timedelta(days=1) if end else date
+    elif month:
+        date = datetime.date(year, int(month), 1)
+        if end:
+            date = datetime.date(year + date.month // 12, date.month % 12 + 1, 1)
+    else:
+        date = datetime.date(year + 1 if end else year, 1, 1)
+    return int(datetime.datetime(date.year, date.month, date.day, tzinfo=tz).timestamp())
+
+
+@functools.lru_cache(maxsize=65536)
+def _day_offset(tz: datetime.tzinfo, day: int) -> int:
+    """UTC offset in seconds at noon of a UTC day."""
+    return int(datetime.datetime.fromtimestamp(day * 86400 + 43200, tz).utcoffset().total_seconds())
+
+
+def _run_starts(values: np.ndarray) -> np.ndarray:
+    """Mask of the elements that differ from their predecessor."""
+    starts = np.empty(len(values), dtype=bool)
+    starts[:1] = True
+    np.not_equal(values[1:], values[:-1], out=starts[1:])
+    return starts
+
+
+class Plays:
+    """Scrobbles of one user as parallel arrays, sorted by time. Albums are -1 if unknown."""
+    __slots__ = ["times", "artists", "albums", "tracks"]
+
+    def __init__(self, times: np.ndarray, artists: np.ndarray, albums: np.ndarray, tracks: np.ndarray):
+        self.times = times
+        self.artists = artists
+        self.albums = albums
+        self.tracks = tracks
+
+    @classmethod
+    def from_rows(cls, rows: List[tuple]) -> "Plays":
+        """From (time, artist, track, album) rows as returned by :meth:`History.plays`."""
+        count = len(rows)
+        times = np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+        artists = np.fromiter((row[1] for row in rows), dtype=np.int32, count=count)
+        tracks = np.fromiter((row[2] for row in rows), dtype=np.int32, count=count)
+        albums = np.fromiter((-1 if row[3] is None else row[3] for row in rows), dtype=np.int32, count=count)
+        return cls(times, artists, albums, tracks)
+
+    @classmethod
+    def concatenate(cls, parts: List["Plays"]) -> "Plays":
+        return cls(*[np.concatenate([getattr(part, name) for part in parts]) for name in cls.__slots__])
+
+    def __len__(self):
+        return len(self.times)
+
+    def window(self, start: Optional[int] = None, end: Optional[int] = None) -> "Plays":
+        """The plays with start <= time < end, as views of the arrays."""
+        first = np.searchsorted(self.times, start, side="left") if start is not None else 0
+        last = np.searchsorted(self.times, end, side="left") if end is not None else len(self.times)
+        return Plays(*[getattr(self, name)[first:last] for name in self.__slots__])
+
+    def top(self, kind: str, count: int = 10) -> List[Tuple[int, int]]:
+        """The `count` most played (id, plays) of "artists", "albums" or "tracks", most played first.
+        Ties are ordered by id, so the result is stable."""
+        ids = getattr(self, kind)
+        if kind == "albums":
+            ids = ids[ids >= 0]
+        unique, counts = np.unique(ids, return_counts=True)
+        if len(unique) > count:
+            # Only sort the candidates, np.unique already sorted the ids for the tie-break
+            candidates = np.argpartition(-counts, count - 1)[:count]
+            threshold = counts[candidates].min()
+            candidates = np.flatnonzero(counts >= threshold)
+        else:
+            candidates = np.arange(len(unique))
+        order = candidates[np.lexsort((unique[candidates], -counts[candidates]))][:count]
+        return [(int(unique[i]), int(counts[i])) for i in order]
+
+    def local_days(self, tz: datetime.tzinfo) -> Tuple[np.ndarray, np.ndarray]:
+        """The local day number (days since 1970-01-01) and the local second of the day of every play."""
+        local = self.times + self._utc_offsets(tz)
+        return local // 86400, local % 86400
+
+    def _utc_offsets(self, tz: datetime.tzinfo) -> np.ndarray:
+        if tz is datetime.timezone.utc:
+            return np.zeros(len(self.times), dtype=np.int64)
+
+        if not len(self.times):
+            return np.zeros(0, dtype=np.int64)
+
+        # The offset only changes with daylight saving time, so look it up once per UTC day.
+        # The times are sorted, so every day is one run in the array.
+        utc_days = self.times // 86400
+        new_day = _run_starts(utc_days)
+        offsets = np.array([_day_offset(tz, int(day)) for day in utc_days[new_day]], dtype=np.int64)
+        return offsets[np.cumsum(new_day) - 1]
+
+    def by_hour(self, tz: datetime.tzinfo) -> np.ndarray:
+        """Plays per local hour of the day, index 0 is midnight."""
+        _, seconds = self.local_days(tz)
+        return np.bincount(seconds // 3600, minlength=24)
+
+    def by_weekday(self, tz: datetime.tzinfo) -> np.ndarray:
+        """Plays per local weekday, index 0 is Monday."""
+        days, _ = self.local_days(tz)
+        # 1970-01-01 was a Thursday
+        return np.bincount((days + 3) % 7, minlength=7)
+
+    def streaks(self, tz: datetime.tzinfo, today: Optional[int] = None) -> Dict[str, int]:
+        """The longest run of consecutive days with plays, and the current one (which may end yesterday)."""
+        days = self.local_days(tz)[0]
+        # Local days are sorted as well, except around DST changes at midnight in a few timezones
+        days = days[_run_starts(days)] if np.all(days[1:] >= days[:-1]) else np.unique(days)
+        if not len(days):
+            return {"longest": 0, "current": 0, "days": 0}
+
+        # Split into runs wherever there is a gap of more than one day
+        breaks = np.flatnonzero(np.diff(days) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        lengths = np.diff(np.concatenate((starts, [len(days)])))
+
+        if today is None:
+            now = datetime.datetime.now(tz)
+            today = int(now.timestamp() + now.utcoffset().total_seconds()) // 86400
+        current = int(lengths[-1]) if days[-1] >= today - 1 else 0
+        return {"longest": int(lengths.max()), "current": current, "days": len(days)}
+
+
+class Stats:
+    """Keeps the plays of recently queried users in memory, and loads only the scrobbles that were synced or
+    backfilled since the last query."""
+
+    def __init__(self, history: History, max_users: int = 50):
+        self.history = history
+        self.max_users = max_users
+        self._plays: Dict[str, Plays] = {}
+
+    async def plays(self, username: str) -> Plays:
+        key = username.lower()
+        count = (await self.history.status(username))[0]
+        plays = self._plays.pop(key, None)
+
+        if plays is not None and len(plays) != count and len(plays):
+            # Syncs only add newer scrobbles and the backfill only older ones
+            newer = Plays.from_rows(await self.history.plays(username, start=int(plays.times[-1]) + 1))
+            older = Plays.from_rows(await self.history.plays(username, end=int(plays.times[0])))
+            plays = Plays.concatenate([older, plays, newer])
+        if plays is None or len(plays) != count:
+            # Scrobbles within the same second as a boundary were missed, or nothing is loaded yet
+            plays = Plays.from_rows(await self.history.plays(username))
+
+        self._plays[key] = plays
+        _evict(self._plays, self.max_users)
+        return plays
+
+    async def top(self, username: str, kind: str, start: Optional[int] = None, end: Optional[int] = None,
+                  count: int = 10) -> List[Tuple[str, str, int]]:
+        """The most played items of `kind` as (artist, title, plays). For artists, the title is empty."""
+        plays = (await self.plays(username)).window(start, end)
+        top = plays.top(kind, count)
+        titles = await self.history.titles(kind, [item for item, _ in top])
+        return [(*titles[item], weight) for item, weight in top]
+
+
+def timezone(name: Optional[str]) -> datetime.tzinfo:
+    return ZoneInfo(name) if name else datetime.timezone.utc
+
+
+class GuildCharts:
+    """Top lists of all registered members of a guild, merged from the counts of each member.
+    The counts per member and the merged top lists are cached with the history version of each member, so only
+    members with new scrobbles are counted again, and a top list is only merged again if any of them changed."""
+
+    def __init__(self, history: History, max_members: int = 5000, max_guilds: int = 200):
+        self.history = history
+        self.max_members = max_members
+        self.max_guilds = max_guilds
+        # (username, kind, start, end) -> (version, ids, counts)
+        self._members: Dict[tuple, Tuple[tuple, np.ndarray, np.ndarray]] = {}
+        # (guild id, kind, start, end, count) -> (versions, top)
+        self._guilds: Dict[tuple, Tuple[Dict[str, tuple], list]] = {}
+
+    async def top(self, guild_id: int, usernames: List[str], kind: str, start: Optional[int] = None,
+                  end: Optional[int] = None, count: int = 10) -> Tuple[List[Tuple[str, str, int, int]], int]:
+        """The most played items of `kind` as (artist, title, plays, listeners), and the number of members with
+        a history. For relative periods, round `start` so the cached results can be used for a while."""
+        versions = await self.history.versions(usernames)
+        key = (guild_id, kind, start, end, count)
+        cached = self._guilds.pop(key, None)
+        if cached and cached[0] == versions:
+            self._guilds[key] = cached
+            return cached[1], len(versions)
+
+        contributions = [await self.member_counts(name, version, kind, start, end)
+                         for name, version in versions.items()]
+        top = await self._merge(contributions, kind, count)
+
+        self._guilds[key] = (versions, top)
+        _evict(self._guilds, self.max_guilds)
+        return top, len(versions)
+
+    async def member_counts(self, username: str, version: tuple, kind: str, start: Optional[int],
+                            end: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """The distinct ids of `kind` a user played in the window, and their play counts.
+        `version` is the user's version from :meth:`History.versions`."""
+        key = (username, kind, start, end)
+        cached = self._members.pop(key, None)
+        if not cached or cached[0] != version:
+            # Only the window is loaded, and not kept, as there may be many more members than Stats keeps
+            ids = getattr(Plays.from_rows(await self.history.plays(username, start, end)), kind)
+            if kind == "albums":
+                ids = ids[ids >= 0]
+            cached = (version, *np.unique(ids, return_counts=True))
+        self._members[key] = cached
+        _evict(self._members, self.max_members)
+        return cached[1], cached[2]
+
+    async def _merge(self, contributions: List[Tuple[np.ndarray, np.ndarray]], kind: str, count: int) \
+            -> List[Tuple[str, str, int, int]]:
+        if not contributions:
+            return []
+        ids = np.concatenate([ids for ids, _ in contributions])
+        unique, inverse = np.unique(ids, return_inverse=True)
+        plays = np.bincount(inverse, weights=np.concatenate([counts for _, counts in contributions]))
+        # Every member contributes each id once
+        listeners = np.bincount(inverse)
+
+        order = np.lexsort((unique, -listeners, -plays))[:count]
+        titles = await self.history.titles(kind, unique[order].tolist())
+        return [(*titles[int(unique[i])], int(plays[i]), int(listeners[i])) for i in order]
+
+
+def _evict(cache: dict, size: int):
+    """Drop the least recently used entries, which are first as entries are moved to the end on use."""
+    while len(cache) > size:
+        del cache[next(iter(cache))]
@@ -0,0 +1,85 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .stats import GuildCharts, _evict
+
+# Taste compatibility of registered members, from the artist play counts of their local history.
+# Every member is a sparse vector over all artists, weighted with log(1 + plays) so a few heavily played artists
+# don't dominate. With the rows normalized, the cosine similarity of all pairs of a guild is one sparse product of
+# the matrix with its transpose. scipy is only imported on first use.
+
+
+class Similarity:
+    """Cosine similarities between the members of a guild."""
+
+    def __init__(self, usernames: List[str], artists: np.ndarray, matrix, similarity: np.ndarray):
+        self.usernames = usernames
+        self.index = {name: i for i, name in enumerate(usernames)}
+        # Artist id of every column of the matrix
+        self.artists = artists
+        self.matrix = matrix
+        self.similarity = similarity
+
+    def __contains__(self, username: str):
+        return username.lower() in self.index
+
+    def pair(self, a: str, b: str) -> float:
+        return float(self.similarity[self.index[a.lower()], self.index[b.lower()]])
+
+    def shared(self, a: str, b: str, count: int = 5) -> List[int]:
+        """The artist ids contributing the most to the similarity of two users."""
+        product = self.matrix[self.index[a.lower()]].multiply(self.matrix[self.index[b.lower()]]).tocoo()
+        order = np.argsort(-product.data, kind="stable")[:count]
+        return [int(self.artists[product.col[i]]) for i in order]
+
+    def most_similar(self, count: int = 10) -> List[Tuple[str, str, float]]:
+        """The most similar pairs of different users."""
+        upper = np.triu(self.similarity, k=1)
+        pairs = np.argsort(-upper, axis=None, kind="stable")[:count]
+        result = []
+        for a, b in zip(*np.unravel_index(pairs, upper.shape)):
+            if upper[a, b] > 0:
+                result.append((self.usernames[a], self.usernames[b], float(upper[a, b])))
+        return result
+
+
+class Compatibility:
+    """Builds the similarities of a guild from the artist counts cached by :class:`GuildCharts`, and caches them
+    until a member of the guild has new scrobbles."""
+
+    def __init__(self, charts: GuildCharts, max_guilds: int = 100):
+        self.charts = charts
+        self.max_guilds = max_guilds
+        # guild id -> (versions, similarity)
+        self._guilds: Dict[int, Tuple[Dict[str, tuple], Similarity]] = {}
+
+    async def similarity(self, guild_id: int, usernames: List[str]) -> Similarity:
+        versions = await self.charts.history.versions(usernames)
+        cached = self._guilds.pop(guild_id, None)
+        if not cached or cached[0] != versions:
+            counts = [await self.charts.member_counts(name, version, "artists", None, None)
+                      for name, version in versions.items()]
+            cached = (versions, self._build(list(versions), counts))
+
+        self._guilds[guild_id] = cached
+        _evict(self._guilds, self.max_guilds)
+        return cached[1]
+
+    @staticmethod
+    def _build(usernames: List[str], counts: List[Tuple[np.ndarray, np.ndarray]]) -> Similarity:
+        from scipy import sparse
+
+        if not counts:
+            return Similarity([], np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, 0)), np.zeros((0, 0)))
+
+        ids = np.concatenate([artists for artists, _ in counts])
+        artists, columns = np.unique(ids, return_inverse=True)
+        rows = np.repeat(np.arange(len(counts)), [len(artists) for artists, _ in counts])
+        weights = np.log1p(np.concatenate([plays for _, plays in counts]).astype(np.float64))
+        matrix = sparse.csr_matrix((weights, (rows, columns)), shape=(len(counts), len(artists)))
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+        return Similarity(usernames, artists, matrix.tocsr(), (matrix @ matrix.T).toarray())
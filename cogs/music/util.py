@@ -41,6 +41,9 @@ col2_width = 22
 
 tbl_format = "{:>2}|{:#.#}|{:$.$}|{:>4}\n".replace("#", str(col1_width)).replace("$", str(col2_width))
 tbl_artist_format = "{:>2}|{:#.#}|{:>4}\n".replace("#", str(col1_width + col2_width + 1))
+# With a column for the number of listeners, for server charts
+tbl_server_format = "{:>2}|{:#.#}|{:$.$}|{:>4}|{:>3}\n".replace("#", str(col1_width)).replace("$", str(col2_width - 4))
+tbl_server_artist_format = "{:>2}|{:#.#}|{:>4}|{:>3}\n".replace("#", str(col1_width + col2_width - 3))
 
 
 def make_table(format_string, cols: dict):
@@ -52,3 +55,12 @@ def make_table(format_string, cols: dict):
 
     table += "```"
     return table
+
+
+def make_bars(labels, values, width=20) -> str:
+    """Horizontal bar chart as a code block, one line per label."""
+    highest = max(max(values, default=0), 1)
+    label_width = max((len(str(label)) for label in labels), default=0)
+    lines = [f"{str(label):>{label_width}} {'█' * round(value * width / highest):<{width}} {value}"
+             for label, value in zip(labels, values)]
+    return "```\n" + "\n".join(lines) + "\n```"
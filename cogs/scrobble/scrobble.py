@@ -1,7 +1,7 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import timedelta
 
-from discord import Member, Spotify
+from discord import Member, Spotify, utils
 from discord.ext.commands import Cog
 
 from cogs.music.classes import Track
@@ -13,7 +13,7 @@ class Scrobble(Cog):
 
     @Cog.listener()
     async def on_member_update(self, before: Member, after: Member):
-        now = datetime.utcnow()
+        now = utils.utcnow()
 
         # See if there actually was an activity change and not something else
         if before.activity is not after.activity:
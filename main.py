@@ -1,12 +1,21 @@
+import ast
+import asyncio
+import glob
+import importlib.util
 import logging
 import os
+import time
+import weakref
 
-from discord import Intents
+from discord import HTTPException, Intents
 from discord.ext import commands
 from discord.ext.commands import CommandError, Context
 from dotenv import load_dotenv
 
+from util import get_command, metrics, slash, tracing
 from util.config import Config
+from util.store import SQLiteStore
+from util.watchdog import Watchdog
 
 log = logging.getLogger(__name__)
 
@@ -16,11 +25,31 @@ def main():
 
     load_dotenv(verbose=True)
 
-    bot = DamaBot()
+    use_store()
+    if "SHARD_COUNT" in os.environ or "SHARD_IDS" in os.environ:
+        shard_ids = [int(i) for i in os.environ["SHARD_IDS"].split(",")] if "SHARD_IDS" in os.environ else None
+        shard_count = int(os.environ["SHARD_COUNT"]) if "SHARD_COUNT" in os.environ else None
+        bot = ShardedDamaBot(shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = DamaBot()
     # https://discordpy.readthedocs.io/en/stable/logging.html
     bot.run(os.environ["DISCORD_TOKEN"], log_handler=None)
 
 
+def use_store():
+    """Keep the configs in a SQLite store if CONFIG_STORE is set, so multiple processes can share them.
+    CONFIG_STORE is the path of the database, or "1" for DATA_DIR/store.db."""
+    path = os.environ.get("CONFIG_STORE")
+    if not path:
+        return
+    if path == "1":
+        datadir = os.environ.get("DATA_DIR", "./data/")
+        os.makedirs(datadir, exist_ok=True)
+        path = os.path.join(datadir, "store.db")
+    log.info(f"Using config store {path}")
+    Config.use_store(SQLiteStore(path))
+
+
 def setup_logging():
     _loglevel = os.environ["LOG_LEVEL"] if "LOG_LEVEL" in os.environ else "DEBUG"
     logging.basicConfig(level=_loglevel, format="%(levelname)-7s | %(asctime)s | %(name)-18s | %(message)s")
@@ -28,42 +57,199 @@ def setup_logging():
     logging.getLogger("pylast").setLevel("INFO")
 
 
+class TracedContext(Context):
+    """Records every message sent for a command as a span of its trace."""
+
+    async def send(self, *args, **kwargs):
+        with tracing.span("discord", operation="send"):
+            return await super().send(*args, **kwargs)
+
+
+def import_dependencies(cog: str):
+    """Import the modules the cog imports at the top of its files, without executing the cog. Modules of
+    the cogs package are skipped, importing them would execute the cog they belong to."""
+    spec = importlib.util.find_spec(cog)
+    if not spec or not spec.origin:
+        return
+
+    paths = [spec.origin]
+    for location in spec.submodule_search_locations or []:
+        paths += [path for path in glob.glob(os.path.join(location, "*.py")) if path != spec.origin]
+
+    names = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            tree = ast.parse(file.read(), path)
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names.add(node.module)
+
+    for name in sorted(names):
+        if name == "cogs" or name.startswith("cogs."):
+            continue
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            # Reported when the cog itself is loaded
+            pass
+
+
 class DamaBot(commands.Bot):
 
     def __init__(self, **kwargs):
         # Init client with all intents enabled
         kwargs["intents"] = Intents.all()
         super().__init__(command_prefix=os.environ["PREFIX"], **kwargs)
+        self.watchdog = Watchdog()
+        self.before_invoke(self._on_before_invoke)
+        self.after_invoke(self._on_after_invoke)
+        self._command_start = weakref.WeakKeyDictionary()
+        self._traces = weakref.WeakKeyDictionary()
+        self._metrics_server = None
+        self._autosync = None
+        # Seconds per startup phase, logged once the bot is ready
+        self.startup = {}
+        self._created = time.perf_counter()
 
     async def setup_hook(self):
+        start = time.perf_counter()
+        self.startup["login"] = start - self._created
+        self.watchdog.start()
         config = Config("admin")
+        tracing.configure()
+        tracing.setup_export(os.path.join(config.datadir, "traces.jsonl"))
+
+        executor = metrics.Executor()
+        asyncio.get_running_loop().set_default_executor(executor)
+
+        metrics.Gauge("damabot_loop_lag_seconds", "Event loop lag percentiles and maximum over the recent history",
+                      ["stat"], callback=lambda: {(stat,): v for stat, v in self.watchdog.percentiles().items()})
+        metrics.Counter("damabot_loop_blocked_total", "Times the event loop was blocked for longer than the threshold",
+                        callback=lambda: {(): self.watchdog.blocked})
+        metrics.Gauge("damabot_executor_queue_depth", "Calls waiting for a thread in the default executor",
+                      callback=lambda: {(): executor.waiting})
+        metrics.Gauge("damabot_startup_seconds", "Duration of the startup phases", ["phase"],
+                      callback=lambda: {(phase,): seconds for phase, seconds in self.startup.items()})
+        if "METRICS_PORT" in os.environ:
+            self._metrics_server = await metrics.start_server(os.environ.get("METRICS_HOST", "127.0.0.1"),
+                                                              int(os.environ["METRICS_PORT"]))
 
         # This should always be loaded, else we can't manage cogs at all
         await self.load_ext("cogs.admin")
 
-        if "cogs.enabled" in config.data:
-            for cog in config.data["cogs.enabled"]:
-                await self.load_ext(cog)
+        # The cogs don't depend on each other, so load them concurrently
+        await asyncio.gather(*[self.load_ext(cog) for cog in config.data.get("cogs.enabled", [])])
+
+        # Doesn't need to delay the gateway connection
+        if self.is_primary and config.data.get("slash.autosync", True):
+            self._autosync = asyncio.create_task(self._sync_slash())
+        self.startup["setup"] = time.perf_counter() - start
+
+    async def _sync_slash(self):
+        # Cheap unless the commands changed, as only changed command trees are uploaded
+        start = time.perf_counter()
+        try:
+            await slash.sync_all(self)
+        except HTTPException as e:
+            log.warning(f"Could not sync slash commands: {e}")
+        self.startup["slash.sync"] = time.perf_counter() - start
+
+    @property
+    def is_primary(self) -> bool:
+        """Whether this process does the work that is only done once per bot, like syncing slash commands."""
+        return True
 
     async def load_ext(self, cog: str):
         if cog not in self.extensions:
             log.info(f"Loading {cog}")
+            start = time.perf_counter()
+            # Import the dependencies of the cog in a thread, so imports of concurrently loaded cogs overlap.
+            # The cog modules themselves are only executed by load_extension.
+            await asyncio.to_thread(import_dependencies, cog)
+            imported = time.perf_counter()
             await self.load_extension(cog)
+            self.startup[f"{cog}.import"] = imported - start
+            self.startup[f"{cog}.setup"] = time.perf_counter() - imported
+
+    def _report_startup(self):
+        if "ready" in self.startup:
+            return
+        self.startup["ready"] = time.perf_counter() - self._created
+
+        cogs = sorted({phase.rsplit(".", 1)[0] for phase in self.startup if phase.endswith(".import")})
+        details = ", ".join(f"{cog} {self.startup[cog + '.import']:.2f}s + {self.startup[cog + '.setup']:.2f}s"
+                            for cog in cogs)
+        log.info(f"Ready {self.startup['ready']:.2f}s after start. Login {self.startup['login']:.2f}s, "
+                 f"setup {self.startup['setup']:.2f}s, cogs (import + setup): {details}")
+
+    async def close(self):
+        self.watchdog.stop()
+        if self._autosync:
+            self._autosync.cancel()
+        tracing.stop_export()
+        if self._metrics_server:
+            await self._metrics_server.cleanup()
+        await super().close()
+
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        metrics.events.inc(event=event_name)
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def get_context(self, origin, /, *, cls=TracedContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def _on_before_invoke(self, ctx: Context):
+        self._command_start[ctx] = time.perf_counter()
+        self.watchdog.set_context(get_command(ctx))
+        trace = tracing.start_trace(ctx.command.qualified_name, invocation=get_command(ctx))
+        if trace:
+            self._traces[ctx] = trace
+
+    async def _on_after_invoke(self, ctx: Context):
+        self.watchdog.clear_context()
+        tracing.finish_trace(self._traces.pop(ctx, None))
+        start = self._command_start.pop(ctx, None)
+        if start:
+            metrics.commands.observe(time.perf_counter() - start, command=ctx.command.qualified_name)
 
     async def on_ready(self):
         log.info(f"Online as {self.user.name}. ID: {self.user.id}")
+        self._report_startup()
 
     async def on_command_error(self, ctx: Context, error: CommandError):
+        original = error.original if isinstance(error, commands.CommandInvokeError) else error
+        metrics.command_errors.inc(command=ctx.command.qualified_name if ctx.command else "unknown",
+                                   error=original.__class__.__name__)
+
         if isinstance(error, commands.MissingRequiredArgument):
             await ctx.reply("Missing argument '" + error.param.name + "'")
         elif isinstance(error, commands.CommandNotFound):
             await ctx.reply("Unknown command.")
         elif isinstance(error, CommandError):
-            log.warning("Passing CommandError", error)
+            log.warning(f"Passing CommandError: {error}")
         else:
             log.error(f"Error during command: {ctx.message.clean_content}", exc_info=error)
         await super().on_command_error(ctx, error)
 
 
+class ShardedDamaBot(DamaBot, commands.AutoShardedBot):
+    """DamaBot running several shards in one process. Pass `shard_ids` to only run a part of the shards,
+    with the others running in other processes (see cluster.py)."""
+
+    @property
+    def is_primary(self) -> bool:
+        return self.shard_ids is None or 0 in self.shard_ids
+
+    async def on_ready(self):
+        shards = ", ".join(str(i) for i in sorted(self.shards))
+        log.info(f"Online as {self.user.name}. ID: {self.user.id}. Shards {shards} of {self.shard_count}")
+        self._report_startup()
+
+    async def on_shard_ready(self, shard_id: int):
+        log.info(f"Shard {shard_id} ready")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, Iterable
+
+# Helpers shared by the benchmark scripts (test/bench_*.py). The benchmarks are not collected by pytest,
+# run them with `python -m test.bench_<name>` from the repository root.
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(values: Iterable[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    values = list(values)
+    return {
+        "n": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(name: str, results: dict, output: str = None):
+    """Print the results as a table, and optionally append them as one json line to `output`,
+    so runs can be compared across commits."""
+    print(f"\n{name} @ {git_revision()}")
+    _print_results(results, 1)
+
+    if output:
+        with open(output, "a") as file:
+            file.write(json.dumps({"benchmark": name, "revision": git_revision(), "results": results}) + "\n")
+
+
+def _print_results(results: dict, depth: int):
+    for key, value in results.items():
+        if isinstance(value, dict) and any(isinstance(v, dict) for v in value.values()):
+            print("  " * depth + str(key))
+            _print_results(value, depth + 1)
+        elif isinstance(value, dict):
+            print("  " * depth + f"{key:<28} " + "  ".join(f"{k}={v}" for k, v in value.items()))
+        else:
+            print("  " * depth + f"{key:<28} {value}")
+
+
+def setup_environment():
+    """Prepare the environment for instantiating DamaBot without any real credentials or data."""
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"))
+    os.environ.setdefault("PREFIX", ".")
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="damabot-bench-")
+
+
+async def start_music_standin(**kwargs):
+    """Start a :class:`test.standin.music.MusicStandin` and point the music search module to it.
+    Must run before anything imports cogs.music."""
+    from test.standin.music import MusicStandin
+
+    standin = MusicStandin(**kwargs)
+    await standin.start(tls=True)
+    os.environ.update({
+        "LAST_API_KEY": "standin", "LAST_API_SECRET": "standin", "SPOTIFY_CLIENT_ID": "standin",
+        "SPOTIFY_CLIENT_SECRET": "standin", "GENIUS_CLIENT_SECRET": "standin",
+        "LASTFM_API_URL": standin.tls_url + "/2.0/", "SPOTIFY_API_URL": standin.url, "GENIUS_API_URL": standin.url,
+    })
+
+    import pylast
+    pylast.SSL_CONTEXT.load_verify_locations(standin.cafile)
+    return standin
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import time
+
+from test.bench import report, setup_environment, summarize
+from test.standin.ai import AIStandin
+
+# End-to-end benchmark of the AI path against the local stand-in server, no network access required:
+# - provider: concurrent chat requests, which queue up in the provider's connection pool
+# - stream: time to first chunk, and the message edits a streamed answer would cause
+# - command: /chatgpt invoked through dpytest, including the splitting and sending of the answer
+
+
+async def bench_provider(provider, requests: int) -> dict:
+    async def timed():
+        start = time.perf_counter()
+        await provider.chat([{"role": "user", "content": "Tell me a joke"}], model="bench")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    durations = await asyncio.gather(*[timed() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+    return {"latency": summarize(durations), "throughput_rps": round(requests / elapsed, 2)}
+
+
+async def bench_stream(provider, requests: int, edit_interval: float) -> dict:
+    first_chunk, total, edits = [], [], []
+
+    for _ in range(requests):
+        start = last_edit = time.perf_counter()
+        count = 0
+        first = None
+
+        async for _ in provider.stream_chat([{"role": "user", "content": "Tell me a joke"}], model="bench"):
+            now = time.perf_counter()
+            first = first or now - start
+            # Discord allows about one edit per second on a message, so only edit on that interval
+            if now - last_edit >= edit_interval:
+                count += 1
+                last_edit = now
+
+        first_chunk.append(first)
+        total.append(time.perf_counter() - start)
+        edits.append(count + 1)
+
+    return {"first_chunk": summarize(first_chunk), "total": summarize(total), "edits_per_answer": max(edits)}
+
+
+async def bench_command(requests: int) -> dict:
+    import discord.ext.test as dpytest
+    from main import DamaBot
+
+    bot = DamaBot()
+    dpytest.configure(bot)
+    # dpytest replaces the connection state, so initialise the loop afterwards
+    await bot._async_setup_hook()
+    await bot.load_extension("cogs.gpt")
+
+    durations, messages = [], 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        await dpytest.message(".chatgpt Tell me a joke")
+        durations.append(time.perf_counter() - start)
+
+        while not dpytest.sent_queue.empty():
+            await dpytest.sent_queue.get()
+            messages += 1
+
+    await bot.unload_extension("cogs.gpt")
+    return {"latency": summarize(durations), "messages_per_answer": round(messages / requests, 2)}
+
+
+async def main(args):
+    setup_environment()
+
+    from cogs.gpt import ai
+    from cogs.gpt.providers import HTTPProvider
+
+    standin = AIStandin(latency=args.latency, token_delay=args.token_delay, tokens=args.tokens)
+    async with standin:
+        provider = HTTPProvider(standin.url + "/v1", max_connections=args.connections)
+        ai.set_provider(provider)
+
+        results = {
+            "provider": await bench_provider(provider, args.requests),
+            "stream": await bench_stream(provider, min(args.requests, 10), args.edit_interval),
+            "command": await bench_command(min(args.requests, 10)),
+            "server_calls": sum(standin.calls.values()),
+        }
+        await provider.close()
+
+    report("ai", results, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--connections", type=int, default=10, help="Connection pool size of the provider")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--tokens", type=int, default=800)
+    parser.add_argument("--edit-interval", type=float, default=1.0)
+    parser.add_argument("--output", help="Append the results to this jsonl file")
+    asyncio.run(main(parser.parse_args()))
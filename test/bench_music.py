@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import collections
+import time
+
+from discord.ext.commands import CommandError
+
+from test.bench import report, setup_environment, start_music_standin, summarize
+from test.standin.music import MusicStandin
+
+# End-to-end benchmark of the music commands against the local Last.fm/Spotify/Genius stand-in, no network
+# access or credentials required. Each command is invoked through dpytest by a registered member without a
+# Spotify activity, so the commands that fall back to the current scrobble take that path as well.
+# Reports the latency per command, and how many calls to each service one invocation caused.
+
+commands = {
+    "now": ".last now",
+    "album": ".album",
+    "album_search": ".album In Rainbows",
+    "artist": ".artist",
+    "who_knows": ".wk artist",
+    "tracks": ".last tracks 7d",
+    "albums": ".last albums 1m",
+    "artists": ".last artists all",
+    "lyricsgenius": ".lyricsgenius",
+}
+
+
+async def bench_command(dpytest, standin: MusicStandin, content: str, runs: int) -> dict:
+    from util import metrics
+
+    durations = []
+    calls_before = collections.Counter(standin.calls)
+    errors_before = sum(metrics.command_errors.values.values())
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            await dpytest.message(content)
+        except CommandError:
+            # Already counted in the metrics, and answered by the error handler
+            pass
+        durations.append(time.perf_counter() - start)
+        await dpytest.empty_queue()
+
+    calls = collections.Counter()
+    for name, count in (collections.Counter(standin.calls) - calls_before).items():
+        calls[name.split()[0]] += count
+
+    return {
+        "latency": summarize(durations),
+        "calls_per_run": {service: round(count / runs, 2) for service, count in sorted(calls.items())},
+        "errors": sum(metrics.command_errors.values.values()) - errors_before,
+    }
+
+
+async def main(args):
+    setup_environment()
+
+    standin = await start_music_standin(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                        seed=args.seed)
+
+    import discord.ext.test as dpytest
+    from main import DamaBot
+    from util.config import Config
+
+    bot = DamaBot()
+    dpytest.configure(bot, members=args.members)
+    # dpytest replaces the connection state, so initialise the loop afterwards
+    await bot._async_setup_hook()
+    await bot.load_extension("cogs.music")
+
+    config = Config("music")
+    for i, member in enumerate(dpytest.get_config().members):
+        config.data["names"][str(member.id)] = f"standin{i}"
+    config.save()
+
+    selected = args.commands.split(",") if args.commands else commands
+    results = {}
+    for name in selected:
+        results[name] = await bench_command(dpytest, standin, commands[name], args.runs)
+
+    await bot.unload_extension("cogs.music")
+    await standin.stop()
+
+    results["settings"] = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+                           "members": args.members, "runs": args.runs}
+    report("music", results, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20, help="Invocations per command")
+    parser.add_argument("--members", type=int, default=10, help="Registered members in the guild, for who_knows")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds until each stand-in response starts")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stand-in requests that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--commands", help=f"Comma separated subset of: {', '.join(commands)}")
+    parser.add_argument("--output", help="Append the results to this jsonl file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import resource
+import time
+import tracemalloc
+
+from test.bench import report, setup_environment, start_music_standin, summarize
+
+# Load generator for presence and member updates in large guilds. The updates are replayed as raw gateway
+# payloads through the client's connection state, so the measurement covers the json decoding, discord.py's
+# member and activity parsing, the event dispatch and all listeners of the loaded cogs.
+# - throughput: replay as fast as possible, and wait until all listeners are done
+# - paced: replay at a fixed rate like a busy gateway would, and measure how far behind the processing falls
+# - memory: allocations of the member cache, and growth during the replay (measured with tracemalloc)
+# The event stream is generated from a seed, so runs with the same arguments are comparable across commits.
+
+catalog_size = 2000
+
+
+class Listener:
+    """State of a member listening on Spotify."""
+    __slots__ = ["track", "start", "playing"]
+
+    def __init__(self, track: int, start: float):
+        self.track = track
+        self.start = start
+        self.playing = True
+
+
+class ChurnGenerator:
+    """Generates PRESENCE_UPDATE and GUILD_MEMBER_UPDATE payloads with realistic Spotify activity churn:
+    mostly track changes, some pauses, resumes and scrubs, and unrelated status and game changes
+    of the members that don't listen on Spotify."""
+
+    weights = {"track_change": 0.55, "pause": 0.08, "resume": 0.07, "scrub": 0.05, "status": 0.2, "member": 0.05}
+
+    def __init__(self, guilds: list, listening: float, seed: int):
+        self._random = random.Random(seed)
+        self._members = [(guild.id, member) for guild in guilds for member in guild.members if not member.bot]
+        self._listeners = {}
+        for guild_id, member in self._members:
+            if self._random.random() < listening:
+                self._listeners[member.id] = Listener(self._random.randrange(catalog_size), time.time())
+        self._kinds = list(self.weights)
+        self._weights = list(self.weights.values())
+
+    def initial(self):
+        """Presence updates that start the activity of every listening member."""
+        for guild_id, member in self._members:
+            if member.id in self._listeners:
+                yield self._presence(guild_id, member, self._listeners[member.id])
+
+    def __iter__(self):
+        while True:
+            kind = self._random.choices(self._kinds, self._weights)[0]
+            guild_id, member = self._random.choice(self._members)
+            listener = self._listeners.get(member.id)
+
+            if kind == "member":
+                yield self._member_update(guild_id, member)
+            elif not listener or kind == "status":
+                yield self._presence(guild_id, member, listener, status=self._random.choice(["online", "idle", "dnd"]))
+            else:
+                if kind == "track_change":
+                    listener.track = (listener.track + 1) % catalog_size
+                    listener.start = time.time()
+                    listener.playing = True
+                elif kind == "scrub":
+                    listener.start -= self._random.uniform(5, 60)
+                else:
+                    listener.playing = kind == "resume"
+                yield self._presence(guild_id, member, listener)
+
+    def _presence(self, guild_id: int, member, listener: Listener = None, status: str = "online") -> dict:
+        activities = []
+        if listener and listener.playing:
+            activities.append(self._spotify(member.id, listener))
+        elif self._random.random() < 0.3:
+            activities.append({"type": 0, "name": f"Game {self._random.randrange(50)}", "id": "game",
+                               "created_at": int(time.time() * 1000),
+                               "timestamps": {"start": int(time.time() * 1000)}})
+
+        return {"op": 0, "t": "PRESENCE_UPDATE", "d": {
+            "user": {"id": str(member.id)},
+            "guild_id": str(guild_id),
+            "status": status,
+            "client_status": {"desktop": status},
+            "activities": activities,
+        }}
+
+    @staticmethod
+    def _spotify(user_id: int, listener: Listener) -> dict:
+        track = listener.track
+        start = int(listener.start * 1000)
+        return {
+            "type": 2, "name": "Spotify", "id": "spotify:1", "flags": 48,
+            "details": f"Track {track}",
+            "state": f"Artist {track % 300}; Featured Artist {track % 7}",
+            "sync_id": f"{track:022d}",
+            "session_id": f"{user_id:x}",
+            "party": {"id": f"spotify:{user_id}"},
+            "assets": {"large_image": f"spotify:ab67616d0000b273{track:024x}", "large_text": f"Album {track % 900}"},
+            "timestamps": {"start": start, "end": start + 150_000 + (track % 120) * 1000},
+            "created_at": start,
+        }
+
+    def _member_update(self, guild_id: int, member) -> dict:
+        return {"op": 0, "t": "GUILD_MEMBER_UPDATE", "d": {
+            "guild_id": str(guild_id),
+            "user": {"id": str(member.id), "username": member.name, "discriminator": "0", "avatar": None},
+            "nick": f"Nick {self._random.randrange(1000)}",
+            "roles": [],
+            "joined_at": member.joined_at.isoformat() if member.joined_at else None,
+            "deaf": False,
+            "mute": False,
+            "flags": 0,
+        }}
+
+
+def add_members(state, guild, count: int, start_id: int):
+    """Fill the member cache of `guild`, like the initial GUILD_CREATE of a large guild would."""
+    import discord
+
+    joined = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc).isoformat()
+    for member_id in range(start_id, start_id + count):
+        data = {"user": {"id": str(member_id), "username": f"member{member_id}", "discriminator": "0",
+                         "avatar": None, "global_name": None},
+                "roles": [], "joined_at": joined, "deaf": False, "mute": False, "flags": 0}
+        guild._add_member(discord.Member(data=data, guild=guild, state=state))
+    guild._member_count = len(guild._members)
+
+
+def replay(state, raw: str):
+    """Handle one raw gateway message like DiscordWebSocket.received_message does."""
+    from discord import utils
+
+    message = utils._from_json(raw)
+    getattr(state, "parse_" + message["t"].lower())(message["d"])
+
+
+async def wait_for_listeners():
+    """Wait until the tasks of all dispatched events are done."""
+    current = asyncio.current_task()
+    while True:
+        pending = [task for task in asyncio.all_tasks() if task is not current and not task.done()
+                   and task.get_coro().__qualname__.startswith("Client._run_event")]
+        if not pending:
+            return
+        await asyncio.wait(pending)
+
+
+async def bench_throughput(state, events: list, batch: int) -> dict:
+    start = time.perf_counter()
+    for index, raw in enumerate(events, 1):
+        replay(state, raw)
+        # The gateway yields to the loop after every received message, a batch approximates that cheaper
+        if index % batch == 0:
+            await asyncio.sleep(0)
+    dispatched = time.perf_counter() - start
+
+    await wait_for_listeners()
+    elapsed = time.perf_counter() - start
+    return {
+        "events": len(events),
+        "events_per_second": round(len(events) / elapsed),
+        "dispatch_only_per_second": round(len(events) / dispatched),
+    }
+
+
+async def bench_paced(bot, state, events: list, rate: float) -> dict:
+    """Replay at `rate` events per second. The delay of each event behind its schedule shows
+    how far the bot falls behind the gateway."""
+    watchdog = bot.watchdog
+    watchdog.lags.clear()
+    blocked_before = watchdog.blocked
+
+    delays = []
+    start = time.perf_counter()
+    for index, raw in enumerate(events):
+        scheduled = start + index / rate
+        now = time.perf_counter()
+        if scheduled > now:
+            await asyncio.sleep(scheduled - now)
+        delays.append(max(0.0, time.perf_counter() - scheduled))
+        replay(state, raw)
+        await asyncio.sleep(0)
+
+    await wait_for_listeners()
+    elapsed = time.perf_counter() - start
+    lags = watchdog.percentiles()
+    return {
+        "rate": rate,
+        "achieved_rate": round(len(events) / elapsed, 1),
+        "behind_schedule": summarize(delays) | {"max_ms": round(max(delays, default=0.0) * 1000, 2)},
+        "loop_lag_ms": {name: round(value * 1000, 2) for name, value in lags.items()},
+        "loop_blocked": watchdog.blocked - blocked_before,
+    }
+
+
+async def main(args):
+    setup_environment()
+    standin = await start_music_standin()
+
+    import discord.ext.test as dpytest
+    import discord.ext.test.backend as backend
+    from main import DamaBot
+    from util.config import Config
+
+    tracemalloc.start()
+    before_setup = tracemalloc.get_traced_memory()[0]
+
+    bot = DamaBot()
+    dpytest.configure(bot, guilds=0, text_channels=0, voice_channels=0, members=0)
+    # dpytest replaces the connection state, so initialise the loop afterwards
+    await bot._async_setup_hook()
+    for cog in args.cogs.split(","):
+        await bot.load_extension(cog)
+    # Since discord.py 2.0, activity changes only arrive as presence updates, which the scrobble cog doesn't
+    # listen to yet. Measure its handler on them anyway, without enabling it for the bot itself.
+    scrobble = bot.get_cog("Scrobble")
+    if scrobble:
+        bot.add_listener(scrobble.on_member_update, "on_presence_update")
+
+    state = bot._connection
+    guilds = []
+    config = Config("music")
+    for index in range(args.guilds):
+        guild = backend.make_guild(f"Guild {index}")
+        add_members(state, guild, args.members, start_id=10 ** 15 + index * args.members)
+        for member in list(guild.members)[:args.registered]:
+            config.data["names"][str(member.id)] = member.name
+        guilds.append(guild)
+    config.save()
+
+    generator = ChurnGenerator(guilds, args.listening, args.seed)
+    initial = [json.dumps(event) for event in generator.initial()]
+    stream = iter(generator)
+    events = [json.dumps(next(stream)) for _ in range(args.events)]
+    paced = [json.dumps(next(stream)) for _ in range(int(args.rate * args.duration))]
+
+    for raw in initial:
+        replay(state, raw)
+    await wait_for_listeners()
+    after_setup = tracemalloc.get_traced_memory()[0]
+
+    # Churn through part of the stream with tracemalloc still on, to see if the replay retains memory
+    tracemalloc.reset_peak()
+    for raw in events[:len(events) // 10]:
+        replay(state, raw)
+    await wait_for_listeners()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    bot.watchdog.start()
+    members = args.guilds * args.members
+    results = {
+        "throughput": await bench_throughput(state, events, args.batch),
+        "paced": await bench_paced(bot, state, paced, args.rate),
+        "memory": {
+            "setup_mb": round((after_setup - before_setup) / 2 ** 20, 2),
+            "bytes_per_member": round((after_setup - before_setup) / members) if members else 0,
+            "replay_growth_mb": round((current - after_setup) / 2 ** 20, 2),
+            "replay_peak_mb": round((peak - after_setup) / 2 ** 20, 2),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "settings": {"guilds": args.guilds, "members": args.members, "registered": args.registered,
+                     "listening": args.listening, "events": args.events, "rate": args.rate, "seed": args.seed,
+                     "cogs": args.cogs},
+    }
+
+    bot.watchdog.stop()
+    await standin.stop()
+    report("presence", results, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--members", type=int, default=5000, help="Members per guild")
+    parser.add_argument("--registered", type=int, default=200, help="Members per guild registered with Last.fm")
+    parser.add_argument("--listening", type=float, default=0.3, help="Share of members listening on Spotify")
+    parser.add_argument("--events", type=int, default=50000, help="Events for the throughput measurement")
+    parser.add_argument("--batch", type=int, default=20, help="Events between yields to the loop")
+    parser.add_argument("--rate", type=float, default=500, help="Events per second for the paced measurement")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of the paced measurement")
+    parser.add_argument("--cogs", default="cogs.admin,cogs.scrobble,cogs.music", help="Comma separated cogs to load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Append the results to this jsonl file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import io
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from cogs.emoji import transcode
+from test.bench import report, summarize
+
+# Benchmark of the emoji downscaling in cogs.emoji.transcode on generated sample images:
+# - fit: time per image for a direct call, and the size of the result
+# - pool: throughput of a batch of images in the process pool, and the worst event loop stall meanwhile
+
+
+def noise(size: int, frames: int) -> list:
+    rand = random.Random(size * frames)
+    return [Image.frombytes("RGBA", (size, size), rand.randbytes(size * size * 4)) for _ in range(frames)]
+
+
+def shapes(size: int, frames: int) -> list:
+    """Moving shapes on a gradient, which compresses like a typical animated emoji"""
+    result = []
+    for idx in range(frames):
+        image = Image.linear_gradient("L").resize((size, size)).convert("RGBA")
+        draw = ImageDraw.Draw(image)
+        offset = idx * size // frames
+        for shape in range(12):
+            x, y = (offset + shape * 37) % size, (shape * 53 + offset // 2) % size
+            draw.ellipse((x, y, x + size // 5, y + size // 5), fill=(shape * 20, 255 - shape * 20, idx * 4, 255))
+        result.append(image)
+    return result
+
+
+def encode(frames: list) -> bytes:
+    buffer = io.BytesIO()
+    if len(frames) > 1:
+        frames[0].save(buffer, "GIF", save_all=True, append_images=frames[1:], duration=40, loop=0)
+    else:
+        frames[0].save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def samples() -> dict:
+    return {
+        "static_noise_512.png": encode(noise(512, 1)),
+        "animated_noise_160x16.gif": encode(noise(160, 16)),
+        "animated_shapes_512x60.gif": encode(shapes(512, 60)),
+    }
+
+
+async def bench_pool(images: list, workers: int) -> dict:
+    loop = asyncio.get_running_loop()
+    stall = 0.0
+
+    async def ticker():
+        nonlocal stall
+        while True:
+            before = loop.time()
+            await asyncio.sleep(0.01)
+            stall = max(stall, loop.time() - before - 0.01)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Start the workers before measuring
+        await loop.run_in_executor(pool, transcode.fit, b"")
+        task = asyncio.create_task(ticker())
+
+        start = time.perf_counter()
+        await asyncio.gather(*[loop.run_in_executor(pool, transcode.fit, data) for data in images])
+        elapsed = time.perf_counter() - start
+        task.cancel()
+
+    return {"images": len(images), "total_s": round(elapsed, 2), "images_per_s": round(len(images) / elapsed, 2),
+            "max_loop_stall_ms": round(stall * 1000, 2)}
+
+
+def main(args):
+    results = {}
+    images = samples()
+
+    for name, data in images.items():
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = transcode.fit(data)
+            durations.append(time.perf_counter() - start)
+
+        results[name] = {"in_kb": len(data) // 1024, "out_kb": len(result) // 1024 if result else None,
+                         **summarize(durations)}
+
+    results["pool"] = asyncio.run(bench_pool(list(images.values()) * args.batch, args.workers))
+    report("transcode", results, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=2, help="Copies of each sample for the pool benchmark")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="Append the results to this jsonl file")
+    main(parser.parse_args())
@@ -40,5 +40,4 @@ def setup_mock_env(mocker: MockFixture):
 def mock_search_apis(mocker: MockFixture):
     mocker.patch("pylast.LastFMNetwork")
     mocker.patch("tekore.Spotify", return_value=AsyncMock())
-    mocker.patch("tekore.request_client_token")
-    mocker.patch("lyricsgenius.Genius")
+    mocker.patch("tekore.Credentials")
@@ -0,0 +1,114 @@
+import asyncio
+import collections
+import logging
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+
+from aiohttp import web
+
+# Local stand-in servers for the external HTTP APIs used by the bot, for offline tests and benchmarks.
+# Each server listens on a random local port, adds a configurable latency to every request,
+# and counts the requests per call (by default the path).
+
+_log = logging.getLogger(__name__)
+
+
+class StandinServer:
+    """Base class for the stand-in servers. Subclasses add their routes in :meth:`routes`."""
+
+    def __init__(self, *, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = collections.Counter()
+        self.url = None
+        self.tls_url = None
+        self.cafile = None
+
+        self._random = random.Random(seed)
+        self._runner = None
+
+    def routes(self) -> list:
+        raise NotImplementedError
+
+    async def call_name(self, request: web.Request) -> str:
+        """Name under which a request is counted in :attr:`calls`."""
+        return request.path
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, *, tls: bool = False) -> str:
+        """Start serving on `port`. With `tls`, the same routes are also served over https on another port,
+        with a self-signed certificate in :attr:`cafile`."""
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes(self.routes())
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.url = f"http://{host}:{self._runner.addresses[0][1]}"
+
+        if tls:
+            certfile, keyfile = self_signed_certificate(host)
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(certfile, keyfile)
+            await web.TCPSite(self._runner, host, 0, ssl_context=context).start()
+            self.tls_url = f"https://{host}:{self._runner.addresses[1][1]}"
+            self.cafile = certfile
+
+        _log.info("%s listening on %s", self.__class__.__name__, self.url)
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def delay(self, factor: float = 1.0):
+        await asyncio.sleep(max(0.0, (self.latency + self._random.uniform(-self.jitter, self.jitter)) * factor))
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.calls[await self.call_name(request)] += 1
+        await self.delay()
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "Injected error"}}, status=503)
+
+        return await handler(request)
+
+
+def self_signed_certificate(host: str) -> tuple:
+    """Create a certificate and key for `host` with the openssl command line tool, and return their paths."""
+    directory = tempfile.mkdtemp(prefix="standin-")
+    certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", f"/CN={host}",
+                    "-addext", f"subjectAltName=IP:{host}", "-keyout", keyfile, "-out", certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def serve_forever(server: StandinServer, port: int, tls: bool = False):
+    """Run a stand-in server in the foreground, for manual testing against a bot instance."""
+
+    async def run():
+        await server.start(port=port, tls=tls)
+        print(f"Serving on {server.url}, press Ctrl+C to stop")
+        if tls:
+            print(f"Serving https on {server.tls_url}, with the certificate {server.cafile}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
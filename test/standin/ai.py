@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+from test.standin import StandinServer, serve_forever
+
+# Stand-in for the OpenAI completion and chat completion endpoints.
+# Run standalone with `python -m test.standin.ai`,
+# and point the bot to it with OPENAI_API_BASE=http://127.0.0.1:<port>/v1
+
+_words = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore "
+          "magna aliqua").split()
+
+
+class AIStandin(StandinServer):
+    """Answers every prompt with `tokens` words of filler text. Streamed responses are sent one word at a time,
+    with `token_delay` seconds between the words."""
+
+    def __init__(self, *, tokens: int = 200, token_delay: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = tokens
+        self.token_delay = token_delay
+
+    def routes(self) -> list:
+        return [
+            web.post("/v1/completions", self.completions),
+            web.post("/v1/chat/completions", self.chat_completions),
+        ]
+
+    def _text(self, payload: dict) -> list:
+        count = min(self.tokens, payload.get("max_tokens") or self.tokens)
+        return [word + " " for word in itertools.islice(itertools.cycle(_words), count)]
+
+    async def completions(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        tokens = self._text(payload)
+        await asyncio.sleep(self.token_delay * len(tokens))
+
+        text = "".join(tokens)
+        if payload.get("echo"):
+            text = payload["prompt"] + text
+
+        return web.json_response({
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [{"index": 0, "text": text, "finish_reason": "stop"}],
+        })
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        tokens = self._text(payload)
+
+        if not payload.get("stream"):
+            await asyncio.sleep(self.token_delay * len(tokens))
+            return web.json_response({
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+
+        for token in tokens:
+            await asyncio.sleep(self.token_delay)
+            chunk = {"object": "chat.completion.chunk", "model": payload["model"],
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds until the response starts")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds per generated word")
+    parser.add_argument("--tokens", type=int, default=200, help="Words per response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    serve_forever(AIStandin(latency=args.latency, token_delay=args.token_delay, tokens=args.tokens,
+                            error_rate=args.error_rate), args.port)
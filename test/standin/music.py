@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+
+from aiohttp import web
+
+from test.standin import StandinServer, serve_forever
+
+# Stand-in for the Last.fm, Spotify Web API and Genius endpoints used by cogs/music/search.py.
+# It replays the responses in test/standin/recordings, e.g. recordings/lastfm/<method>.xml for a Last.fm call.
+# Run standalone with `python -m test.standin.music`, and point the bot to it with
+# LASTFM_API_URL=https://127.0.0.1:<tls port>/2.0/, SPOTIFY_API_URL=http://127.0.0.1:<port>
+# and GENIUS_API_URL=http://127.0.0.1:<port>. pylast only supports https, so Last.fm must use the TLS port,
+# and the printed certificate must be trusted by pylast.SSL_CONTEXT.
+
+recordings = os.path.join(os.path.dirname(__file__), "recordings")
+
+
+def _load(service: str, name: str) -> str:
+    with open(os.path.join(recordings, service, name), encoding="utf-8") as file:
+        return file.read()
+
+
+class MusicStandin(StandinServer):
+    """Serves all three music APIs. Requests are counted as "<service> <call>", e.g. "lastfm user.getInfo"."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Read everything up front, so the replay itself adds no file I/O to the measured latency
+        self._lastfm = {name[:-4]: _load("lastfm", name) for name in os.listdir(os.path.join(recordings, "lastfm"))}
+        self._spotify = {name[:-5]: json.loads(_load("spotify", name))
+                         for name in os.listdir(os.path.join(recordings, "spotify"))}
+        self._genius_search = json.loads(_load("genius", "search_multi.json"))
+        self._genius_lyrics = _load("genius", "lyrics.html")
+
+    def routes(self) -> list:
+        return [
+            web.post("/2.0/", self.lastfm),
+            web.post("/api/token", self.spotify_token),
+            web.get("/v1/search", self.spotify_search),
+            web.get("/v1/albums/", self.spotify_albums),
+            web.get("/v1/albums/{id}", self.spotify_album),
+            web.get("/v1/tracks/", self.spotify_tracks),
+            web.get("/v1/tracks/{id}", self.spotify_track),
+            web.get("/v1/artists/{id}", self.spotify_artist),
+            web.get("/api/search/multi", self.genius_search),
+            web.get("/songs/{id}", self.genius_song),
+            web.get("/{path}", self.genius_lyrics),
+        ]
+
+    async def call_name(self, request: web.Request) -> str:
+        if request.path == "/2.0/":
+            return "lastfm " + (await request.post()).get("method", "")
+        if request.path == "/v1/search":
+            return f"spotify search {request.query.get('type')}"
+        if request.path in ("/v1/albums/", "/v1/tracks/"):
+            # spotify albums or spotify tracks, several ids at once
+            return "spotify " + request.path.split("/")[2]
+        if request.path.startswith("/v1/"):
+            # spotify album, spotify track or spotify artist
+            return "spotify " + request.path.split("/")[2][:-1]
+        if request.path == "/api/token":
+            return "spotify token"
+        if request.path == "/api/search/multi":
+            return "genius search"
+        if request.path.startswith("/songs/"):
+            return "genius song"
+        return "genius lyrics"
+
+    async def lastfm(self, request: web.Request) -> web.Response:
+        method = (await request.post()).get("method", "")
+        if method not in self._lastfm:
+            return web.Response(text=f'<?xml version="1.0" encoding="UTF-8"?>\n<lfm status="failed">'
+                                     f'<error code="3">Invalid Method - No method with that name in this package'
+                                     f'</error></lfm>', content_type="text/xml", status=400)
+        return web.Response(text=self._lastfm[method], content_type="text/xml")
+
+    async def spotify_token(self, request: web.Request) -> web.Response:
+        return web.json_response({"access_token": "standin", "token_type": "Bearer", "expires_in": 3600})
+
+    async def spotify_search(self, request: web.Request) -> web.Response:
+        kind = request.query.get("type", "track").split(",")[0]
+        return web.json_response(self._spotify[f"search_{kind}"])
+
+    async def spotify_album(self, request: web.Request) -> web.Response:
+        return web.json_response(self._spotify["album"])
+
+    async def spotify_albums(self, request: web.Request) -> web.Response:
+        ids = request.query.get("ids", "").split(",")
+        return web.json_response({"albums": [self._spotify["album"]] * len(ids)})
+
+    async def spotify_tracks(self, request: web.Request) -> web.Response:
+        ids = request.query.get("ids", "").split(",")
+        return web.json_response({"tracks": [self._spotify["search_track"]["tracks"]["items"][0]] * len(ids)})
+
+    async def spotify_track(self, request: web.Request) -> web.Response:
+        # The recordings only have the track and artist in the search results
+        return web.json_response(self._spotify["search_track"]["tracks"]["items"][0])
+
+    async def spotify_artist(self, request: web.Request) -> web.Response:
+        return web.json_response(self._spotify["search_artist"]["artists"]["items"][0])
+
+    async def genius_search(self, request: web.Request) -> web.Response:
+        return web.json_response(self._genius_search)
+
+    async def genius_song(self, request: web.Request) -> web.Response:
+        song = self._genius_search["response"]["sections"][0]["hits"][0]["result"]
+        return web.json_response({"meta": {"status": 200}, "response": {"song": song}})
+
+    async def genius_lyrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self._genius_lyrics, content_type="text/html")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.15, help="Seconds until each response starts")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    serve_forever(MusicStandin(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate), args.port,
+                  tls=True)
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from cogs.gpt.providers import AIError, HTTPProvider
+from test.standin.ai import AIStandin
+
+# Tests for cogs.gpt.providers against the local AI stand-in server
+
+# Mark all tests in this module as async
+pytestmark = pytest.mark.asyncio
+
+
+async def test_completion():
+    async with AIStandin(tokens=3) as standin:
+        provider = HTTPProvider(standin.url + "/v1")
+        result = await provider.completion("Say ", model="test", echo=True)
+        await provider.close()
+
+    assert result == "Say lorem ipsum dolor "
+
+
+async def test_chat():
+    async with AIStandin(tokens=3) as standin:
+        provider = HTTPProvider(standin.url + "/v1")
+        result = await provider.chat([{"role": "user", "content": "Hi"}], model="test")
+        await provider.close()
+
+    assert result == "lorem ipsum dolor "
+    assert standin.calls["/v1/chat/completions"] == 1
+
+
+async def test_stream_chat():
+    async with AIStandin(tokens=3) as standin:
+        provider = HTTPProvider(standin.url + "/v1")
+        chunks = [chunk async for chunk in provider.stream_chat([{"role": "user", "content": "Hi"}], model="test")]
+        await provider.close()
+
+    assert chunks == ["lorem ", "ipsum ", "dolor "]
+
+
+async def test_retries_then_raises():
+    async with AIStandin(error_rate=1.0) as standin:
+        provider = HTTPProvider(standin.url + "/v1", retries=1)
+        with pytest.raises(AIError, match="Injected error"):
+            await provider.chat([{"role": "user", "content": "Hi"}], model="test")
+        await provider.close()
+
+    assert standin.calls["/v1/chat/completions"] == 2
+
+
+class BrokenStandin(AIStandin):
+    """Answers the completions with an html page and the chats with json without choices."""
+
+    def routes(self) -> list:
+        return [
+            web.post("/v1/completions", self.html),
+            web.post("/v1/chat/completions", self.no_choices),
+        ]
+
+    async def html(self, request: web.Request) -> web.Response:
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    async def no_choices(self, request: web.Request) -> web.Response:
+        return web.json_response({"choices": []})
+
+
+async def test_invalid_responses_raise_ai_errors():
+    async with BrokenStandin() as standin:
+        provider = HTTPProvider(standin.url + "/v1")
+        with pytest.raises(AIError, match="invalid response: ContentTypeError"):
+            await provider.completion("Hi", model="test")
+        with pytest.raises(AIError, match="invalid response: IndexError"):
+            await provider.chat([{"role": "user", "content": "Hi"}], model="test")
+        await provider.close()
+
+
+async def test_stream_timeout_raises_ai_error():
+    async with AIStandin(tokens=5, token_delay=0.2) as standin:
+        provider = HTTPProvider(standin.url + "/v1", timeout=0.5)
+        with pytest.raises(AIError, match="Could not read"):
+            async for _ in provider.stream_chat([{"role": "user", "content": "Hi"}], model="test"):
+                pass
+        await provider.close()
+
+
+class StalledErrorStandin(AIStandin):
+    """Answers with an error status, and stalls while sending the body."""
+
+    def routes(self) -> list:
+        return [web.post("/v1/chat/completions", self.stalled_error)]
+
+    async def stalled_error(self, request: web.Request) -> web.StreamResponse:
+        resp = web.StreamResponse(status=400, headers={"Content-Type": "application/json"})
+        await resp.prepare(request)
+        await resp.write(b'{"error": ')
+        await asyncio.sleep(1)
+        return resp
+
+
+async def test_unreadable_error_raises_ai_error():
+    async with StalledErrorStandin() as standin:
+        provider = HTTPProvider(standin.url + "/v1", timeout=0.3, retries=0)
+        with pytest.raises(AIError, match="Could not read"):
+            await provider.chat([{"role": "user", "content": "Hi"}], model="test")
+        await provider.close()
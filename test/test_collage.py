@@ -0,0 +1,47 @@
+import io
+
+import pytest
+from PIL import Image
+
+# Tests for cogs.music.collage
+
+
+@pytest.fixture
+def collage(setup_mock_env, mock_search_apis):
+    from cogs.music import collage
+    return collage
+
+
+def cover(tmp_path, name: str, color: tuple, size: int = 600) -> str:
+    path = tmp_path / name
+    Image.new("RGB", (size, size), color).save(path, "JPEG")
+    return str(path)
+
+
+def test_collage_size(collage):
+    assert collage.tile_size(3) == 300
+    assert collage.tile_size(10) == 150
+
+
+def test_covers_are_placed_row_by_row(collage, tmp_path):
+    paths = [cover(tmp_path, "red.jpg", (255, 0, 0)), cover(tmp_path, "blue.jpg", (0, 0, 255)),
+             cover(tmp_path, "green.jpg", (0, 255, 0), size=64)]
+    image = Image.open(io.BytesIO(collage.render(paths, ["", "", ""], 2)))
+
+    assert image.size == (600, 600)
+    red, green, blue = image.getpixel((150, 150)), image.getpixel((150, 450)), image.getpixel((450, 150))
+    assert red[0] > 200 and red[2] < 50
+    assert blue[2] > 200 and blue[0] < 50
+    assert green[1] > 200 and green[0] < 50
+    # The fourth tile has no album
+    assert image.getpixel((450, 450)) == collage.background
+
+
+def test_missing_covers_keep_the_caption(collage, tmp_path):
+    broken = tmp_path / "broken"
+    broken.write_bytes(b"not an image")
+    image = Image.open(io.BytesIO(collage.render([None, str(broken)], ["Artist - Album", "Artist - Other"], 2)))
+
+    # The caption band is drawn on the empty tiles
+    assert image.getpixel((150, 2)) != collage.background
+    assert image.getpixel((150, 150)) == collage.background
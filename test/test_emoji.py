@@ -0,0 +1,80 @@
+import io
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import discord
+import pytest
+import pytest_asyncio
+from PIL import Image
+
+from cogs.emoji import Emoji
+from util.ratelimit import TokenBucket
+
+# Tests for the bulk import of cogs.emoji and util.ratelimit
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (32, 32), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_parse_mixed_emojis_and_links():
+    text = ("<:blob:11> text <a:party:22> https://cdn.discordapp.com/emojis/33.png?size=48 "
+            "https://cdn.discordapp.com/emojis/44.gif dance\n<:blob:11>")
+    assert Emoji._parse(text) == [
+        ("blob", "11", False),
+        ("party", "22", True),
+        ("emoji_33", "33", False),
+        ("dance", "44", True),
+    ]
+
+
+def test_parse_link_names():
+    # Names must be valid emoji names, else the link is named after its id
+    assert Emoji._parse("https://cdn.discordapp.com/emojis/1.webp x") == [("emoji_1", "1", False)]
+    assert Emoji._parse("https://cdn.discordapp.com/emojis/2.png\tcool_cat") == [("cool_cat", "2", False)]
+    assert Emoji._parse("no emojis here, :smile:") == []
+
+
+@pytest_asyncio.fixture
+async def cog():
+    cog = Emoji()
+    await cog.cog_load()
+    yield cog
+    await cog.cog_unload()
+
+
+@pytest.mark.asyncio
+async def test_yoinkall_summarizes_failures(cog):
+    images = {"1": png(), "2": b"", "3": b"no image" * 40000, "4": png()}
+    cog._fetch = AsyncMock(side_effect=lambda emoji_id, animated: images[emoji_id])
+
+    async def create(guild, name, data):
+        if name == "taken":
+            raise discord.HTTPException(MagicMock(status=400), "Invalid emoji name")
+        return f"<:{name}:1>"
+
+    cog._create = AsyncMock(side_effect=create)
+    ctx = MagicMock(reply=AsyncMock(), send=AsyncMock())
+    ctx.message.reference = None
+    ctx.channel.id = 1
+
+    await Emoji.yoinkall.callback(cog, ctx, emojis="<:ok:1> <:gone:2> <:broken:3> <:taken:4>")
+
+    ctx.reply.assert_awaited_once_with("Added 1 of 4 emojis: <:ok:1>\n"
+                                       "Failed: gone (download failed), broken (not an image), "
+                                       "taken (Invalid emoji name)")
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_allows_bursts():
+    bucket = TokenBucket(2, 0.2)
+    start = time.monotonic()
+    await bucket.acquire()
+    await bucket.acquire()
+    assert time.monotonic() - start < 0.05
+
+    # The third action waits for a token to be refilled
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.09
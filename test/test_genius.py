@@ -0,0 +1,92 @@
+import asyncio
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+# Tests for cogs.music.genius
+
+
+def song(song_id: int, title: str, artist: str = "Artist", lyrics_state: str = "complete") -> dict:
+    return {"id": song_id, "title": title, "primary_artist": {"name": artist}, "lyrics_state": lyrics_state,
+            "url": f"https://genius.com/{song_id}", "header_image_url": f"https://images.genius.com/{song_id}.jpg"}
+
+
+class Api:
+    """Fake Genius with a top hit that is an artist, a tracklist page and a song. Counts the requests per path."""
+
+    def __init__(self):
+        self.requests = {}
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.requests["search"] = self.requests.get("search", 0) + 1
+        await asyncio.sleep(0.05)
+        if request.query["q"] == "nothing":
+            return web.json_response({"response": {"sections": []}})
+        return web.json_response({"response": {"sections": [
+            {"type": "top_hit", "hits": [{"index": "artist", "result": {"name": "Artist"}}]},
+            {"type": "song", "hits": [{"index": "song", "result": song(1, "Album Track List")},
+                                      {"index": "song", "result": song(2, "Unreleased", lyrics_state="unreleased")},
+                                      {"index": "song", "result": song(3, "Song")}]},
+        ]}})
+
+    async def song(self, request: web.Request) -> web.Response:
+        self.requests["song"] = self.requests.get("song", 0) + 1
+        assert request.headers["Authorization"] == "Bearer token"
+        song_id = int(request.match_info["id"])
+        if song_id != 4:
+            return web.json_response({"meta": {"status": 404}}, status=404)
+        return web.json_response({"response": {"song": song(4, "Other")}})
+
+
+@pytest_asyncio.fixture
+async def api():
+    api = Api()
+    app = web.Application()
+    app.router.add_get("/api/search/multi", api.search)
+    app.router.add_get("/songs/{id}", api.song)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    api.url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+    yield api
+    await runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def genius(setup_mock_env, mock_search_apis, api):
+    from cogs.music.genius import Genius
+
+    async with aiohttp.ClientSession() as session:
+        yield Genius("token", session, api.url, api.url + "api/")
+
+
+@pytest.mark.asyncio
+async def test_search_skips_non_songs(genius, api):
+    found = await genius.search("Song Artist")
+    assert (found.id, found.title, found.artist) == (3, "Song", "Artist")
+    assert await genius.search("nothing") is None
+
+
+@pytest.mark.asyncio
+async def test_search_is_cached_by_normalized_query(genius, api):
+    results = await asyncio.gather(genius.search("Song Artist"), genius.search("song, artist"))
+    assert results[0] == results[1]
+    assert await genius.search("SONG ARTIST (Remastered)") == results[0]
+    assert api.requests == {"search": 1}
+
+    # The song of a search is cached by its id too
+    assert (await genius.song(3)).title == "Song"
+    assert api.requests == {"search": 1}
+
+
+@pytest.mark.asyncio
+async def test_song_by_id(genius, api):
+    assert (await genius.song(4)).title == "Other"
+    await genius.song(4)
+    with pytest.raises(aiohttp.ClientResponseError) as info:
+        await genius.song(5)
+    assert info.value.status == 404
+    assert api.requests == {"song": 2}
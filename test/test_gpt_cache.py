@@ -0,0 +1,63 @@
+from cogs.gpt.cache import ResponseCache
+from util.config import Config
+
+
+# Tests for cogs.gpt.cache.ResponseCache
+
+def test_only_deterministic_requests_are_cacheable():
+    cache = ResponseCache("_cache", ttl=60, max_entries=10)
+    assert cache.cacheable(0)
+    assert cache.cacheable(0.0)
+    assert not cache.cacheable(0.1)
+
+    disabled = ResponseCache("_cache_disabled", ttl=60, max_entries=0)
+    assert not disabled.cacheable(0)
+
+
+def test_key_depends_on_all_parts():
+    key = ResponseCache.key("model", "system", "prompt", 0)
+    assert key == ResponseCache.key("model", "system", "prompt", 0.0)
+    assert key != ResponseCache.key("model2", "system", "prompt", 0)
+    assert key != ResponseCache.key("model", "system2", "prompt", 0)
+    assert key != ResponseCache.key("model", "system", "prompt2", 0)
+
+
+def test_get_put():
+    cache = ResponseCache("_cache", ttl=60, max_entries=10)
+    assert cache.get("a") is None
+
+    cache.put("a", "response")
+    assert cache.get("a") == "response"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl(mocker):
+    time = mocker.patch("time.time", return_value=1000)
+    cache = ResponseCache("_cache", ttl=60, max_entries=10)
+    cache.put("a", "response")
+
+    time.return_value = 1061
+    assert cache.get("a") is None
+
+
+def test_lru_eviction():
+    cache = ResponseCache("_cache", ttl=60, max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+
+    # Touch "a", so "b" is the least recently used entry
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_persistence():
+    cache = ResponseCache("_cache", ttl=60, max_entries=10)
+    cache.put("a", "response")
+
+    Config._instances.clear()
+    cache = ResponseCache("_cache", ttl=60, max_entries=10)
+    assert cache.get("a") == "response"
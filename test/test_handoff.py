@@ -0,0 +1,72 @@
+import sys
+
+import pytest
+import pytest_asyncio
+from discord import Intents
+from discord.ext.commands import Bot
+
+from util import handoff
+
+# Tests for util.handoff
+
+pytestmark = pytest.mark.asyncio
+
+extension = """
+from discord.ext.commands import Cog
+
+
+async def setup(bot):
+    await bot.add_cog(Counter())
+
+
+class Counter(Cog):
+    state_version = {version}
+
+    def __init__(self):
+        self.count = 0
+
+    def export_state(self):
+        return self.count
+
+    def import_state(self, state):
+        self.count = state
+"""
+
+
+@pytest_asyncio.fixture
+async def bot(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / "_counter.py").write_text(extension.format(version=1))
+
+    bot = Bot(command_prefix=".", intents=Intents.none())
+    await bot.load_extension("_counter")
+    yield bot, tmp_path / "_counter.py"
+    await bot.close()
+    sys.modules.pop("_counter", None)
+
+
+async def test_state_is_kept(bot):
+    bot, _ = bot
+    bot.get_cog("Counter").count = 3
+
+    assert await handoff.reload(bot, "_counter") == {"Counter": True}
+    assert bot.get_cog("Counter").count == 3
+
+
+async def test_state_of_other_version_is_dropped(bot):
+    bot, path = bot
+    bot.get_cog("Counter").count = 3
+    path.write_text(extension.format(version=2))
+
+    assert await handoff.reload(bot, "_counter") == {"Counter": False}
+    assert bot.get_cog("Counter").count == 0
+
+
+async def test_state_is_kept_when_reload_fails(bot):
+    bot, path = bot
+    bot.get_cog("Counter").count = 3
+    path.write_text("raise ImportError()")
+
+    with pytest.raises(Exception):
+        await handoff.reload(bot, "_counter")
+    assert bot.get_cog("Counter").count == 3
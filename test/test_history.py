@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+# Tests for cogs.music.history, against a fake getRecentTracks
+
+# (time, artist, track, album), newest first like Last.fm returns them
+scrobbles = [(1000 - i * 10, f"Artist {i % 3}", f"Track {i % 5}", "Album" if i % 2 else None) for i in range(10)]
+
+
+@pytest.fixture
+def history(setup_mock_env, mock_search_apis, tmp_path):
+    from cogs.music.history import History
+    from util.ratelimit import TokenBucket
+
+    history = History(str(tmp_path / "history.db"))
+    history.page_size = 3
+    history._backfill_bucket = TokenBucket(100, 1.0)
+    history.requests = []
+    history.scrobbles = list(scrobbles)
+
+    def fetch(username, time_from, time_to):
+        history.requests.append((time_from, time_to))
+        window = [s for s in history.scrobbles if (not time_from or s[0] >= time_from)
+                  and (not time_to or s[0] < time_to)]
+        return window[:history.page_size]
+
+    history._fetch = fetch
+    yield history
+    history.close()
+
+
+def test_backfill_and_sync(history):
+    async def run():
+        assert await history.sync("User") == 3
+        assert await history.backfill("user", pages=2) is False
+        assert await history.backfill("user", pages=5) is True
+        assert (await history.status("user"))[0] == 10
+
+        # Nothing new, only the watermark is fetched again
+        assert await history.sync("user") == 0
+
+        history.scrobbles[:0] = [(1100 - i * 10, "Artist 9", "New", None) for i in range(5)]
+        requests = len(history.requests)
+        assert await history.sync("user") == 5
+        # Five new scrobbles and the one at the watermark fill two pages of three, the third one ends the walk
+        assert len(history.requests) - requests == 3
+
+        return await history.plays("user", start=990)
+
+    plays = asyncio.run(run())
+    assert [p[0] for p in plays] == [990, 1000, 1060, 1070, 1080, 1090, 1100]
+    assert plays[0][3] is not None and plays[1][3] is None
+
+
+def test_names_are_interned(history):
+    async def run():
+        await history.sync("user")
+        await history.backfill("user", pages=5)
+        plays = await history.plays("user")
+        return plays, await history.titles("artists", {p[1] for p in plays}), \
+            await history.titles("tracks", {p[2] for p in plays})
+
+    plays, artists, tracks = asyncio.run(run())
+    assert len({p[1] for p in plays}) == 3
+    assert sorted(artists.values()) == [("Artist 0", ""), ("Artist 1", ""), ("Artist 2", "")]
+    # The same title by different artists are different tracks
+    assert len(tracks) == 10 and ("Artist 1", "Track 1") in tracks.values()
+
+
+def test_maintain_skips_failed_users(history):
+    import pylast
+
+    fetch = history._fetch
+
+    def failing_fetch(username, time_from, time_to):
+        if username == "gone":
+            raise pylast.WSError(None, "6", "User not found")
+        if username == "broken":
+            raise KeyError("date")
+        return fetch(username, time_from, time_to)
+
+    history._fetch = failing_fetch
+    states = []
+    state = history._state
+    history._state = lambda username: states.append(username) or state(username)
+
+    async def run():
+        task = asyncio.create_task(history.maintain(lambda: ["gone", "broken", "user"], interval=0.5, delay=0))
+        await asyncio.sleep(0.3)
+        assert not task.done()
+        task.cancel()
+        return await history.status("user")
+
+    count, _, complete = asyncio.run(run())
+    assert count == 10 and complete
+    # One sync each, and the backfill of the synced user only, instead of spinning on the failed ones
+    assert states.count("gone") == 1 and states.count("broken") == 1
@@ -0,0 +1,144 @@
+import sqlite3
+from unittest.mock import AsyncMock
+
+import pytest
+import tekore
+
+# Tests for cogs.music.identity
+
+
+@pytest.fixture
+def identity(setup_mock_env, mock_search_apis):
+    from cogs.music import identity
+    return identity
+
+
+@pytest.fixture
+def identities(identity, tmp_path):
+    identities = identity.Identities(str(tmp_path / "identities.db"))
+    yield identities
+    identities.close()
+
+
+def make_artist(name: str, spotify_id: str):
+    from cogs.music.classes import Artist
+
+    artist = Artist()
+    artist.name = name
+    artist.spotify_id = spotify_id
+    return artist
+
+
+def test_normalize(identity):
+    assert identity.normalize("Sigur Rós") == "sigur ros"
+    assert identity.normalize("Let It Be (Remastered 2009)") == "let it be"
+    assert identity.normalize("Heroes - 2017 Remaster") == "heroes"
+    assert identity.normalize("Simon & Garfunkel") == "simon and garfunkel"
+    assert identity.normalize("Say So feat. Nicki Minaj") == "say so"
+    # Names that are only a note are kept
+    assert identity.normalize("(What's the Story) Morning Glory?") == "morning glory"
+    assert identity.normalize("[ ]") == ""
+
+
+def test_similarity(identity):
+    assert identity.similarity("Radiohead", "radiohead") == 1.0
+    assert identity.similarity("Daft Punk", "Daft Punk, Pharrell Williams") == 0.9
+    assert identity.similarity("Radiohead", "Portishead") < 0.8
+
+
+@pytest.mark.asyncio
+async def test_links_expire(identity, identities):
+    keys = identity.keys("Radiohead")
+    await identities.link("artist", keys, "spotify", identity.Link("strong", 0.95))
+    assert await identities.lookup("artist", keys, "spotify") == ("strong", 0.95)
+
+    # Weak links and misses are searched again after a day
+    await identities.link("artist", identity.keys("Weak"), "spotify", identity.Link("weak", 0.5))
+    await identities.link("artist", identity.keys("Missing"), "spotify", identity.Link(None, 0.0))
+    identities._db.execute("UPDATE links SET resolved = resolved - 2 * 86400")
+    assert await identities.lookup("artist", identity.keys("Weak"), "spotify") is None
+    assert await identities.lookup("artist", identity.keys("Missing"), "spotify") is None
+    assert await identities.lookup("artist", keys, "spotify") == ("strong", 0.95)
+
+
+@pytest.mark.asyncio
+async def test_resolution_searches_once(identity, identities, mocker):
+    search = mocker.patch.object(identity.search, "search_spotify_artist",
+                                 AsyncMock(return_value=make_artist("Radiohead", "abc")))
+    get = mocker.patch.object(identity.search, "get_spotify_artist",
+                              AsyncMock(return_value=make_artist("Radiohead", "abc")))
+
+    assert (await identities.spotify_artist("Radiohead")).spotify_id == "abc"
+    assert (await identities.spotify_artist("radiohead")).spotify_id == "abc"
+    assert search.await_count == 1
+    get.assert_awaited_once_with("abc")
+
+
+@pytest.mark.asyncio
+async def test_misses_are_remembered(identity, identities, mocker):
+    search = mocker.patch.object(identity.search, "search_spotify_artist", AsyncMock(return_value=None))
+    assert await identities.spotify_artist("Nobody") is None
+    assert await identities.spotify_artist("Nobody") is None
+    assert search.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_ids_are_searched_again(identity, identities, mocker):
+    await identities.link("artist", identity.keys("Radiohead"), "spotify", identity.Link("gone", 1.0))
+    mocker.patch.object(identity.search, "get_spotify_artist",
+                        AsyncMock(side_effect=tekore.NotFound("Not found", None, None)))
+    mocker.patch.object(identity.search, "search_spotify_artist",
+                        AsyncMock(return_value=make_artist("Radiohead", "new")))
+
+    assert (await identities.spotify_artist("Radiohead")).spotify_id == "new"
+    assert await identities.lookup("artist", identity.keys("Radiohead"), "spotify") == ("new", 1.0)
+
+
+@pytest.mark.asyncio
+async def test_new_version_drops_links(identity, identities, tmp_path):
+    await identities.link("artist", identity.keys("Radiohead"), "spotify", identity.Link("abc", 1.0))
+    identities.close()
+
+    db = sqlite3.connect(tmp_path / "identities.db")
+    db.execute("PRAGMA user_version = 0")
+    db.close()
+    identities.__init__(str(tmp_path / "identities.db"))
+    assert await identities.lookup("artist", identity.keys("Radiohead"), "spotify") is None
+
+
+@pytest.mark.asyncio
+async def test_batch_fetches_known_ids_at_once(identity, identities, mocker):
+    for name in ["A", "B", "Gone"]:
+        await identities.link("artist", identity.keys(name), "spotify", identity.Link(name.lower(), 1.0))
+    await identities.link("artist", identity.keys("Missing"), "spotify", identity.Link(None, 0.0))
+
+    get_many = AsyncMock(return_value=[make_artist("A", "a"), make_artist("B", "b"), None])
+    resolve = AsyncMock(side_effect=lambda name, _: make_artist(name, name.lower()))
+    results = await identities._batch("artist", [("A", ""), ("New", ""), ("B", ""), ("Gone", ""), ("Missing", ""),
+                                                 ("A", "")], get_many, resolve)
+
+    assert [r.spotify_id if r else None for r in results] == ["a", "new", "b", "gone", None, "a"]
+    # One request for the linked ids, duplicates included once
+    get_many.assert_awaited_once_with(["a", "b", "gone"])
+    # The unknown id was dropped, remembered misses are not searched again
+    assert sorted(call.args[0] for call in resolve.await_args_list) == ["Gone", "New"]
+    assert await identities.lookup("artist", identity.keys("Gone"), "spotify") is None
+
+
+@pytest.mark.asyncio
+async def test_genius_song_is_linked(identity, identities):
+    import aiohttp
+    from unittest.mock import MagicMock
+    from cogs.music.genius import Song
+
+    found = Song(1, "Karma Police", "Radiohead", "https://genius.com/1", "")
+    identities.genius = MagicMock(search=AsyncMock(return_value=found), song=AsyncMock(return_value=found))
+    assert await identities.genius_song("Karma Police Radiohead", "Radiohead", "Karma Police") == found
+    assert await identities.genius_song("karma police radiohead", "Radiohead", "Karma Police (Remastered)") == found
+    identities.genius.search.assert_awaited_once()
+    identities.genius.song.assert_awaited_once_with(1)
+
+    # A song that is gone is searched again
+    identities.genius.song.side_effect = aiohttp.ClientResponseError(None, (), status=404)
+    assert await identities.genius_song("Karma Police Radiohead", "Radiohead", "Karma Police") == found
+    assert identities.genius.search.await_count == 2
@@ -0,0 +1,140 @@
+import asyncio
+import os
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from util.imagecache import ImageCache
+
+# Tests for util.imagecache
+
+
+class Images:
+    """Serves /<name> with the bytes of `name`, and counts the requests per path."""
+
+    def __init__(self):
+        self.requests = {}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        self.requests[name] = self.requests.get(name, 0) + 1
+        await asyncio.sleep(0.05)
+        if name == "missing":
+            return web.Response(status=404)
+        if name == "chunked":
+            # Without a content length, written in several chunks
+            resp = web.StreamResponse()
+            await resp.prepare(request)
+            for part in range(6):
+                await resp.write(bytes([part]) * 100_000)
+                await asyncio.sleep(0.01)
+            await resp.write_eof()
+            return resp
+        # Names with the same prefix before the dot are the same image
+        return web.Response(body=name.split(".")[0].encode() * 100)
+
+
+@pytest_asyncio.fixture
+async def server():
+    images = Images()
+    app = web.Application()
+    app.router.add_get("/{name}", images.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    images.url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    yield images
+    await runner.cleanup()
+
+
+@pytest_asyncio.fixture
+async def cache(tmp_path):
+    async with aiohttp.ClientSession() as session:
+        cache = ImageCache(str(tmp_path), session, max_bytes=1000)
+        yield cache
+        cache.close()
+
+
+@pytest.mark.asyncio
+async def test_hit_and_miss(server, cache):
+    path = await cache.get(f"{server.url}/a")
+    assert open(path, "rb").read() == b"a" * 100
+    assert await cache.get(f"{server.url}/a") == path
+
+    assert server.requests == {"a": 1}
+    assert (cache.hits, cache.misses, cache.hit_rate) == (1, 1, 0.5)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_downloads_are_shared(server, cache):
+    paths = await asyncio.gather(*(cache.get(f"{server.url}/a") for _ in range(5)))
+    assert len(set(paths)) == 1
+    assert server.requests == {"a": 1}
+
+
+@pytest.mark.asyncio
+async def test_same_content_is_stored_once(server, cache):
+    assert await cache.get(f"{server.url}/a.jpg") == await cache.get(f"{server.url}/a.png")
+    assert cache.size == 100
+
+
+@pytest.mark.asyncio
+async def test_chunked_download(server, tmp_path):
+    async with aiohttp.ClientSession() as session:
+        cache = ImageCache(str(tmp_path), session)
+        path = await cache.get(f"{server.url}/chunked")
+        assert open(path, "rb").read() == b"".join(bytes([part]) * 100_000 for part in range(6))
+
+        # Too large images are only noticed while reading
+        cache.max_image_bytes = 500_000
+        assert await cache.get(f"{server.url}/chunked?again") is None
+        cache.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_download(server, cache):
+    assert await cache.get(f"{server.url}/missing") is None
+    assert await cache.get("http://127.0.0.1:1/unreachable") is None
+    assert cache.size == 0
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_are_evicted(server, cache):
+    paths = {}
+    for name in "abcdefghij":
+        paths[name] = await cache.get(f"{server.url}/{name}")
+    # Use "a" again, so "b" is the least recently used
+    await cache.get(f"{server.url}/a")
+
+    await cache.get(f"{server.url}/k")
+    # Evicted down to 90% of the limit
+    assert cache.size == 900
+    assert not os.path.exists(paths["b"]) and not os.path.exists(paths["c"])
+    assert os.path.exists(paths["a"]) and os.path.exists(paths["d"])
+
+    await cache.get(f"{server.url}/b")
+    assert server.requests["b"] == 2
+
+
+@pytest.mark.asyncio
+async def test_open_maps_the_file(server, cache):
+    view = await cache.open(f"{server.url}/a")
+    assert view[:3] == b"aaa" and len(view) == 100
+    view.close()
+
+
+@pytest.mark.asyncio
+async def test_index_survives_restart(server, tmp_path):
+    async with aiohttp.ClientSession() as session:
+        cache = ImageCache(str(tmp_path), session)
+        path = await cache.get(f"{server.url}/a")
+        cache.close()
+
+        cache = ImageCache(str(tmp_path), session)
+        assert cache.size == 100
+        assert await cache.get(f"{server.url}/a") == path
+        cache.close()
+    assert server.requests == {"a": 1}
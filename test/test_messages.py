@@ -0,0 +1,85 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from util.messages import MessageSender, split_text
+
+
+# Tests for util.messages
+
+def test_short_text_is_not_split():
+    assert split_text("hello", prefix="> ") == ["> hello"]
+
+
+def test_chunks_fit_the_limit():
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = split_text(text, limit=100, prefix="<", suffix=">")
+
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert all(chunk.startswith("<") and chunk.endswith(">") for chunk in chunks)
+    # Nothing but the separating spaces got lost
+    assert " ".join(chunk[1:-1] for chunk in chunks) == text
+
+
+def test_split_prefers_paragraphs():
+    first = "a" * 40 + "\n" + "b" * 20
+    second = "c" * 30
+    assert split_text(first + "\n\n" + second, limit=70) == [first, second]
+
+
+def test_split_does_not_cut_words():
+    text = "lorem ipsum dolor sit amet " * 10
+    for chunk in split_text(text, limit=50):
+        assert all(word in ("lorem", "ipsum", "dolor", "sit", "amet") for word in chunk.split())
+
+
+def test_code_blocks_are_balanced():
+    code = "\n".join(f"print({i})" for i in range(50))
+    text = f"Some code:\n```py\n{code}\n```\nDone."
+    chunks = split_text(text, limit=120)
+
+    assert len(chunks) > 2
+    for chunk in chunks:
+        assert chunk.count("```") % 2 == 0
+    # Continued blocks keep their language
+    assert all(chunk.startswith("```py\n") for chunk in chunks[1:-1])
+
+
+def test_combining_characters_stay_together():
+    text = "é" * 30
+    for chunk in split_text(text, limit=15):
+        assert not chunk.startswith("́")
+
+
+def test_no_chunk_is_blank():
+    text = "a" * 50 + "\n\n\n\n" + "b" * 50 + "\n\n\n"
+    assert split_text(text, limit=60) == ["a" * 50, "b" * 50]
+    assert split_text(text, limit=60, prefix="> ") == ["> " + "a" * 50, "> " + "b" * 50]
+    assert split_text("\n\n \n") == []
+
+
+def test_no_chunk_is_blank_after_code_blocks():
+    text = "```\n" + "x" * 40 + "\n```\n\n\n\n" + "y" * 40 + "\n\n"
+    chunks = split_text(text, limit=50, prefix="> ")
+    assert chunks == ["> ```\n" + "x" * 40 + "\n```", "> " + "y" * 40]
+
+
+@pytest.mark.asyncio
+async def test_sender_keeps_order_and_paces():
+    sent = []
+
+    ctx = MagicMock()
+    ctx.channel.id = 1
+    ctx.reply = AsyncMock(side_effect=lambda msg: sent.append(msg))
+    ctx.send = AsyncMock(side_effect=lambda msg: sent.append(msg))
+
+    sender = MessageSender(rate=2, per=0.1)
+    start = time.monotonic()
+    await asyncio.gather(sender.send(ctx, ["a1", "a2", "a3"]), sender.send(ctx, ["b1", "b2"]))
+
+    assert sent == ["a1", "a2", "a3", "b1", "b2"]
+    assert ctx.reply.await_count == 2
+    # The first two messages are free, the other three have to wait for the bucket to refill
+    assert time.monotonic() - start >= 0.15
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from util import metrics
+
+
+# Tests for util.metrics
+
+def test_counter():
+    counter = metrics.Counter("test_counter_total", "Test counter", ["kind"])
+    counter.inc(kind="a")
+    counter.inc(2, kind="a")
+    counter.inc(kind="b")
+
+    assert counter.get(kind="a") == 3
+    assert 'test_counter_total{kind="a"} 3' in metrics.render()
+    assert "# TYPE test_counter_total counter" in metrics.render()
+
+
+def test_metrics_are_registered_once():
+    counter = metrics.Counter("test_once_total", "Test counter")
+    counter.inc()
+
+    again = metrics.Counter("test_once_total", "Test counter")
+    assert again is counter
+    assert again.get() == 1
+
+
+def test_histogram():
+    histogram = metrics.Histogram("test_seconds", "Test histogram", ["command"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, command="x")
+    histogram.observe(0.5, command="x")
+    histogram.observe(5, command="x")
+
+    rendered = metrics.render()
+    assert 'test_seconds_bucket{command="x",le="0.1"} 1' in rendered
+    assert 'test_seconds_bucket{command="x",le="1.0"} 2' in rendered
+    assert 'test_seconds_bucket{command="x",le="+Inf"} 3' in rendered
+    assert 'test_seconds_count{command="x"} 3' in rendered
+    assert 'test_seconds_sum{command="x"} 5.55' in rendered
+
+
+def test_gauge_callback():
+    metrics.Gauge("test_gauge", "Test gauge", ["stat"], callback=lambda: {("p50",): 0.25})
+    assert 'test_gauge{stat="p50"} 0.25' in metrics.render()
+
+
+def test_counter_callback():
+    metrics.Counter("test_callback_total", "Test counter", callback=lambda: {(): 3})
+    assert "test_callback_total 3" in metrics.render()
+    assert "# TYPE test_callback_total counter" in metrics.render()
+
+
+def test_executor_counts_waiting_calls():
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    with metrics.Executor(max_workers=1) as executor:
+        futures = [executor.submit(block), executor.submit(block), executor.submit(print, end="")]
+        started.wait()
+        assert executor.waiting == 2
+        release.set()
+        for future in futures:
+            future.result()
+        assert executor.waiting == 0
+
+
+def test_track_counts_errors():
+    with metrics.track("test_service"):
+        pass
+
+    with pytest.raises(ValueError):
+        with metrics.track("test_service"):
+            raise ValueError()
+
+    assert metrics.outbound_errors.get(service="test_service") == 1
+    assert 'damabot_outbound_seconds_count{service="test_service"} 2' in metrics.render()
+
+
+def test_cache_hit_ratio():
+    metrics.cache_lookup("test_cache", hit=True)
+    metrics.cache_lookup("test_cache", hit=True)
+    metrics.cache_lookup("test_cache", hit=False)
+    metrics.cache_lookup("test_cache", hit=False)
+    assert 'damabot_cache_hit_ratio{cache="test_cache"} 0.5' in metrics.render()
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+import pytest
+
+from util import profiler
+
+# Tests for util.profiler
+
+# Mark all tests in this module as async
+pytestmark = pytest.mark.asyncio
+
+
+async def blocking_work():
+    while True:
+        time.sleep(0.01)
+        await asyncio.sleep(0)
+
+
+async def test_profile_finds_blocking_calls():
+    task = asyncio.create_task(blocking_work())
+    result = await profiler.profile(0.3, memory=True)
+    task.cancel()
+
+    assert result.samples > 0
+    assert any("blocking_work" in name for name in result.own)
+    assert any("blocking_work" in name for name in result.awaiting)
+    assert result.memory is not None
+    assert "Top functions by own time" in result.report()
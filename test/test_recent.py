@@ -0,0 +1,151 @@
+import asyncio
+from types import SimpleNamespace
+
+import pylast
+import pytest
+
+# Tests for cogs.music.recent
+
+
+@pytest.fixture
+def recent(setup_mock_env, mock_search_apis):
+    from cogs.music import recent
+    return recent
+
+
+class Scrobbles:
+    """Fake Last.fm with 25 scrobbles, one per second, or the given times. Counts the requests."""
+
+    def __init__(self, count: int = 25, times: list = None):
+        self.times = times or list(range(1000 + count, 1000, -1))
+        self.requests = []
+
+    async def fetch(self, username: str, limit: int, time_to: int = None):
+        self.requests.append(time_to)
+        await asyncio.sleep(0.01)
+        selected = [i for i, t in enumerate(self.times) if time_to is None or t < time_to][:limit]
+        return [pylast.PlayedTrack(SimpleNamespace(title=f"Track {i}", artist=SimpleNamespace(name="Artist")),
+                                   None, None, str(self.times[i])) for i in selected]
+
+
+@pytest.mark.asyncio
+async def test_pages_continue_at_the_previous_one(recent):
+    scrobbles = Scrobbles()
+    cache = recent.RecentCache(scrobbles.fetch)
+    pages = cache.get("user")
+
+    first = await pages.get(0)
+    assert [p.timestamp for p in first] == [str(t) for t in range(1025, 1015, -1)]
+    second = await pages.get(1)
+    assert second[0].timestamp == "1015"
+    last = await pages.get(2)
+    assert len(last) == 5
+    assert pages.has_next(1) and not pages.has_next(2)
+    # Nothing is prefetched after the last page
+    await asyncio.sleep(0.05)
+    assert scrobbles.requests == [None, 1017, 1007]
+    cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_scrobbles_at_the_page_boundary_are_kept(recent):
+    # 23 scrobbles, of which 12 in the same second across the end of the first and the whole second page
+    scrobbles = Scrobbles(times=[1020 - i for i in range(5)] + [1010] * 12 + [1000 - i for i in range(6)])
+    cache = recent.RecentCache(scrobbles.fetch)
+    pages = cache.get("user")
+
+    shown = [s.track.title for index in range(3) for s in await pages.get(index)]
+    assert shown == [f"Track {i}" for i in range(23)]
+    assert not pages.has_next(2)
+    cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_expired_pages_stay_usable(recent):
+    scrobbles = Scrobbles()
+    cache = recent.RecentCache(scrobbles.fetch, ttl=0.0)
+    pages = cache.get("user")
+    loading = asyncio.create_task(pages.get(0))
+    await asyncio.sleep(0)
+
+    # Expires the pages of the user while a view waits for them
+    assert cache.get("other") is not pages
+    assert len(await loading) == 10
+    cache.clear()
+    pages.cancel()
+
+
+@pytest.mark.asyncio
+async def test_next_page_is_prefetched(recent):
+    scrobbles = Scrobbles()
+    cache = recent.RecentCache(scrobbles.fetch)
+    pages = cache.get("user")
+
+    await pages.get(0)
+    assert not pages.ready(1)
+    await asyncio.sleep(0.05)
+    assert pages.ready(1)
+    await pages.get(1)
+    assert scrobbles.requests == [None, 1017]
+    cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_pages_are_cached(recent):
+    scrobbles = Scrobbles()
+    cache = recent.RecentCache(scrobbles.fetch, ttl=0.1)
+    await cache.get("User").get(0)
+    await cache.get("user").get(0)
+    assert scrobbles.requests == [None]
+
+    await asyncio.sleep(0.15)
+    await cache.get("user").get(0)
+    assert scrobbles.requests[-1] is None and len(scrobbles.requests) == 3
+    cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_failed_fetch_is_retried(recent):
+    scrobbles = Scrobbles()
+    calls = []
+
+    async def flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise pylast.NetworkError(None, "timeout")
+        return await scrobbles.fetch(*args)
+
+    cache = recent.RecentCache(flaky)
+    pages = cache.get("user")
+    with pytest.raises(pylast.NetworkError):
+        await pages.get(0)
+    assert len(await pages.get(0)) == 10
+    cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_view_pages_with_buttons(recent):
+    from unittest.mock import AsyncMock, MagicMock
+
+    scrobbles = Scrobbles()
+    cache = recent.RecentCache(scrobbles.fetch)
+    view = recent.RecentView(cache.get("user"), MagicMock())
+
+    embed = await view.embed()
+    assert embed.title == "Recent scrobbles" and len(embed.fields) == 10
+    assert view.newer.disabled and not view.older.disabled
+
+    # The prefetched page is shown right away
+    await asyncio.sleep(0.05)
+    interaction = MagicMock(response=AsyncMock())
+    await view._show(interaction, 1)
+    interaction.response.edit_message.assert_awaited_once()
+    assert view.index == 1 and not view.newer.disabled
+
+    # The page after it is still being fetched, so the interaction is deferred
+    interaction = MagicMock(response=AsyncMock(), edit_original_response=AsyncMock())
+    await view._show(interaction, 2)
+    interaction.response.defer.assert_awaited_once()
+    assert interaction.edit_original_response.call_args.kwargs["embed"].footer.text == "Page 3"
+    assert view.older.disabled
+    cache.clear()
@@ -0,0 +1,62 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from discord import Intents, Object
+from discord.ext.commands import Bot, hybrid_command
+
+from util import slash
+
+# Tests for util.slash
+
+# Mark all tests in this module as async
+pytestmark = pytest.mark.asyncio
+
+
+@hybrid_command()
+async def ping(ctx):
+    """Test command"""
+    pass
+
+
+def make_bot() -> Bot:
+    bot = Bot(command_prefix=".", intents=Intents.none())
+    bot._connection.application_id = 1
+    bot.tree.sync = AsyncMock()
+    return bot
+
+
+async def test_sync_skips_unchanged_tree():
+    bot = make_bot()
+
+    assert await slash.sync(bot)
+    assert not await slash.sync(bot)
+    assert await slash.sync(bot, force=True)
+    assert bot.tree.sync.await_count == 2
+
+
+async def test_sync_after_change():
+    bot = make_bot()
+    await slash.sync(bot)
+
+    bot.add_command(ping)
+    assert await slash.sync(bot)
+
+    # Guild scopes are tracked separately
+    assert await slash.sync(bot, guild=Object(5))
+    assert not await slash.sync(bot, guild=Object(5))
+
+
+async def test_clear_forces_next_sync():
+    bot = make_bot()
+    await slash.sync(bot)
+
+    bot.add_command(ping)
+    await slash.sync(bot)
+
+    # An empty tree is synced, and the local tree is restored
+    uploaded = []
+    bot.tree.sync.side_effect = lambda guild: uploaded.append(bot.tree.get_commands(guild=guild))
+    await slash.clear(bot)
+    assert uploaded == [[]]
+    assert [command.name for command in bot.tree.get_commands()] == ["ping"]
+    assert await slash.sync(bot)
@@ -0,0 +1,132 @@
+import asyncio
+import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pytest
+
+# Tests for cogs.music.stats
+
+utc = datetime.timezone.utc
+
+
+@pytest.fixture
+def stats(setup_mock_env, mock_search_apis):
+    from cogs.music import stats
+    return stats
+
+
+def ts(*args, tz=utc) -> int:
+    return int(datetime.datetime(*args, tzinfo=tz).timestamp())
+
+
+def test_parse_range(stats):
+    assert stats.parse_range("all", utc) == (None, None)
+    assert stats.parse_range("2023-01..2023-06", utc) == (ts(2023, 1, 1), ts(2023, 7, 1))
+    assert stats.parse_range("2023", utc) == (ts(2023, 1, 1), ts(2024, 1, 1))
+    assert stats.parse_range("2023-12", utc) == (ts(2023, 12, 1), ts(2024, 1, 1))
+    assert stats.parse_range("2023-03-14..", utc) == (ts(2023, 3, 14), None)
+    assert stats.parse_range("..2020", utc) == (None, ts(2021, 1, 1))
+
+    berlin = ZoneInfo("Europe/Berlin")
+    assert stats.parse_range("2023-07-01", berlin) == (ts(2023, 7, 1, tz=berlin), ts(2023, 7, 2, tz=berlin))
+
+    now = datetime.datetime(2023, 8, 1, tzinfo=utc)
+    assert stats.parse_range("7d", utc, now=now) == (ts(2023, 7, 25), None)
+
+    for invalid in ["lh", "2023-13", "2023-06..2023-01", ".."]:
+        with pytest.raises(ValueError):
+            stats.parse_range(invalid, utc)
+
+
+def test_top_and_window(stats):
+    # (time, artist, track, album)
+    rows = [(100, 1, 10, 5), (200, 2, 20, None), (300, 1, 11, 5), (400, 3, 30, 6), (500, 2, 20, None)]
+    plays = stats.Plays.from_rows(rows)
+
+    assert plays.top("artists") == [(1, 2), (2, 2), (3, 1)]
+    assert plays.top("artists", count=1) == [(1, 2)]
+    assert plays.top("albums") == [(5, 2), (6, 1)]
+    assert plays.window(200, 500).top("tracks") == [(11, 1), (20, 1), (30, 1)]
+    assert len(plays.window(start=450)) == 1
+
+
+def test_time_breakdowns(stats):
+    berlin = ZoneInfo("Europe/Berlin")
+    # Monday 2023-07-03 23:30 UTC is already Tuesday 01:30 in Berlin (summer time)
+    times = [ts(2023, 7, 3, 23, 30), ts(2023, 7, 4, 12), ts(2023, 7, 5, 12), ts(2023, 7, 8, 12)]
+    plays = stats.Plays.from_rows([(t, 1, 1, None) for t in times])
+
+    assert plays.by_weekday(utc).tolist() == [1, 1, 1, 0, 0, 1, 0]
+    assert plays.by_weekday(berlin).tolist() == [0, 2, 1, 0, 0, 1, 0]
+    assert plays.by_hour(berlin)[1] == 1 and plays.by_hour(utc)[23] == 1
+
+    today = ts(2023, 7, 9) // 86400
+    assert plays.streaks(utc, today=today) == {"longest": 3, "current": 1, "days": 4}
+    assert plays.streaks(berlin, today=today + 5)["current"] == 0
+
+
+def test_stats_loads_new_scrobbles_only(stats):
+    class FakeHistory:
+        def __init__(self):
+            self.rows = [(t, 1, 1, None) for t in range(100, 200, 10)]
+            self.queries = []
+
+        async def status(self, username):
+            return len(self.rows), None, False
+
+        async def plays(self, username, start=None, end=None):
+            self.queries.append((start, end))
+            return [r for r in self.rows if (start is None or r[0] >= start) and (end is None or r[0] < end)]
+
+    async def run():
+        history = FakeHistory()
+        engine = stats.Stats(history)
+        assert len(await engine.plays("user")) == 10
+
+        # A sync and a backfill page arrive
+        history.rows = [(50, 2, 2, None)] + history.rows + [(300, 3, 3, 7)]
+        history.queries.clear()
+        plays = await engine.plays("user")
+        return plays, history.queries
+
+    plays, queries = asyncio.run(run())
+    assert queries == [(191, None), (None, 100)]
+    assert plays.times.tolist() == [50] + list(range(100, 200, 10)) + [300]
+    assert np.all(np.diff(plays.times) > 0)
+
+
+def test_guild_charts_recount_changed_members_only(stats):
+    class FakeHistory:
+        def __init__(self):
+            # (time, artist, track, album)
+            self.rows = {"a": [(1, 1, 1, None), (2, 2, 2, None)], "b": [(1, 1, 1, None), (2, 1, 3, None)]}
+            self.queries = []
+
+        async def versions(self, usernames):
+            return {name: (len(self.rows[name]),) for name in usernames if name in self.rows}
+
+        async def plays(self, username, start=None, end=None):
+            self.queries.append(username)
+            return self.rows[username]
+
+        async def titles(self, kind, ids):
+            return {i: (f"Artist {i}", "") for i in ids}
+
+    async def run():
+        history = FakeHistory()
+        charts = stats.GuildCharts(history)
+        results = [await charts.top(1, ["a", "b", "unsynced"], "artists")]
+        results.append(await charts.top(1, ["a", "b", "unsynced"], "artists"))
+        queries = list(history.queries)
+
+        history.rows["b"].append((3, 2, 4, None))
+        results.append(await charts.top(1, ["a", "b", "unsynced"], "artists"))
+        return results, queries, history.queries[len(queries):]
+
+    results, first_queries, later_queries = asyncio.run(run())
+    assert results[0] == ([("Artist 1", "", 3, 2), ("Artist 2", "", 1, 1)], 2)
+    assert results[1] == results[0]
+    assert sorted(first_queries) == ["a", "b"]
+    assert later_queries == ["b"]
+    assert results[2][0][1] == ("Artist 2", "", 2, 2)
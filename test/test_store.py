@@ -0,0 +1,72 @@
+import pytest
+
+from cluster import split_shards
+from util.config import Config, _merge
+from util.store import SQLiteStore
+
+
+# Tests for util.store and the store mode of util.config.Config
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "store.db")
+    yield path
+    Config.use_store(None)
+
+
+def test_update_increments_version(store_path):
+    store = SQLiteStore(store_path)
+    assert store.get("music") is None
+
+    assert store.update("music", lambda data: {"names": {}}) == ({"names": {}}, 1)
+    assert store.update("music", lambda data: data | {"x": 1}) == ({"names": {}, "x": 1}, 2)
+    assert store.get("music") == ({"names": {}, "x": 1}, 2)
+
+
+def test_changed_only_sees_other_connections(store_path):
+    a, b = SQLiteStore(store_path, refresh_interval=0), SQLiteStore(store_path, refresh_interval=0)
+
+    a.update("music", lambda data: {})
+    assert not a.changed()
+    assert b.changed()
+    assert not b.changed()
+
+
+def test_merge():
+    base = {"names": {"1": "a", "2": "b"}, "flag": True}
+    ours = {"names": {"1": "a", "3": "c"}, "flag": True}
+    theirs = {"names": {"1": "x", "2": "b"}, "flag": False}
+
+    assert _merge(base, ours, theirs) == {"names": {"1": "x", "3": "c"}, "flag": False}
+
+
+def test_configs_share_the_store(store_path):
+    Config._instances.pop("_shared", None)
+    Config.use_store(SQLiteStore(store_path, refresh_interval=0))
+    config = Config("_shared")
+    config.data["names"] = {"1": "a"}
+    config.save()
+
+    # Another process writes in between
+    other = SQLiteStore(store_path)
+    other.update("_shared", lambda data: {"names": data["names"] | {"2": "b"}})
+
+    names = config.data["names"]
+    assert names == {"1": "a", "2": "b"}
+
+    # References to nested dicts see later changes
+    other.update("_shared", lambda data: {"names": data["names"] | {"5": "e"}})
+    assert config.data["names"] is names
+    assert names["5"] == "e"
+    del names["5"]
+
+    names["3"] = "c"
+    other.update("_shared", lambda data: {"names": data["names"] | {"4": "d"}})
+    config.save()
+    assert other.get("_shared")[0]["names"] == {"1": "a", "2": "b", "3": "c", "4": "d"}
+    assert config.data["names"] is names
+
+
+def test_split_shards():
+    assert split_shards(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert split_shards(2, 4) == [[0], [1]]
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+# Tests for cogs.music.taste
+
+
+@pytest.fixture
+def taste(setup_mock_env, mock_search_apis):
+    from cogs.music import stats, taste
+
+    class FakeHistory:
+        def __init__(self):
+            # Artist ids played per user, every scrobble is (time, artist, track, album)
+            self.artists = {"a": [1, 1, 2, 3], "b": [1, 2, 2, 3], "c": [7, 8], "d": [1, 1, 1, 8]}
+            self.queries = 0
+
+        async def versions(self, usernames):
+            return {name.lower(): (len(self.artists[name.lower()]),) for name in usernames}
+
+        async def plays(self, username, start=None, end=None):
+            self.queries += 1
+            return [(i, artist, artist, None) for i, artist in enumerate(self.artists[username])]
+
+    history = FakeHistory()
+    return taste.Compatibility(stats.GuildCharts(history)), history
+
+
+def test_similarity(taste):
+    compatibility, history = taste
+    similarity = asyncio.run(compatibility.similarity(1, ["A", "b", "c", "d"]))
+
+    assert similarity.pair("a", "a") == pytest.approx(1.0)
+    assert similarity.pair("a", "c") == 0.0
+    assert similarity.pair("a", "b") == pytest.approx(similarity.pair("B", "A"))
+    assert similarity.pair("a", "b") > similarity.pair("a", "d") > 0
+    assert similarity.most_similar(2)[0][:2] == ("a", "b")
+    assert set(similarity.shared("a", "b")) == {1, 2, 3}
+    assert similarity.shared("a", "d") == [1]
+
+
+def test_similarity_is_cached_until_a_member_changes(taste):
+    compatibility, history = taste
+
+    async def run():
+        first = await compatibility.similarity(1, ["a", "b", "c"])
+        second = await compatibility.similarity(1, ["a", "b", "c"])
+        queries = history.queries
+        history.artists["c"].append(1)
+        third = await compatibility.similarity(1, ["a", "b", "c"])
+        return first, second, third, queries
+
+    first, second, third, queries = asyncio.run(run())
+    assert first is second and queries == 3
+    # Only the changed member was counted again
+    assert history.queries == 4
+    assert third.pair("a", "c") > 0
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+import pytest
+
+from util import metrics, tracing
+
+
+# Tests for util.tracing
+
+@pytest.fixture
+def sampled(monkeypatch):
+    monkeypatch.setattr(tracing, "sample_rate", 1.0)
+    tracing.recent.clear()
+
+
+def test_spans_without_trace_are_noops():
+    with tracing.span("lastfm") as span:
+        assert span is None
+
+
+def test_unsampled_commands_are_not_traced(monkeypatch):
+    monkeypatch.setattr(tracing, "sample_rate", 0.0)
+    assert tracing.start_trace("album") is None
+
+    with tracing.span("lastfm") as span:
+        assert span is None
+
+
+def test_track_records_child_spans(sampled):
+    async def command():
+        root = tracing.start_trace("album")
+        with metrics.track("lastfm", "search"):
+            pass
+        with pytest.raises(ValueError):
+            with metrics.track("spotify"):
+                raise ValueError()
+        tracing.finish_trace(root)
+        return root
+
+    root = asyncio.run(command())
+
+    assert [(s.name, s.attributes, s.error) for s in root.children] == \
+           [("lastfm", {"operation": "search"}, None), ("spotify", {}, "ValueError")]
+    assert "spotify" in root.summary() and "1 failed" in root.summary()
+    assert tracing.slowest() == [root]
+
+
+def test_concurrent_calls_share_the_trace(sampled):
+    async def call():
+        with tracing.span("lastfm"):
+            await asyncio.sleep(0.01)
+
+    async def command():
+        root = tracing.start_trace("who_knows")
+        await asyncio.gather(*[call() for _ in range(3)])
+        tracing.finish_trace(root)
+        return root
+
+    root = asyncio.run(command())
+    assert len(root.children) == 3
+    assert "(3x)" in root.summary()
+
+
+def test_export(sampled, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracing.setup_export(str(path))
+    try:
+        root = tracing.start_trace("album", invocation="/album")
+        with tracing.span("discord", operation="send"):
+            pass
+        tracing.finish_trace(root)
+    finally:
+        tracing.stop_export()
+
+    line = json.loads(path.read_text())
+    assert line["trace_id"] == root.trace_id
+    assert line["attributes"] == {"invocation": "/album"}
+    assert line["children"][0]["name"] == "discord"
+
+
+def test_sample_rate_from_environment(monkeypatch):
+    monkeypatch.setattr(tracing, "sample_rate", 0.2)
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "0.5")
+    tracing.configure()
+    assert tracing.sample_rate == 0.5
@@ -0,0 +1,66 @@
+import io
+import random
+
+from PIL import Image
+
+from cogs.emoji import transcode
+
+
+# Tests for cogs.emoji.transcode
+
+def noise_image(size: int, seed: int = 0) -> Image.Image:
+    """Random pixels compress badly, which makes it easy to create oversized images"""
+    return Image.frombytes("RGBA", (size, size), random.Random(seed).randbytes(size * size * 4))
+
+
+def encode(frames, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if len(frames) > 1:
+        frames[0].save(buffer, fmt, save_all=True, append_images=frames[1:], duration=50, loop=0)
+    else:
+        frames[0].save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_small_image_is_unchanged():
+    data = encode([noise_image(32)], "PNG")
+    assert transcode.fit(data) is data
+
+
+def test_static_image_is_shrunk():
+    data = encode([noise_image(512)], "PNG")
+    assert len(data) > transcode.EMOJI_LIMIT
+
+    result = transcode.fit(data)
+    assert len(result) <= transcode.EMOJI_LIMIT
+    with Image.open(io.BytesIO(result)) as image:
+        assert max(image.size) <= 128
+
+
+def test_animated_image_stays_animated():
+    data = encode([noise_image(256, seed) for seed in range(12)], "GIF")
+    assert len(data) > transcode.EMOJI_LIMIT
+
+    result = transcode.fit(data)
+    assert len(result) <= transcode.EMOJI_LIMIT
+    with Image.open(io.BytesIO(result)) as image:
+        assert image.format == "GIF"
+        assert image.is_animated
+
+
+def test_resolution_is_reduced_first():
+    data = encode([noise_image(256, seed) for seed in range(4)], "GIF")
+    first = []
+    for variant in transcode.variants(data):
+        with Image.open(io.BytesIO(variant)) as image:
+            first.append((image.size[0], image.n_frames))
+        if len(first) == 6:
+            break
+
+    # All sizes with all frames, before any frame is dropped
+    assert first == [(128, 4), (96, 4), (64, 4), (48, 4), (32, 4), (128, 2)]
+
+
+def test_unfittable_image():
+    data = encode([noise_image(128)], "PNG")
+    assert transcode.fit(data, limit=100) is None
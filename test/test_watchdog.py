@@ -0,0 +1,33 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from util.watchdog import Watchdog
+
+# Tests for util.watchdog
+
+# Mark all tests in this module as async
+pytestmark = pytest.mark.asyncio
+
+
+async def test_blocking_call_is_reported(caplog):
+    watchdog = Watchdog(interval=0.01, threshold=0.05)
+    watchdog.start()
+
+    async def command():
+        watchdog.set_context(".blocking")
+        time.sleep(0.2)
+        watchdog.clear_context()
+
+    with caplog.at_level(logging.WARNING, logger="util.watchdog"):
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(command())
+        await asyncio.sleep(0.05)
+    watchdog.stop()
+
+    assert watchdog.blocked == 1
+    assert "during .blocking" in caplog.text
+    assert "command" in caplog.text
+    assert watchdog.percentiles()["max"] >= 0.15
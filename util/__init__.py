@@ -3,6 +3,8 @@ import logging
 from discord.app_commands import Command
 from discord.ext.commands import Context
 
+from util import messages
+
 _log = logging.getLogger(__name__)
 
 
@@ -15,10 +17,11 @@ _log = logging.getLogger(__name__)
 
 
 async def split_message(text: str, ctx: Context, prefix="", suffix=""):
-    chunk_len = 2000 - len(prefix) - len(suffix)
-    messages_to_send = [prefix + text[idx: idx + chunk_len] + suffix for idx in range(0, len(text), chunk_len)]
-    await ctx.reply(messages_to_send[0])
-    [await ctx.send(msg) for msg in messages_to_send[1:]]
+    """
+    Reply with a text that may be too long for a single message. See :func:`util.messages.split_text`
+    for how the text is split, the messages are sent through the rate-limited :data:`util.messages.sender`.
+    """
+    await messages.sender.send(ctx, messages.split_text(text, prefix=prefix, suffix=suffix))
 
 
 def get_command(ctx: Context) -> str:
@@ -26,7 +29,7 @@ def get_command(ctx: Context) -> str:
     Retrieve the original command as a string from a commands.Context or SlashContext.
     """
     if ctx.interaction:
-        maybe_command = ctx.interaction.command()
+        maybe_command = ctx.interaction.command
         if isinstance(maybe_command, Command):
             return "/" + maybe_command.qualified_name
 
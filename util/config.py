@@ -6,6 +6,42 @@ from typing import Any, get_type_hints
 
 _log = logging.getLogger(__name__)
 
+_missing = object()
+
+
+def _copy(data: dict) -> dict:
+    return json.loads(json.dumps(data))
+
+
+def _merge(base: dict, ours: dict, theirs: dict) -> dict:
+    """Three-way merge of json objects, keeping the changes of both sides. On conflicts, ours wins."""
+    result = dict(theirs)
+    for key in set(base) | set(ours):
+        previous, mine = base.get(key, _missing), ours.get(key, _missing)
+        if mine == previous:
+            continue
+
+        if mine is _missing:
+            # Deleted by us, unless they changed it in the meantime
+            if theirs.get(key, _missing) == previous:
+                result.pop(key, None)
+        elif isinstance(mine, dict) and isinstance(previous, dict) and isinstance(theirs.get(key), dict):
+            result[key] = _merge(previous, mine, theirs[key])
+        else:
+            result[key] = mine
+    return result
+
+
+def _assign(target: dict, source: dict):
+    """Make `target` equal to `source`. Nested dicts are updated in place, so references to them stay valid."""
+    for key in [key for key in target if key not in source]:
+        del target[key]
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _assign(target[key], value)
+        else:
+            target[key] = value
+
 
 class Config:
     """Helper class for reading and writing json-based config files. The data for one file is shared across
@@ -22,9 +58,17 @@ class Config:
 
             def _init_defaults(self):
                 self.my_int = 5
+
+    With :meth:`use_store`, all configs are kept in a :class:`util.store.SQLiteStore` instead, to share them between
+    processes. Changes from other processes are merged into the loaded data, and saving merges with them as well.
+    The merge updates nested dicts in place, so references to them see the changes too.
     """
     __slots__ = ["_name", "_data", "datadir", "datafile"]
     _instances = {}
+    _store = None
+    # Per config name, the data and version last read from or written to the store
+    _bases = {}
+    _versions = {}
 
     def __init__(self, name: str):
         self._name = name
@@ -84,14 +128,47 @@ class Config:
 
     @property
     def data(self) -> dict:
+        if Config._store and Config._store.changed():
+            Config.refresh()
         return self._data
 
+    @classmethod
+    def use_store(cls, store):
+        """Keep all configs in `store`. Existing json files are imported when the config is first loaded."""
+        cls._store = store
+        cls._bases.clear()
+        cls._versions.clear()
+
+    @classmethod
+    def refresh(cls):
+        """Merge the changes other processes saved to the store into all loaded configs."""
+        for name, data in cls._instances.items():
+            stored = cls._store.get(name)
+            if stored and stored[1] != cls._versions.get(name):
+                _assign(data, _merge(cls._bases.get(name, {}), data, stored[0]))
+                cls._bases[name], cls._versions[name] = _copy(stored[0]), stored[1]
+
     def save(self):
+        if Config._store:
+            base = Config._bases.get(self.name, {})
+            data, version = Config._store.update(self.name, lambda stored: _merge(base, self._data, stored or {}))
+            if data != self._data:
+                _assign(self._data, data)
+            Config._bases[self.name], Config._versions[self.name] = _copy(data), version
+            return
+
         with open(self.datafile, "w") as file:
             file.write(json.dumps(self.data, indent=4))
             file.close()
 
     def load(self) -> bool:
+        if Config._store:
+            stored = Config._store.get(self.name)
+            if stored:
+                self._data.update(stored[0])
+                Config._bases[self.name], Config._versions[self.name] = _copy(stored[0]), stored[1]
+                return True
+
         if os.path.exists(self.datafile):
             with open(self.datafile, "r") as file:
                 self.data.update(json.loads(file.read()))
@@ -0,0 +1,58 @@
+import logging
+from typing import Dict
+
+from discord.ext.commands import Bot
+
+# Hand-off of in-memory state (caches, rate limits, ...) when an extension is reloaded, see :func:`reload`.
+# Cogs opt in with three members:
+# - state_version: int, to be incremented whenever the shape of the state changes
+# - export_state(self): return the state to keep. Use builtin types or classes of modules that are not reloaded,
+#   as instances of classes from the old extension module are not instances of the reloaded classes.
+# - import_state(self, state): take over the state, called after cog_load of the new instance
+# The state is handed to the new cog with the same name, and dropped if the new state_version differs.
+
+_log = logging.getLogger(__name__)
+
+
+def export_states(bot: Bot, extension: str) -> Dict[str, tuple]:
+    """Export the state of all cogs of `extension` that support it, as {cog name: (state_version, state)}."""
+    states = {}
+    for name, cog in bot.cogs.items():
+        in_extension = cog.__module__ == extension or cog.__module__.startswith(extension + ".")
+        if not in_extension or not hasattr(cog, "export_state"):
+            continue
+        try:
+            states[name] = (cog.state_version, cog.export_state())
+        except Exception:
+            _log.exception(f"Could not export the state of {name}, it starts empty")
+    return states
+
+
+def import_states(bot: Bot, states: Dict[str, tuple]) -> Dict[str, bool]:
+    """Import exported states into the cogs with the same name. Returns whether each state was taken over."""
+    result = {}
+    for name, (version, state) in states.items():
+        cog = bot.get_cog(name)
+        result[name] = False
+        if not cog or not hasattr(cog, "import_state"):
+            _log.info(f"Dropped the state of {name}, the cog does not take it anymore")
+        elif cog.state_version != version:
+            _log.info(f"Dropped the state of {name}, its version changed from {version} to {cog.state_version}")
+        else:
+            try:
+                cog.import_state(state)
+                result[name] = True
+            except Exception:
+                _log.exception(f"Could not import the state of {name}, it starts empty")
+    return result
+
+
+async def reload(bot: Bot, extension: str) -> Dict[str, bool]:
+    """Reload `extension`, and hand the state of its cogs to the new instances.
+    If the reload fails, discord.py restores the old extension, and the state is handed back to it instead."""
+    states = export_states(bot, extension)
+    try:
+        await bot.reload_extension(extension)
+    finally:
+        result = import_states(bot, states)
+    return result
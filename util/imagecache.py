@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+from util import metrics
+
+# On-disk cache for remote images like album covers, for features that process them instead of only embedding
+# their URL. The files are named after the hash of their content, so the same image behind several URLs is stored
+# once. An SQLite index maps the URLs to the files and keeps the time of their last use. When the cache grows
+# over `max_bytes`, the least recently used files are deleted until it is below `low_water` of the limit.
+# Several processes may share the directory (see cluster.py).
+
+_log = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS urls_digest ON urls (digest);
+CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blobs_used ON blobs (used);
+"""
+
+transferred = metrics.Counter("damabot_image_cache_bytes_total",
+                              "Bytes downloaded into the image cache, and bytes served from it", ["direction"])
+
+
+class ImageCache:
+    # Share of max_bytes that is kept after an eviction, so not every download evicts
+    low_water = 0.9
+    # Larger images are not downloaded
+    max_image_bytes = 10 * 2 ** 20
+
+    def __init__(self, directory: str, session: aiohttp.ClientSession, max_bytes: int = 256 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._session = session
+        os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False,
+                                   isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_schema)
+        self._db_lock = threading.Lock()
+        # Last use of the files since the last write, written with the next download instead of on every hit
+        self._touched: Dict[str, float] = {}
+        self._downloads: Dict[str, asyncio.Future] = {}
+
+        self.size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        metrics.Gauge("damabot_image_cache_size_bytes", "Bytes stored in the image cache",
+                      callback=lambda: {(): self.size})
+
+    def close(self):
+        with self._db_lock:
+            self._flush_touched()
+            self._db.close()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    async def get(self, url: str) -> Optional[str]:
+        """Path of the image at `url`, which is downloaded if it isn't cached yet. None if the download failed.
+        Concurrent calls for the same URL share one download. The file may be evicted later, so read it soon."""
+        cached = await self._run(self._lookup, url)
+        if cached:
+            self._hit(cached[1])
+            return cached[0]
+
+        download = self._downloads.get(url)
+        if download:
+            # Only one of the callers downloads, the others count as hits
+            path = await asyncio.shield(download)
+            if path:
+                self._hit(os.path.getsize(path))
+            return path
+
+        self.misses += 1
+        metrics.cache_lookup("images", False)
+        download = self._downloads[url] = asyncio.ensure_future(self._download(url))
+        download.add_done_callback(lambda _: self._downloads.pop(url, None))
+        return await asyncio.shield(download)
+
+    async def open(self, url: str) -> Optional[mmap.mmap]:
+        """Memory-map the image at `url` for reading, see :meth:`get`. The map stays valid even if the file is
+        evicted meanwhile. Close it when done."""
+        path = await self.get(url)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            # Evicted by another process right after the lookup
+            return None
+
+    def _hit(self, size: int):
+        self.hits += 1
+        metrics.cache_lookup("images", True)
+        transferred.inc(size, direction="served")
+
+    async def _download(self, url: str) -> Optional[str]:
+        try:
+            with metrics.track("images", "download"):
+                async with self._session.get(url) as resp:
+                    if not resp.ok or (resp.content_length or 0) > self.max_image_bytes:
+                        return None
+                    # Without a content length, the size is only known while reading
+                    data = bytearray()
+                    async for chunk in resp.content.iter_chunked(2 ** 16):
+                        data += chunk
+                        if len(data) > self.max_image_bytes:
+                            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            _log.warning(f"Could not download the image {url}", exc_info=True)
+            return None
+
+        if not data:
+            return None
+        data = bytes(data)
+        transferred.inc(len(data), direction="downloaded")
+        return await self._run(self._store, url, data)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    # ---------- Index, called in a thread through _run ----------
+
+    async def _run(self, func, *args):
+        return await asyncio.to_thread(self._locked, func, *args)
+
+    def _locked(self, func, *args):
+        with self._db_lock:
+            return func(*args)
+
+    def _lookup(self, url: str) -> Optional[tuple]:
+        row = self._db.execute("SELECT urls.digest, size FROM urls JOIN blobs ON urls.digest = blobs.digest "
+                               "WHERE url = ?", (url,)).fetchone()
+        if not row:
+            return None
+        digest, size = row
+        path = self._path(digest)
+        if not os.path.exists(path):
+            # Deleted from outside, download it again
+            self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._db.execute("DELETE FROM urls WHERE digest = ?", (digest,))
+            return None
+        self._touched[digest] = time.time()
+        return path, size
+
+    def _store(self, url: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first, so no reader ever sees a half written image
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as file:
+                file.write(data)
+            os.replace(temp, path)
+
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._flush_touched()
+            self._db.execute("INSERT INTO blobs (digest, size, used) VALUES (?, ?, ?) "
+                             "ON CONFLICT (digest) DO UPDATE SET used = excluded.used",
+                             (digest, len(data), time.time()))
+            self._db.execute("INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)", (url, digest))
+            self.size = self._db.execute("SELECT SUM(size) FROM blobs").fetchone()[0]
+            evicted = self._evict(keep=digest) if self.size > self.max_bytes else []
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def _evict(self, keep: str) -> list:
+        """Remove the least recently used files from the index until the cache is below the low water mark.
+        Returns their digests, the files are deleted after the commit."""
+        evicted = []
+        for digest, size in self._db.execute("SELECT digest, size FROM blobs ORDER BY used").fetchall():
+            if self.size <= self.max_bytes * self.low_water:
+                break
+            if digest == keep:
+                continue
+            self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._db.execute("DELETE FROM urls WHERE digest = ?", (digest,))
+            self.size -= size
+            evicted.append(digest)
+        _log.debug(f"Evicted {len(evicted)} images, {self.size} bytes left")
+        return evicted
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE blobs SET used = MAX(used, ?) WHERE digest = ?",
+                                 [(used, digest) for digest, used in self._touched.items()])
+            self._touched.clear()
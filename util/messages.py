@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+import unicodedata
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from discord.ext.commands import Context
+
+from util.ratelimit import TokenBucket
+
+_log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 2000
+
+_fence = "```"
+# Characters that attach to the character before them, a message must not be split in front of them
+_joiners = {"\u200d", "\ufe0e", "\ufe0f"}
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT, prefix: str = "", suffix: str = "") -> List[str]:
+    """Split a text into chunks that fit into one message each, including `prefix` and `suffix`.
+    Splits happen preferably at paragraph breaks, then at line breaks, then at spaces.
+    A code block that is cut in half is closed at the end of the chunk, and reopened with
+    the same language in the next one. Whitespace at the splits is dropped, so no chunk is empty."""
+    chunks = []
+    open_fence = None
+    rest = text
+
+    while rest:
+        # Blank lines at a split would make chunks without text, which Discord rejects
+        rest = rest.lstrip("\n")
+        if not rest.strip():
+            break
+        # The previous chunk already closed the code block that ends here
+        first_line, _, after = rest.partition("\n")
+        if open_fence and first_line.strip() == _fence:
+            open_fence = None
+            rest = after
+            continue
+        head = prefix + (open_fence + "\n" if open_fence else "")
+
+        if len(head) + len(rest) + len(suffix) <= limit:
+            chunks.append(head + rest.rstrip() + suffix)
+            break
+
+        # Always keep room to close a code block
+        room = limit - len(head) - len(suffix) - len("\n" + _fence)
+        if room <= 0:
+            raise ValueError("Prefix and suffix leave no room for the text")
+
+        cut, skip = _find_cut(rest, room)
+        body = rest[:cut].rstrip()
+        rest = rest[cut + skip:]
+        if not body.strip():
+            continue
+
+        open_fence = _fence_state(body, open_fence)
+        chunks.append(head + body + ("\n" + _fence if open_fence else "") + suffix)
+
+    return chunks
+
+
+def _find_cut(text: str, room: int) -> Tuple[int, int]:
+    """Find the position to cut `text` at, so the first part is at most `room` long.
+    Returns the position, and the length of the separator to drop there."""
+    piece = text[:room + 1]
+
+    for sep in ("\n\n", "\n", " "):
+        idx = piece.rfind(sep, 0, room)
+        # Only accept cuts in the second half, to avoid sending lots of tiny messages
+        if idx >= room // 2:
+            return idx, len(sep)
+
+    idx = piece.rfind(" ", 0, room)
+    if idx > 0:
+        return idx, 1
+
+    # No whitespace at all, cut hard, but keep combining characters with their base
+    cut = room
+    while cut > 1 and (unicodedata.combining(text[cut]) or text[cut] in _joiners or text[cut - 1] in _joiners
+                       or "\U0001f3fb" <= text[cut] <= "\U0001f3ff"):
+        cut -= 1
+    return cut, 0
+
+
+def _fence_state(text: str, open_fence: Optional[str]) -> Optional[str]:
+    """Return the opening line of the code block that is still open at the end of `text`, or None."""
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith(_fence):
+            open_fence = None if open_fence else stripped
+    return open_fence
+
+
+class MessageSender:
+    """Sends multi-part messages in order, paced to Discord's per-channel rate limit of 5 messages per 5 seconds,
+    instead of running into 429 responses. Messages for the same channel are queued, so the parts of two
+    answers never interleave."""
+
+    def __init__(self, rate: int = 5, per: float = 5.0):
+        self.rate = rate
+        self.per = per
+        self._locks = weakref.WeakValueDictionary()
+        self._buckets: Dict[int, TokenBucket] = {}
+
+    def _bucket(self, channel_id: int) -> TokenBucket:
+        bucket = self._buckets.get(channel_id)
+        if not bucket:
+            # Buckets of idle channels are full again, so they can be dropped
+            now = time.monotonic()
+            for key in [k for k, b in self._buckets.items() if now - b.updated > self.per]:
+                del self._buckets[key]
+
+            bucket = self._buckets[channel_id] = TokenBucket(self.rate, self.per)
+        return bucket
+
+    async def send(self, ctx: Context, chunks: Sequence[str]):
+        """Reply to `ctx` with the first chunk, and send the others to the same channel."""
+        channel_id = ctx.channel.id
+
+        lock = self._locks.get(channel_id)
+        if not lock:
+            lock = self._locks[channel_id] = asyncio.Lock()
+
+        async with lock:
+            for idx, chunk in enumerate(chunks):
+                await self._bucket(channel_id).acquire()
+                if idx == 0:
+                    await ctx.reply(chunk)
+                else:
+                    await ctx.send(chunk)
+
+
+sender = MessageSender()
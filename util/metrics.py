@@ -0,0 +1,240 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from util import tracing
+
+# Minimal metrics collection, exposed over HTTP in the Prometheus text format.
+# Recording a value is a dict lookup and an addition, so it is cheap enough for the hot paths.
+# All metrics are registered by name, creating one a second time (e.g. on a cog reload) returns the existing one.
+
+_log = logging.getLogger(__name__)
+
+_registry: Dict[str, "_Metric"] = {}
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __new__(cls, name: str, *args, **kwargs):
+        if name in _registry:
+            return _registry[name]
+        metric = super().__new__(cls)
+        _registry[name] = metric
+        return metric
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        if hasattr(self, "name"):
+            return
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, LabelValues, dict, float]]:
+        """Yield (name suffix, label values, extra labels, value) for every sample of this metric."""
+        ...
+
+
+class Counter(_Metric):
+    """A value that only goes up. With a `callback`, the values are collected from it on every scrape, for counts
+    that are kept elsewhere. It must return a dict from label values to the value."""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        if not hasattr(self, "values"):
+            self.values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        values = self.callback() if self.callback else self.values
+        for key, value in values.items():
+            yield "", key, {}, value
+
+
+class Gauge(_Metric):
+    """A value that can go up and down. With a `callback`, the values are collected from it on every scrape,
+    it must return a dict from label values to the value."""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        if not hasattr(self, "values"):
+            self.values: Dict[LabelValues, float] = {}
+        # Always take the latest callback, it may belong to a new instance of the measured object
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def samples(self):
+        values = self.callback() if self.callback else self.values
+        for key, value in values.items():
+            yield "", key, {}, value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = default_buckets):
+        super().__init__(name, documentation, labelnames)
+        if not hasattr(self, "buckets"):
+            self.buckets = tuple(buckets)
+            # Per label values: counts per bucket (non-cumulative, the last one is +Inf), sum
+            self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", key, {"le": "+Inf" if bound == float("inf") else repr(bound)}, cumulative
+            yield "_sum", key, {}, total
+            yield "_count", key, {}, cumulative
+
+
+# ---------- Metrics shared across the bot ----------
+commands = Histogram("damabot_command_seconds", "Command latency", ["command"])
+command_errors = Counter("damabot_command_errors_total", "Commands that raised an error", ["command", "error"])
+outbound = Histogram("damabot_outbound_seconds", "Latency of calls to external services", ["service"])
+outbound_errors = Counter("damabot_outbound_errors_total", "Calls to external services that failed", ["service"])
+events = Counter("damabot_events_total", "Dispatched gateway and client events", ["event"])
+cache_requests = Counter("damabot_cache_requests_total", "Cache lookups by result (hit or miss)", ["cache", "result"])
+
+
+def _cache_hit_ratios() -> Dict[LabelValues, float]:
+    totals, hits = {}, {}
+    for (cache, result), count in cache_requests.values.items():
+        totals[cache] = totals.get(cache, 0) + count
+        if result == "hit":
+            hits[cache] = count
+    return {(cache,): hits.get(cache, 0) / total for cache, total in totals.items() if total}
+
+
+cache_hit_ratio = Gauge("damabot_cache_hit_ratio", "Share of cache lookups that were hits", ["cache"],
+                        callback=_cache_hit_ratios)
+
+
+@contextlib.contextmanager
+def track(service: str, operation: str = ""):
+    """Measure a call to an external service, and count it as failed if it raises.
+    Also records the call as a span of the current trace, named after the service."""
+    start = time.perf_counter()
+    try:
+        with tracing.span(service, **({"operation": operation} if operation else {})):
+            yield
+    except Exception:
+        outbound_errors.inc(service=service)
+        raise
+    finally:
+        outbound.observe(time.perf_counter() - start, service=service)
+
+
+def cache_lookup(cache: str, hit: bool):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_registry.values()):
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+
+        try:
+            samples = list(metric.samples())
+        except Exception:
+            _log.exception("Could not collect metric %s", metric.name)
+            continue
+
+        for suffix, key, extra, value in samples:
+            labels = {**dict(zip(metric.labelnames, key)), **extra}
+            label_str = ",".join(f'{name}="{_escape(str(val))}"' for name, val in labels.items())
+            lines.append(f"{metric.name}{suffix}{{{label_str}}} {value}" if label_str
+                         else f"{metric.name}{suffix} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+class Executor(ThreadPoolExecutor):
+    """Thread pool that counts the calls waiting for a thread. Set as the default executor of the event loop,
+    it runs everything passed to asyncio.to_thread."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self._waiting_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        with self._waiting_lock:
+            self.waiting += 1
+        try:
+            return super().submit(self._run, fn, args, kwargs)
+        except Exception:
+            with self._waiting_lock:
+                self.waiting -= 1
+            raise
+
+    def _run(self, fn, args: tuple, kwargs: dict):
+        with self._waiting_lock:
+            self.waiting -= 1
+        return fn(*args, **kwargs)
@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from types import CodeType, FrameType
+from typing import Counter, Optional
+
+# Sampling profiler for the running bot. Nothing in here runs unless a profile is requested, so
+# there is no overhead otherwise. Two kinds of samples are taken while profiling:
+# - Thread samples: the stack of the event loop thread, taken from a helper thread at a fixed interval.
+#   This shows where the loop spends its wall-clock time, including blocking calls.
+# - Task samples: the coroutine each pending task is currently awaiting, which shows where work is waiting.
+
+# The selector call means that the event loop is waiting for I/O, and not doing any work
+_idle_functions = {"select"}
+
+
+def describe_code(code: CodeType, lineno: Optional[int] = None) -> str:
+    filename = os.path.relpath(code.co_filename) if code.co_filename.startswith(os.getcwd()) else code.co_filename
+    location = f"{filename}:{lineno if lineno is not None else code.co_firstlineno}"
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({location})"
+
+
+def describe_frame(frame: FrameType) -> str:
+    return describe_code(frame.f_code, frame.f_lineno)
+
+
+def format_stack(frame: FrameType, limit: int = 30) -> str:
+    """Format a stack from the innermost frame outwards."""
+    lines = []
+    while frame and len(lines) < limit:
+        lines.append("  " + describe_frame(frame))
+        frame = frame.f_back
+    return "\n".join(lines)
+
+
+def innermost_await(task: asyncio.Task) -> Optional[str]:
+    """Follow the chain of awaited coroutines of a task, and describe the one that is actually waiting,
+    together with its caller."""
+    chain = []
+    coro = task.get_coro()
+    while getattr(coro, "cr_frame", None) is not None:
+        chain.append(coro.cr_frame)
+        coro = coro.cr_await
+
+    return " <- ".join(describe_frame(frame) for frame in reversed(chain[-2:])) or None
+
+
+class Profile:
+    def __init__(self):
+        self.duration = 0.0
+        self.samples = 0
+        self.idle = 0
+        self.own: Counter[str] = collections.Counter()
+        self.cumulative: Counter[str] = collections.Counter()
+        self.task_samples = 0
+        self.awaiting: Counter[str] = collections.Counter()
+        self.memory: Optional[list] = None
+
+    def report(self, top: int = 25) -> str:
+        busy = max(1, self.samples - self.idle)
+        lines = [f"Profile over {self.duration:.1f}s: {self.samples} thread samples, {self.task_samples} task samples",
+                 f"Event loop idle: {self.idle / max(1, self.samples):.1%}", ""]
+
+        lines.append("Top functions by own time (% of busy samples)")
+        lines += [f"{count:>7} {count / busy:>7.1%}  {name}" for name, count in self.own.most_common(top)]
+
+        lines += ["", "Top functions by cumulative time (% of busy samples)"]
+        lines += [f"{count:>7} {count / busy:>7.1%}  {name}" for name, count in self.cumulative.most_common(top)]
+
+        lines += ["", "Awaiting coroutines (% of task samples)"]
+        lines += [f"{count:>7} {count / max(1, self.task_samples):>7.1%}  {name}"
+                  for name, count in self.awaiting.most_common(top)]
+
+        if self.memory is not None:
+            lines += ["", "Memory growth"]
+            lines += [f"  {stat}" for stat in self.memory[:top]]
+
+        return "\n".join(lines) + "\n"
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ])
+
+
+async def profile(seconds: float, interval: float = 0.005, task_interval: float = 0.05,
+                  memory: bool = False) -> Profile:
+    """Profile the running event loop for `seconds`. With `memory`, the allocations of that timespan are traced
+    and compared, which slows down the bot noticeably while profiling."""
+    result = Profile()
+    loop_thread = threading.get_ident()
+    stop = threading.Event()
+
+    def sample_thread():
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(loop_thread)
+            if not frame:
+                continue
+
+            result.samples += 1
+            if frame.f_code.co_name in _idle_functions:
+                result.idle += 1
+                continue
+
+            result.own[describe_code(frame.f_code)] += 1
+            seen = set()
+            while frame:
+                name = describe_code(frame.f_code)
+                if name not in seen:
+                    seen.add(name)
+                    result.cumulative[name] += 1
+                frame = frame.f_back
+
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    before = _snapshot() if memory else None
+
+    sampler = threading.Thread(target=sample_thread, name="profiler", daemon=True)
+    start = time.perf_counter()
+    sampler.start()
+
+    try:
+        current = asyncio.current_task()
+        end = start + seconds
+        while time.perf_counter() < end:
+            for task in asyncio.all_tasks():
+                if task is current or task.done():
+                    continue
+                awaiting = innermost_await(task)
+                if awaiting:
+                    result.task_samples += 1
+                    result.awaiting[awaiting] += 1
+            await asyncio.sleep(task_interval)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+        result.duration = time.perf_counter() - start
+
+        if memory:
+            after = _snapshot()
+            result.memory = after.compare_to(before, "lineno")
+            if started_tracing:
+                tracemalloc.stop()
+
+    return result
@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Token bucket that allows bursts of `rate` actions, and `rate` actions per `per` seconds on average."""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until an action is allowed, and take its token."""
+        while True:
+            self._refill()
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+from typing import Optional
+
+from discord import AppCommandType, Object
+from discord.abc import Snowflake
+from discord.ext.commands import Bot
+
+from util.config import Config
+
+# Slash command syncing, that only talks to Discord if the command tree actually changed.
+# The hash of the last synced tree is stored per scope (a guild ID, or "global") in the "slash" config.
+
+_log = logging.getLogger(__name__)
+
+
+def _scope(guild: Optional[Snowflake]) -> str:
+    return str(guild.id) if guild else "global"
+
+
+def _hashes() -> dict:
+    config = Config("slash")
+    return config.data.setdefault("hashes", {})
+
+
+def tree_hash(client: Bot, guild: Optional[Snowflake] = None) -> str:
+    """Hash the local command tree of one scope, as it would be uploaded to Discord."""
+    payload = sorted((command.to_dict() for command in client.tree.get_commands(guild=guild)),
+                     key=lambda c: (c.get("type", 1), c["name"]))
+    raw = json.dumps([client.application_id, payload], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def sync(client: Bot, guild: Optional[Snowflake] = None, force=False) -> bool:
+    """Upload the command tree of one scope, if it changed since the last sync. Returns whether it was uploaded."""
+    digest = tree_hash(client, guild)
+    hashes = _hashes()
+
+    if not force and hashes.get(_scope(guild)) == digest:
+        _log.debug("Slash commands for scope %s are unchanged", _scope(guild))
+        return False
+
+    _log.info("Syncing slash commands for scope %s", _scope(guild))
+    await client.tree.sync(guild=guild)
+
+    hashes[_scope(guild)] = digest
+    Config("slash").save()
+    return True
+
+
+async def sync_all(client: Bot):
+    """Sync the global scope, and all guild scopes that have been synced before."""
+    await sync(client)
+
+    for scope in [s for s in _hashes() if s != "global"]:
+        await sync(client, guild=Object(int(scope)))
+
+
+async def clear(client: Bot, guild: Optional[Snowflake] = None):
+    """Remove all commands of one scope on Discord with a single bulk overwrite. The local tree is restored
+    afterwards, so the next sync uploads it again."""
+    commands = [command for kind in AppCommandType for command in client.tree.get_commands(guild=guild, type=kind)]
+    client.tree.clear_commands(guild=guild)
+    try:
+        await client.tree.sync(guild=guild)
+    finally:
+        for command in commands:
+            client.tree.add_command(command, guild=guild, override=True)
+
+    _hashes().pop(_scope(guild), None)
+    Config("slash").save()
@@ -0,0 +1,73 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+# SQLite document store, shared by all processes of a sharded bot (see cluster.py).
+# Every document is a json object with a version that is incremented on each write. Other processes notice
+# writes through SQLite's data_version, which is checked at most once per `refresh_interval`.
+
+_log = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+
+    def __init__(self, path: str, refresh_interval: float = 1.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS documents "
+                         "(name TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL)")
+        self._data_version = self._query_data_version()
+        self._checked = time.monotonic()
+
+    def get(self, name: str) -> Optional[Tuple[dict, int]]:
+        """Return the document and its version, or None if it does not exist."""
+        with self._lock:
+            row = self._db.execute("SELECT data, version FROM documents WHERE name = ?", (name,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def update(self, name: str, update: Callable[[Optional[dict]], dict]) -> Tuple[dict, int]:
+        """Atomically replace a document with the result of `update`, which is called with the stored document
+        (or None). No other process can write in between. Returns the new document and its version."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT data, version FROM documents WHERE name = ?", (name,)).fetchone()
+                data = update(json.loads(row[0]) if row else None)
+                version = row[1] + 1 if row else 1
+                self._db.execute("INSERT OR REPLACE INTO documents (name, data, version) VALUES (?, ?, ?)",
+                                 (name, json.dumps(data), version))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            # Our own writes don't change the data_version of this connection, so nothing to refresh
+        return data, version
+
+    def changed(self) -> bool:
+        """Whether another process wrote to the store since the last call. Cheap to call often."""
+        now = time.monotonic()
+        if now - self._checked < self.refresh_interval:
+            return False
+        self._checked = now
+
+        with self._lock:
+            version = self._query_data_version()
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        return True
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query_data_version(self) -> int:
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
@@ -0,0 +1,154 @@
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+import uuid
+from typing import Deque, List, Optional
+
+# Lightweight tracing. Each sampled command gets a root span, and calls to external services and message sends
+# within it add child spans. Finished traces are kept in memory for the `traces` admin command, and exported
+# as one json line each to a rotating file in the data directory.
+# Outside of a sampled trace, opening a span costs one context variable lookup.
+
+_log = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+# Share of the commands that are traced, see configure()
+sample_rate = 0.2
+recent: Deque["Span"] = collections.deque(maxlen=500)
+
+_exporter: Optional[logging.Logger] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class Span:
+    __slots__ = ["name", "trace_id", "attributes", "start", "duration", "error", "children"]
+
+    def __init__(self, name: str, trace_id: str, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List[Span] = []
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.time() - self.start
+        if error:
+            self.error = error.__class__.__name__
+
+    def to_dict(self) -> dict:
+        result = {
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+        }
+        if self.attributes:
+            result["attributes"] = self.attributes
+        if self.error:
+            result["error"] = self.error
+        if self.children:
+            result["children"] = [child.to_dict() for child in self.children]
+        return result
+
+    def summary(self) -> str:
+        """Total time per child span name, e.g. "lastfm 812ms (2x), spotify 95ms (1 failed)"."""
+        totals, counts = {}, collections.Counter()
+        for child in self.children:
+            totals[child.name] = totals.get(child.name, 0.0) + (child.duration or 0.0)
+            counts[child.name] += 1
+
+        errors = collections.Counter(child.name for child in self.children if child.error)
+        return ", ".join(f"{name} {total * 1000:.0f}ms" + (f" ({counts[name]}x)" if counts[name] > 1 else "")
+                         + (f" ({errors[name]} failed)" if errors[name] else "")
+                         for name, total in sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def start_trace(name: str, **attributes) -> Optional[Span]:
+    """Start a new trace in the current context, if it gets sampled. Must be finished with :func:`finish_trace`."""
+    if random.random() >= sample_rate:
+        return None
+
+    root = Span(name, uuid.uuid4().hex, **attributes)
+    _current.set(root)
+    return root
+
+
+def finish_trace(root: Optional[Span]):
+    if not root:
+        return
+
+    root.finish()
+    if _current.get() is root:
+        _current.set(None)
+
+    recent.append(root)
+    if _exporter:
+        _exporter.info(json.dumps({"trace_id": root.trace_id, **root.to_dict()}))
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Record the enclosed block as a child of the current span, if there is a sampled trace."""
+    parent = _current.get()
+    if not parent:
+        yield None
+        return
+
+    child = Span(name, parent.trace_id, **attributes)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.finish(e)
+        raise
+    else:
+        child.finish()
+    finally:
+        _current.reset(token)
+
+
+def slowest(count: int = 10) -> List[Span]:
+    return sorted(recent, key=lambda s: s.duration or 0.0, reverse=True)[:count]
+
+
+def configure():
+    """Read the sample rate from TRACE_SAMPLE_RATE. Called on startup, after the .env file was loaded."""
+    global sample_rate
+    sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", sample_rate))
+
+
+def setup_export(path: str, max_bytes: int = 5 * 1024 * 1024, backups: int = 3):
+    """Export finished traces to a rotating jsonl file. The file is written from a background thread."""
+    global _exporter, _listener
+    if _listener:
+        return
+
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+
+    _exporter = logging.getLogger("damabot.traces")
+    _exporter.propagate = False
+    _exporter.setLevel(logging.INFO)
+    _exporter.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def stop_export():
+    global _exporter, _listener
+    if _listener:
+        _listener.stop()
+        _exporter.handlers.clear()
+    _exporter = _listener = None
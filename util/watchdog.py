@@ -0,0 +1,95 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+
+from util.profiler import format_stack
+
+# Event loop watchdog. A heartbeat task measures how late the loop wakes it up (the loop lag), and a
+# helper thread checks that the heartbeat keeps coming. If it stops for longer than the threshold, something
+# is blocking the loop, and the thread logs the current stack of the loop thread to pinpoint it.
+
+_log = logging.getLogger(__name__)
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+
+class Watchdog:
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, history: int = 3000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = collections.deque(maxlen=history)
+        self.blocked = 0
+
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._context: Dict[asyncio.Task, str] = weakref.WeakKeyDictionary()
+
+    def start(self):
+        """Start watching the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+
+        self._task = self._loop.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    def set_context(self, description: str):
+        """Describe what the current task is doing, e.g. which command it runs. Included in the blocking reports."""
+        task = asyncio.current_task()
+        if task:
+            self._context[task] = description
+
+    def clear_context(self):
+        self._context.pop(asyncio.current_task(), None)
+
+    def percentiles(self) -> Dict[str, float]:
+        """Loop lag percentiles in seconds over the recent history."""
+        lags = list(self.lags)
+        return {f"p{pct}": percentile(lags, pct) for pct in (50, 90, 99)} | {"max": max(lags, default=0.0)}
+
+    async def _beat(self):
+        while True:
+            before = self._loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, self._loop.time() - before - self.interval))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+
+            # Only report once per blocking call
+            if stalled < self.threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            self.blocked += 1
+
+            frame = sys._current_frames().get(self._loop_thread)
+            task = asyncio.current_task(self._loop)
+            context = self._context.get(task, "no command") if task else "no task"
+            _log.warning("Event loop blocked for over %.0fms during %s, at:\n%s",
+                         stalled * 1000, context, format_stack(frame) if frame else "  unknown")